@@ -0,0 +1,588 @@
+"""
+ancillary.py
+
+Local (client-side) atmospheric correction inputs, i.e. water vapour, ozone
+and aerosol optical thickness, computed with the same time steps and
+fallbacks as atmospheric.Atmospheric:
+
+  h2o - NCEP_RE/surface_wv at the closest 6 hour step
+  o3  - TOMS/MERGED at the closest day, or the day-of-year ozone fill
+        (e.g. in the 1994-11 to 1996-08 TOMS gap, or where data are missing)
+  aot - MODIS/006/MOD08_M3 of the closest month, or the monthly AOT fill
+        (e.g. before 2000-03)
+
+Values per dataset time step come from a backend:
+
+  AncillaryCache   - values retrieved from Earth Engine, kept on disk (they
+                     never change after publication) so repeat runs at known
+                     sites need no ancillary requests
+  GriddedAncillary - local grids (npz, or NetCDF/Zarr if xarray is installed)
+                     sampled with bilinear interpolation, i.e. offline
+
+Requests only consume values that are already local: fetch them first (an
+explicit step, i.e. Earth Engine round trips) then build an AncillaryTable
+(keyed by the time steps of atmospheric.Atmospheric, no requests at all)
+
+Usage
+cache = AncillaryCache()
+cache.prefetch(lon, lat, '2000-01-01', '2018-01-01')
+h2o, o3, aot = cache.inputs(lon, lat, times)  # times in milliseconds
+table = cache.table(lon, lat, '2016-01-01', '2017-01-01')
+request_meanRadiance(geom, '2016-01-01', '2017-01-01', mission, True, ancillary_table=table)
+
+grids = GriddedAncillary('/data/ancillary')
+h2o, o3, aot = grids.inputs(lons, lats, times)  # arrays of scenes
+"""
+
+import os
+import pickle
+import threading
+import datetime
+import calendar
+import glob
+from abc import ABC, abstractmethod
+import numpy as np
+import ee
+from atmcorr.atmospheric import Atmospheric, AncillaryLookup
+from atmcorr.interpolated_lookup_tables import atomic_pickle_dump
+from atmcorr.retrieval import date_chunks
+
+# Earth Engine datasets
+DATASETS = {
+  'water':'NCEP_RE/surface_wv',
+  'ozone':'TOMS/MERGED',
+  'ozone_fill':'users/samsammurphy/public/ozone_fill',
+  'aerosol':'MODIS/006/MOD08_M3',
+  'aerosol_fill':'users/samsammurphy/public/AOT_stack'
+}
+
+# Earth Engine band names
+BANDS = {
+  'water':'pr_wtr',
+  'ozone':'ozone',
+  'ozone_fill':'ozone',
+  'aerosol':'Aerosol_Optical_Depth_Land_Mean_Mean_550'
+}
+
+# leading axis of local grids (time steps in ms, fill index or month 1-12)
+GRID_KEYS = {
+  'water':'time',
+  'ozone':'time',
+  'ozone_fill':'index',
+  'aerosol':'time',
+  'aerosol_fill':'month'
+}
+
+# local grid formats
+GRID_EXTENSIONS = ['.npz', '.nc', '.zarr']
+
+HOUR = 3600000
+DAY = 24 * HOUR
+
+def to_millis(date):
+  """
+  'YYYY-MM-DD' to milliseconds since 1970-01-01 (UTC)
+  """
+  return calendar.timegm(datetime.datetime.strptime(date, '%Y-%m-%d').timetuple()) * 1000
+
+# TOMS temporal gap [start, end) and start of MODIS
+TOMS_GAP = (to_millis('1994-11-01'), to_millis('1996-08-01'))
+MODIS_START = to_millis('2000-03-01')
+
+def round_date(t, xhour):
+  """
+  rounds times (ms) to the closest 'x' hours (of the hour of day)
+  """
+  t = np.asarray(t, dtype='int64')
+  day = t - t % DAY
+  hour = (t % DAY) // HOUR
+  return day + np.floor(hour / xhour + 0.5).astype('int64') * xhour * HOUR
+
+def month_start(t, months=0):
+  """
+  start of the month of times (ms), optionally advanced by a number of months
+  """
+  m = np.asarray(t, dtype='int64').astype('datetime64[ms]').astype('datetime64[M]') + months
+  return m.astype('datetime64[ms]').astype('int64')
+
+def round_month(t):
+  """
+  rounds times (ms) to the closest start of month
+  """
+  t = np.asarray(t, dtype='int64')
+  m1 = month_start(t)
+  m2 = month_start(t, 1)
+  return np.where(np.abs(m2 - t) > np.abs(t - m1), m1, m2)
+
+def advance_month(t):
+  """
+  times (ms) advanced by one calendar month (clamped to the end of month)
+  """
+  t = np.asarray(t, dtype='int64')
+  offset = t - month_start(t)
+  return np.minimum(month_start(t, 1) + offset, month_start(t, 2) - 1)
+
+def month_of_year(t):
+  """
+  month (1-12) of times (ms)
+  """
+  m = np.asarray(t, dtype='int64').astype('datetime64[ms]').astype('datetime64[M]').astype('int64')
+  return m % 12 + 1
+
+def ozone_fill_index(t, O3_date):
+  """
+  index of the ozone fill image (i.e. day of year - 1) as in Atmospheric.ozone,
+  negative indices count from the end of the 366 day list
+  """
+  jan01 = np.asarray(O3_date, dtype='int64').astype('datetime64[ms]').astype('datetime64[Y]')
+  jan01 = jan01.astype('datetime64[ms]').astype('int64')
+  index = np.trunc((np.asarray(t, dtype='int64') - jan01) / DAY).astype('int64')
+  return np.where(index < 0, index + 366, index)
+
+def truthy(x):
+  """
+  Earth Engine truthiness of numbers (i.e. not null and not zero)
+  """
+  return np.isfinite(x) & (x != 0)
+
+def as_datetime(t, unit):
+  return np.asarray(t, dtype='int64').astype('datetime64[ms]').astype('datetime64[{}]'.format(unit))
+
+def water_keys(t):
+  """
+  Atmospheric.water_key of times (ms), i.e. NCEP 6 hour step ('YYYY-MM-DDTHH')
+  """
+  return np.datetime_as_string(as_datetime(round_date(t, 6), 'h'))
+
+def ozone_keys(t):
+  """
+  Atmospheric.ozone_key of times (ms), i.e. TOMS/OMI day and fill value day
+  """
+  O3_date = np.datetime_as_string(as_datetime(round_date(t, 24), 'D'))
+  return np.char.add(np.char.add(O3_date, '/'), np.datetime_as_string(as_datetime(t, 'D')))
+
+def aerosol_keys(t):
+  """
+  Atmospheric.aerosol_key of times (ms), i.e. MODIS month (or 'fill') and fill month
+  """
+  t = np.asarray(t, dtype='int64')
+  modis = np.where(t > MODIS_START, np.datetime_as_string(as_datetime(round_month(t), 'M')), 'fill')
+  return np.char.add(np.char.add(modis, '/'), month_of_year(t).astype(str))
+
+
+class AncillaryBackend(ABC):
+  """
+  Source of ancillary values per dataset time step, subclasses implement
+
+  steps(dataset, start, stop) - sorted time steps (ms) of a dataset
+  values(dataset, lon, lat, keys) - values (NaN if missing) where keys are
+    time steps (ms), ozone fill indices or AOT fill months (1-12)
+  """
+
+  @abstractmethod
+  def steps(self, dataset, start, stop):
+    pass
+
+  @abstractmethod
+  def values(self, dataset, lon, lat, keys):
+    pass
+
+  def first_step_values(self, dataset, lon, lat, start, end):
+    """
+    values of the first time step in [start, end) (i.e. ee filterDate().first())
+    """
+    steps = np.asarray(self.steps(dataset, int(start.min()), int(end.max())), dtype='int64')
+    out = np.full(start.shape, np.nan)
+    if len(steps) == 0:
+      return out
+    i = np.minimum(np.searchsorted(steps, start), len(steps) - 1)
+    ok = (steps[i] >= start) & (steps[i] < end)
+    if ok.any():
+      out[ok] = self.values(dataset, lon[ok], lat[ok], steps[i][ok])
+    return out
+
+  def inputs(self, lon, lat, times):
+    """
+    h2o [g/cm^2], o3 [atm-cm] and aot arrays for arrays of location and
+    acquisition time (ms), following the logic of atmospheric.Atmospheric
+    """
+
+    t = np.atleast_1d(np.asarray(times, dtype='int64'))
+    lon, lat = [np.broadcast_to(np.asarray(x, dtype=float), t.shape) for x in [lon, lat]]
+
+    # water vapour (6 hour steps, Google = kg/m^2, Py6S = g/cm^2)
+    H2O_date = round_date(t, 6)
+    h2o = self.first_step_values('water', lon, lat, H2O_date, advance_month(H2O_date)) / 10
+
+    # ozone (24 hour steps, else fill value)
+    O3_date = round_date(t, 24)
+    fill = self.values('ozone_fill', lon, lat, ozone_fill_index(t, O3_date))
+    toms = self.first_step_values('ozone', lon, lat, O3_date, advance_month(O3_date))
+    in_gap = (O3_date >= TOMS_GAP[0]) & (O3_date < TOMS_GAP[1])
+    o3 = np.where(in_gap | ~truthy(toms), fill, toms)
+    o3 = np.where(truthy(o3), o3, fill) / 1000 # (i.e. Dobson units are milli-atm-cm)
+
+    # aerosol optical thickness (monthly, else fill value)
+    aot_fill = self.values('aerosol_fill', lon, lat, month_of_year(t))
+    modis_date = round_month(t)
+    modis = self.first_step_values('aerosol', lon, lat, modis_date, modis_date + 1) / 1000
+    aot = np.where((t > MODIS_START) & truthy(modis), modis, aot_fill)
+
+    return h2o, o3, aot
+
+  def table_values(self, lon, lat, startDate, stopDate):
+    """
+    {key:value} of h2o, o3 and aot for every time step key (see
+    atmospheric.Atmospheric.water_key etc.) that acquisitions in
+    [startDate, stopDate) at a location can use, missing values are left out
+    """
+
+    # 6 hourly times, i.e. every water, ozone and aerosol key (and the next
+    # day's 00:00, as later acquisitions round up to it)
+    t = np.arange(to_millis(startDate), to_millis(stopDate) + 1, 6 * HOUR, dtype='int64')
+    h2o, o3, aot = AncillaryBackend.inputs(self, lon, lat, t)
+
+    def table(keys, values):
+      return {str(k):float(v) for k, v in zip(keys, values) if np.isfinite(v)}
+
+    return table(water_keys(t), h2o), table(ozone_keys(t), o3), table(aerosol_keys(t), aot)
+
+  def table(self, lon, lat, startDate, stopDate):
+    """
+    AncillaryTable for requests in [startDate, stopDate) at a location
+    (no Earth Engine requests)
+    """
+    return AncillaryTable(*self.table_values(lon, lat, startDate, stopDate))
+
+
+class AncillaryTable:
+  """
+  Server-side lookup of precomputed ancillary values by time step (i.e. the
+  keys of atmospheric.AncillaryLookup), used in place of its reductions
+  """
+
+  def __init__(self, h2o, o3, aot):
+    self.h2o = ee.Dictionary(h2o)
+    self.o3 = ee.Dictionary(o3)
+    self.aot = ee.Dictionary(aot)
+
+  def water(self, image):
+    return AncillaryLookup.get(self.h2o, Atmospheric.water_key(AncillaryLookup.date(image)))
+
+  def ozone(self, image):
+    return AncillaryLookup.get(self.o3, Atmospheric.ozone_key(AncillaryLookup.date(image)))
+
+  def aerosol(self, image):
+    return AncillaryLookup.get(self.aot, Atmospheric.aerosol_key(AncillaryLookup.date(image)))
+
+
+class AncillaryCache(AncillaryBackend):
+  """
+  Persistent local cache of ancillary values retrieved from Earth Engine,
+  keyed by dataset, time step and location (quantized to 'precision'
+  decimal places of lon/lat, i.e. values are sampled at the quantized point)
+
+  Missing date ranges are fetched in bulk (one request per year of data) by
+  prefetch() (or inputs()), table() only reads date ranges already fetched.
+  """
+
+  def __init__(self, path=None, precision=2):
+
+    if not path:
+      basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+      path = os.path.join(basedir,'files','ancillary','cache.pkl')
+    self.path = path
+    self.precision = precision
+
+    # fetched [start, stop) ranges per location, values per (dataset, location)
+    self.ranges = {}
+    self.data = {}
+    self.all_steps = {'water':set(), 'ozone':set(), 'aerosol':set()}
+    self.lock = threading.RLock()
+
+    if os.path.isfile(path):
+      self.load()
+
+  def location(self, lon, lat):
+    return (round(float(lon), self.precision), round(float(lat), self.precision))
+
+  def steps(self, dataset, start, stop):
+    with self.lock:
+      return sorted(t for t in self.all_steps[dataset] if start <= t < stop)
+
+  def values(self, dataset, lon, lat, keys):
+    out = np.full(np.shape(keys), np.nan)
+    for i, (x, y, key) in enumerate(zip(np.ravel(lon), np.ravel(lat), np.ravel(keys))):
+      value = self.data.get((dataset,) + self.location(x, y), {}).get(int(key))
+      if value is not None:
+        out.flat[i] = value
+    return out
+
+  def missing_ranges(self, location, start, stop):
+    """
+    parts of [start, stop) not yet fetched for a location
+    """
+    missing = []
+    for a, b in sorted(self.ranges.get(location, [])):
+      if b <= start or a >= stop:
+        continue
+      if a > start:
+        missing.append((start, a))
+      start = max(start, b)
+    if start < stop:
+      missing.append((start, stop))
+    return missing
+
+  def request(self, lon, lat, start, stop, fills=False):
+    """
+    Earth Engine request for all ancillary time steps at a point
+    """
+
+    point = ee.Geometry.Point(lon, lat)
+
+    def sample(dataset):
+      def value(img):
+        return ee.Feature(None, {
+          'dataset':dataset,
+          'key':img.get('system:time_start'),
+          'value':img.reduceRegion(reducer=ee.Reducer.mean(), geometry=point).get(BANDS[dataset])
+        })
+      ic = ee.ImageCollection(DATASETS[dataset]).filterDate(ee.Date(start), ee.Date(stop))
+      return ee.FeatureCollection(ic.map(value))
+
+    fc = sample('water').merge(sample('ozone')).merge(sample('aerosol'))
+
+    if fills:
+      ozone_fills = ee.ImageCollection(DATASETS['ozone_fill']).toList(366)
+      def ozone_fill(i):
+        img = ee.Image(ozone_fills.get(i))
+        return ee.Feature(None, {'dataset':'ozone_fill', 'key':i,\
+          'value':img.reduceRegion(reducer=ee.Reducer.mean(), geometry=point).get(BANDS['ozone_fill'])})
+      aot_fills = ee.Image(DATASETS['aerosol_fill']).reduceRegion(reducer=ee.Reducer.mean(), geometry=point)
+      fc = fc.merge(ee.FeatureCollection(ee.List.sequence(0,365).map(ozone_fill)))\
+             .merge(ee.FeatureCollection([ee.Feature(None, {'dataset':'aerosol_fill', 'key':m,\
+               'value':aot_fills.get('AOT_{}'.format(m))}) for m in range(1,13)]))
+
+    return fc
+
+  def prefetch(self, lon, lat, startDate, stopDate, chunk_days=365):
+    """
+    fetches (in bulk) every ancillary time step needed for acquisitions
+    in [startDate, stopDate) at a location that is not already cached
+    """
+
+    location = self.location(lon, lat)
+    start, stop = to_millis(startDate) - DAY, advance_month(to_millis(stopDate) + DAY).item()
+
+    with self.lock:
+
+      fills = (('ozone_fill',) + location) not in self.data
+      missing = self.missing_ranges(location, start, stop)
+      if not missing and not fills:
+        return
+
+      # fill values (once per location) come with the first chunk
+      for a, b in missing or [(start, start)]:
+        chunks = date_chunks(self.format(a), self.format(b), chunk_days) or [(self.format(a),)*2]
+        for chunk in chunks:
+          print('Fetching ancillary data {} to {} at {}'.format(chunk[0], chunk[1], location))
+          features = self.request(location[0], location[1], to_millis(chunk[0]), to_millis(chunk[1]),\
+                                  fills=fills).getInfo()['features']
+          fills = False
+          for feature in features:
+            p = feature['properties']
+            self.data.setdefault((p['dataset'],) + location, {})[int(p['key'])] = p.get('value')
+            if p['dataset'] in self.all_steps:
+              self.all_steps[p['dataset']].add(int(p['key']))
+        self.ranges.setdefault(location, []).append((to_millis(self.format(a)), to_millis(self.format(b))))
+
+      self.save()
+
+  def table_values(self, lon, lat, startDate, stopDate):
+    """
+    cached values only (see AncillaryBackend.table_values), the date range
+    must have been fetched with prefetch() first
+    """
+
+    location = self.location(lon, lat)
+    start, stop = to_millis(startDate) - DAY, advance_month(to_millis(stopDate) + DAY).item()
+
+    with self.lock:
+      if self.missing_ranges(location, start, stop) or (('ozone_fill',) + location) not in self.data:
+        raise ValueError('ancillary data {} to {} at {} not cached, call prefetch() first'\
+                         .format(startDate, stopDate, location))
+      return AncillaryBackend.table_values(self, lon, lat, startDate, stopDate)
+
+  def format(self, t):
+    """
+    milliseconds to 'YYYY-MM-DD' (i.e. day of t, or next day if not midnight)
+    """
+    day = -(-int(t) // DAY)
+    return datetime.datetime.utcfromtimestamp(day * DAY / 1000).strftime('%Y-%m-%d')
+
+  def inputs(self, lon, lat, times):
+    """
+    h2o, o3 and aot at locations (e.g. one site, or grid nodes) for
+    acquisition times (ms), fetching any ancillary data that are not
+    already cached
+    """
+
+    t = np.atleast_1d(np.asarray(times, dtype='int64'))
+    lon, lat = [np.broadcast_to(np.asarray(x, dtype=float), t.shape) for x in [lon, lat]]
+
+    # date range needed at each (quantized) location
+    ranges = {}
+    for x, y, time in zip(lon.ravel(), lat.ravel(), t.ravel()):
+      start, stop = ranges.get(self.location(x, y), (time, time))
+      ranges[self.location(x, y)] = (min(start, time), max(stop, time))
+    for (x, y), (start, stop) in ranges.items():
+      self.prefetch(x, y, self.format(start - DAY), self.format(stop + DAY))
+
+    return AncillaryBackend.inputs(self, lon, lat, t)
+
+  def save(self):
+    """
+    persists the cache to disk
+    """
+    directory = os.path.dirname(os.path.abspath(self.path))
+    if not os.path.isdir(directory):
+      os.makedirs(directory, exist_ok=True)
+    with self.lock:
+      atomic_pickle_dump({'precision':self.precision, 'ranges':self.ranges,\
+                          'data':self.data, 'all_steps':self.all_steps}, self.path)
+
+  def load(self):
+    with open(self.path, 'rb') as f:
+      cache = pickle.load(f)
+    if cache['precision'] != self.precision:
+      print('ancillary cache precision differs (ignoring): '+self.path)
+      return
+    self.ranges = cache['ranges']
+    self.data = cache['data']
+    self.all_steps = cache['all_steps']
+
+
+def save_grid(filepath, dataset, keys, lat, lon, values):
+  """
+  saves a local grid (.npz) of values (keys, lat, lon) for GriddedAncillary,
+  values in Earth Engine units (e.g. kg/m^2 water vapour, Dobson units ozone)
+  """
+  np.savez(filepath, **{GRID_KEYS[dataset]:np.asarray(keys), 'lat':np.asarray(lat, dtype=float),\
+                        'lon':np.asarray(lon, dtype=float), 'values':np.asarray(values, dtype=float)})
+
+def load_grid(filepath, dataset):
+  """
+  (keys, lat, lon, values) of a local grid, NetCDF and Zarr grids are read
+  with xarray (optional dependency) and use the dataset's band name (or
+  their only data variable)
+  """
+
+  key = GRID_KEYS[dataset]
+
+  if filepath.endswith('.npz'):
+    with np.load(filepath) as f:
+      keys, lat, lon, values = f[key], f['lat'], f['lon'], f['values']
+  else:
+    try:
+      import xarray as xr
+    except ImportError:
+      raise ImportError('xarray is required to read NetCDF/Zarr grids: '+filepath)
+    open_dataset = xr.open_zarr if filepath.endswith('.zarr') else xr.open_dataset
+    with open_dataset(filepath) as ds:
+      name = BANDS.get(dataset) if BANDS.get(dataset) in ds.data_vars else list(ds.data_vars)[0]
+      da = ds[name].transpose(key, 'lat', 'lon')
+      keys, lat, lon, values = da[key].values, da['lat'].values, da['lon'].values, da.values
+
+  # time steps in milliseconds
+  if np.issubdtype(np.asarray(keys).dtype, np.datetime64):
+    keys = keys.astype('datetime64[ms]').astype('int64')
+
+  return np.asarray(keys, dtype='int64'), np.asarray(lat, dtype=float),\
+         np.asarray(lon, dtype=float), np.asarray(values, dtype=float)
+
+
+class GriddedAncillary(AncillaryBackend):
+  """
+  Offline ancillary backend reading local grids from a directory, one file
+  per dataset named after it (e.g. water.npz, ozone.nc, aerosol_fill.zarr)
+  with a leading axis given by GRID_KEYS and (lat, lon) axes.
+
+  Grids are loaded on first use and sampled with (vectorized) bilinear 
+  interpolation, weighted over the corners that have data. Global grids 
+  wrap around in longitude.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.grids = {}
+    self.lock = threading.Lock()
+
+  def grid(self, dataset):
+    """
+    (keys, lat, lon, values, periodic) of a dataset, sorted by key, lat and lon
+    """
+
+    with self.lock:
+      if dataset not in self.grids:
+
+        filepaths = [f for ext in GRID_EXTENSIONS for f in glob.glob(os.path.join(self.path, dataset+ext))]
+        if not filepaths:
+          raise IOError('no local grid for {} in {}'.format(dataset, self.path))
+        keys, lat, lon, values = load_grid(filepaths[0], dataset)
+
+        k, y, x = np.argsort(keys), np.argsort(lat), np.argsort(lon)
+        keys, lat, lon, values = keys[k], lat[y], lon[x], values[k][:, y][:, :, x]
+
+        # global grids wrap around (e.g. NCEP 0 to 357.5 degrees)
+        periodic = len(lon) > 1 and (lon[-1] - lon[0]) + (lon[1] - lon[0]) >= 360 - 1e-6
+        if periodic:
+          lon = np.append(lon, lon[0] + 360)
+          values = np.concatenate([values, values[:, :, :1]], axis=2)
+
+        self.grids[dataset] = (keys, lat, lon, values, periodic)
+
+      return self.grids[dataset]
+
+  def steps(self, dataset, start, stop):
+    keys = self.grid(dataset)[0]
+    return keys[(keys >= start) & (keys < stop)]
+
+  def values(self, dataset, lon, lat, keys):
+
+    grid_keys, grid_lat, grid_lon, grid, periodic = self.grid(dataset)
+
+    keys = np.asarray(keys, dtype='int64')
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+
+    # leading axis
+    k = np.searchsorted(grid_keys, keys)
+    found = (k < len(grid_keys)) & (grid_keys[np.minimum(k, len(grid_keys) - 1)] == keys)
+    k = np.minimum(k, len(grid_keys) - 1)
+
+    # longitude convention of the grid (i.e. -180 to 180 or 0 to 360)
+    if periodic:
+      lon = (lon - grid_lon[0]) % 360 + grid_lon[0]
+
+    def cell(x, axis):
+      i = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, max(len(axis) - 2, 0))
+      j = np.minimum(i + 1, len(axis) - 1)
+      span = axis[j] - axis[i]
+      w = np.where(span > 0, (x - axis[i]) / np.where(span > 0, span, 1), 0)
+      return i, j, np.clip(w, 0, 1)
+
+    y0, y1, wy = cell(lat, grid_lat)
+    x0, x1, wx = cell(lon, grid_lon)
+
+    total = np.zeros(keys.shape)
+    weights = np.zeros(keys.shape)
+    for y, x, w in [(y0, x0, (1-wy)*(1-wx)), (y0, x1, (1-wy)*wx), (y1, x0, wy*(1-wx)), (y1, x1, wy*wx)]:
+      v = grid[k, y, x]
+      ok = np.isfinite(v) & (w > 0)
+      total += np.where(ok, v * w, 0)
+      weights += np.where(ok, w, 0)
+
+    # corners without data are ignored, NaN where none have data
+    out = np.where(weights > 0, total / np.where(weights > 0, weights, 1), np.nan)
+
+    return np.where(found, out, np.nan)
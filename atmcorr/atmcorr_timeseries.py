@@ -9,7 +9,16 @@ correction)
 """
 
 import math
+import numpy as np
 import atmcorr.mission_specifics as mission_s
+from atmcorr.coefficient_cache import band_key
+
+def elliptical_orbit_correction(day_of_year):
+  """
+  Adjusts perihelion correction coefficients for Earth's elliptical orbit
+  (works on scalars or numpy arrays of day of year)
+  """
+  return 0.03275104*np.cos(np.radians(np.asarray(day_of_year)/1.04137484)) + 0.96804905
 
 def atmcorr(radiance, perihelion, day_of_year):
   """
@@ -24,21 +33,42 @@ def atmcorr(radiance, perihelion, day_of_year):
   a = perihelion[0] * elliptical_orbit_correction
   b = perihelion[1] * elliptical_orbit_correction
 
-  # surface reflectance
+  # surface reflectance (NaN if missing or invalid, as in surface_reflectance_batch)
   try:
-    SR = (radiance - a) / b
+    SR = float((radiance - a) / b)
   except:
-    SR = None
+    SR = np.nan
 
   return SR
 
 
-def surface_reflectance_timeseries(meanRadiance, iLUTs, mission):
+# per-scene quality (see ee_requests.TimeSeries.qualityReduce)
+QUALITY = ['pixel_count','clear_fraction']
+
+def quality_columns(feature_collection):
+  """
+  per-scene quality columns, if the features have them
+  (i.e. clear pixel count is always present in quality mode)
+  """
+
+  if not any('pixel_count' in f['properties'] for f in feature_collection):
+    return {}
+
+  return {key:[f['properties'].get(key) for f in feature_collection] for key in QUALITY}
+
+
+def surface_reflectance_timeseries(meanRadiance, iLUTs, mission, batch=False, coefficient_cache=None):
   """
   Atmospherically corrects mean (cloud-free) pixel radiances
   returning a time series of surface reflectance values.
+
+  batch=True runs the vectorized engine (see surface_reflectance_batch)
+  coefficient_cache (optional) memoizes iLUT calls (see coefficient_cache.py)
   """
 
+  if batch:
+    return surface_reflectance_batch(meanRadiance, iLUTs, mission, coefficient_cache)
+
   feature_collection = meanRadiance['features']
   
   # band names 
@@ -46,21 +76,23 @@ def surface_reflectance_timeseries(meanRadiance, iLUTs, mission):
   py6s_bandnames = mission_s.py6s_bandnames(mission)
 
   # time series output variable
-  timeSeries = {'timeStamp':[], 'mission':mission}
+  timeSeries = {'timeStamp':[], 'imageID':[], 'mission':mission}
   for ee_bandname in ee_bandnames:
     timeSeries[ee_bandname] = []
   
   # atmospherically correct each scene in collection
   for feature in feature_collection:
     
-    # time stamp
+    # time stamp (and image)
     timeSeries['timeStamp'].append(feature['properties']['timeStamp'])
+    timeSeries['imageID'].append(feature['properties'].get('imageID'))
     
     # mean average pixel radiances
     mean_averages = feature['properties']['mean_averages']
 
-    # atmospheric correction inputs
-    atmcorr_inputs = feature['properties']['atmcorr_inputs']
+    # atmospheric correction inputs (missing values are NaN)
+    atmcorr_inputs = {key:np.nan if value is None else value \
+                      for key, value in feature['properties']['atmcorr_inputs'].items()}
     solar_z = atmcorr_inputs['solar_z'] # solar zenith [degrees]
     h2o = atmcorr_inputs['h2o']         # water vapour column
     o3 = atmcorr_inputs['o3']           # ozone
@@ -70,9 +102,119 @@ def surface_reflectance_timeseries(meanRadiance, iLUTs, mission):
 
     # atmospheric correction (each waveband)
     for i, ee_bandname in enumerate(ee_bandnames):
-      radiance = mean_averages[ee_bandname]
+      radiance = mean_averages.get(ee_bandname)
       iLUT = iLUTs.iLUTs[py6s_bandnames[i]]
-      perihelion = iLUT(solar_z, h2o, o3, aot, alt)
+      if coefficient_cache is None:
+        perihelion = iLUT(solar_z, h2o, o3, aot, alt)
+      else:
+        band = band_key(iLUTs, py6s_bandnames[i])
+        perihelion = coefficient_cache.lookup(band, iLUT, solar_z, h2o, o3, aot, alt)
       timeSeries[ee_bandname].append(atmcorr(radiance, perihelion, day_of_year))
 
-  return timeSeries
\ No newline at end of file
+  timeSeries.update(quality_columns(feature_collection))
+
+  return timeSeries
+
+
+def batch_inputs(feature_collection):
+  """
+  Gathers atmospheric correction inputs of every feature into one array
+
+  returns (inputs, day_of_year) where inputs has one row per feature and
+  columns (solar_z, h2o, o3, aot, alt), missing values are NaN
+  """
+
+  def column(key):
+    return np.array([f['properties']['atmcorr_inputs'].get(key) \
+                     for f in feature_collection], dtype=float)
+
+  inputs = np.column_stack([column(key) for key in ['solar_z','h2o','o3','aot','alt']])
+  day_of_year = column('doy')
+
+  return inputs, day_of_year
+
+
+def surface_reflectance_batch(meanRadiance, iLUTs, mission, coefficient_cache=None):
+  """
+  Vectorized version of surface_reflectance_timeseries.
+
+  Each waveband's iLUT is evaluated once for all scenes in the collection
+  and the elliptical orbit and (L - a) / b corrections are applied as array
+  operations. Failed values are NaN (as in the scalar engine).
+  """
+
+  feature_collection = meanRadiance['features']
+
+  # band names
+  ee_bandnames = mission_s.ee_bandnames(mission)
+  py6s_bandnames = mission_s.py6s_bandnames(mission)
+
+  # time series output variable
+  timeSeries = {
+    'timeStamp':[f['properties']['timeStamp'] for f in feature_collection],
+    'imageID':[f['properties'].get('imageID') for f in feature_collection],
+    'mission':mission
+  }
+
+  if not feature_collection:
+    for ee_bandname in ee_bandnames:
+      timeSeries[ee_bandname] = []
+    return timeSeries
+
+  # atmospheric correction inputs (one row per scene)
+  inputs, day_of_year = batch_inputs(feature_collection)
+  orbit_correction = elliptical_orbit_correction(day_of_year)
+
+  # atmospheric correction (each waveband, all scenes at once)
+  for i, ee_bandname in enumerate(ee_bandnames):
+    radiance = np.array([f['properties']['mean_averages'].get(ee_bandname) \
+                         for f in feature_collection], dtype=float)
+    iLUT = iLUTs.iLUTs[py6s_bandnames[i]]
+    if coefficient_cache is None:
+      perihelion = np.asarray(iLUT(inputs), dtype=float).reshape(-1, 2)
+    else:
+      band = band_key(iLUTs, py6s_bandnames[i])
+      perihelion = coefficient_cache.lookup_many(band, iLUT, inputs)
+    a = perihelion[:,0] * orbit_correction
+    b = perihelion[:,1] * orbit_correction
+    with np.errstate(divide='ignore', invalid='ignore'):
+      timeSeries[ee_bandname] = ((radiance - a) / b).tolist()
+
+  timeSeries.update(quality_columns(feature_collection))
+
+  return timeSeries
+
+
+def split_sites(meanRadiance):
+  """
+  Splits a multi-site feature collection (i.e. from request_meanRadiance_sites)
+  into one feature collection per 'site_id'
+  """
+
+  sites = {}
+  for feature in meanRadiance['features']:
+    site_id = feature['properties']['site_id']
+    sites.setdefault(site_id, {'features':[]})['features'].append(feature)
+
+  return sites
+
+
+def surface_reflectance_chunks(batches, iLUTs, mission, batch=False, coefficient_cache=None):
+  """
+  Atmospherically corrects an iterable of feature batches (e.g. date chunks
+  from retrieval.iter_meanRadiance) one batch at a time, so raw features
+  are only held in memory for the current batch.
+  """
+
+  timeSeries = {'timeStamp':[], 'imageID':[], 'mission':mission}
+  for ee_bandname in mission_s.ee_bandnames(mission):
+    timeSeries[ee_bandname] = []
+
+  for features in batches:
+    chunk = surface_reflectance_timeseries({'features':features}, iLUTs, mission,\
+      batch=batch, coefficient_cache=coefficient_cache)
+    for key, values in chunk.items():
+      if key != 'mission':
+        timeSeries.setdefault(key, []).extend(values)
+
+  return timeSeries
@@ -8,6 +8,13 @@ H2O = Atmospheric.water(geom,date)
 O3 = Atmospheric.ozone(geom,date)
 AOT = Atmospheric.aerosol(geom,date)
 
+Deduplicated lookups for an image collection (one reduction per distinct
+time step rather than per image)
+ancillary = AncillaryLookup(ic, geom)
+H2O = ancillary.water(image)
+O3 = ancillary.ozone(image)
+AOT = ancillary.aerosol(image)
+
 """
 
 
@@ -205,4 +212,96 @@ class Atmospheric():
     AOT = ee.Algorithms.If(AOT,AOT,get_AOT(aerosol_fill(date),geom))
     # i.e. check reduce region worked (else force fill value)
     
-    return AOT
\ No newline at end of file
+    return AOT
+
+
+  def water_key(date):
+    """
+    NCEP time step used for a date (i.e. 6 hour rounding)
+    """
+    return Atmospheric.round_date(date,6).format("YYYY-MM-dd'T'HH")
+
+
+  def ozone_key(date):
+    """
+    TOMS/OMI time step (i.e. 24 hour rounding) and fill value day of a date
+    """
+    return Atmospheric.round_date(date,24).format('YYYY-MM-dd').cat('/').cat(date.format('YYYY-MM-dd'))
+
+
+  def aerosol_key(date):
+    """
+    MODIS month (or 'fill' before MODIS) and fill value month of a date
+    """
+    after_modis_start = date.difference(ee.Date('2000-03-01'),'month').gt(0)
+    month = ee.Algorithms.If(after_modis_start, Atmospheric.round_month(date).format('YYYY-MM'), 'fill')
+    return ee.String(month).cat('/').cat(date.format('M'))
+
+
+class AncillaryLookup:
+  """
+  Water vapour, ozone and AOT for every image in a collection, looked up 
+  once per distinct (time step, centroid) rather than once per image.
+
+  Sentinel-2 tiles acquired minutes apart (or overlapping Landsat paths)
+  share the same NCEP, TOMS and MODIS time steps, so these reductions 
+  are only computed for the first image with each key and joined back to
+  the other images by key.
+  """
+
+  def __init__(self, ic, geom):
+
+    self.geom = geom
+    self.images = ic.size()
+    self.h2o, self.h2o_lookups = AncillaryLookup.table(ic, geom, Atmospheric.water_key, Atmospheric.water)
+    self.o3, self.o3_lookups = AncillaryLookup.table(ic, geom, Atmospheric.ozone_key, Atmospheric.ozone)
+    self.aot, self.aot_lookups = AncillaryLookup.table(ic, geom, Atmospheric.aerosol_key, Atmospheric.aerosol)
+
+  @staticmethod
+  def table(ic, geom, key, value):
+    """
+    dictionary of {key:value} for each distinct key in the collection
+    (and the number of distinct keys, i.e. of reductions)
+    """
+
+    def setKey(image):
+      return image.set('ancillary_key', key(ee.Date(image.get('system:time_start'))))
+
+    def lookup(image):
+      date = ee.Date(image.get('system:time_start'))
+      return ee.Feature(None, {'key':image.get('ancillary_key'), 'value':value(geom, date)})
+
+    distinct = ic.map(setKey).distinct('ancillary_key')
+    values = ee.FeatureCollection(distinct.map(lookup)).filter(ee.Filter.notNull(['value']))
+
+    return ee.Dictionary.fromLists(values.aggregate_array('key'), values.aggregate_array('value')), distinct.size()
+
+  @staticmethod
+  def date(image):
+    return ee.Date(image.get('system:time_start'))
+
+  @staticmethod
+  def get(table, key):
+    return ee.Algorithms.If(table.contains(key), table.get(key), None)
+
+  def water(self, image):
+    return AncillaryLookup.get(self.h2o, Atmospheric.water_key(AncillaryLookup.date(image)))
+
+  def ozone(self, image):
+    return AncillaryLookup.get(self.o3, Atmospheric.ozone_key(AncillaryLookup.date(image)))
+
+  def aerosol(self, image):
+    return AncillaryLookup.get(self.aot, Atmospheric.aerosol_key(AncillaryLookup.date(image)))
+
+  def report(self):
+    """
+    number of images, ancillary reductions and reductions saved
+    """
+
+    lookups = ee.Number(self.h2o_lookups).add(self.o3_lookups).add(self.aot_lookups)
+
+    return ee.Dictionary({
+      'images':self.images,
+      'lookups':lookups,
+      'lookups_saved':ee.Number(self.images).multiply(3).subtract(lookups)
+    })
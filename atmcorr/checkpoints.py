@@ -0,0 +1,136 @@
+"""
+checkpoints.py
+
+Resumable extraction, i.e. the features of each completed
+(target, mission, request settings, date chunk) are saved as soon as they arrive
+
+  files/checkpoints/<target>/<mission>/<settings>/<chunk start>_<chunk stop>.json
+
+so that a restarted run skips the chunks that are already done and
+reassembles the full time series from the store.
+
+<settings> is a hash of removeClouds and the request options (see
+options_hash), so a run with other cloud, prescreen or reduction settings
+never reuses chunks built with the old ones.
+
+Earth Engine keeps ingesting scenes for a while after acquisition, so chunks
+ending within settle_days of today are fetched but not saved (i.e. they are
+requested again on the next run). Older chunks are frozen once saved: use
+CheckpointStore.clear() to refetch them.
+
+Usage
+store = CheckpointStore()
+timeSeries(target, geom, startDate, stopDate, missions, checkpoints=store)
+"""
+
+import os
+import glob
+import json
+import hashlib
+import datetime
+from atmcorr.interpolated_lookup_tables import atomic_write
+from atmcorr.retrieval import date_chunks, iter_meanRadiance
+
+# request options that do not change the extracted features
+# (i.e. ancillary values are the same however they are looked up)
+NEUTRAL_OPTIONS = ['dedupe_ancillary', 'ancillary_table']
+
+def options_hash(removeClouds, request_options=None):
+  """
+  short hash of the settings that change the extracted features, i.e.
+  removeClouds and request options (e.g. cloud_options, prescreen, reduce_options)
+  """
+
+  options = {key:value for key, value in (request_options or {}).items() if key not in NEUTRAL_OPTIONS}
+  options['removeClouds'] = bool(removeClouds)
+  text = json.dumps(options, sort_keys=True, default=repr)
+
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+class CheckpointStore:
+  """
+  On-disk store of per-chunk mean radiance features (options is a settings
+  hash, see options_hash)
+  """
+
+  def __init__(self, path=None):
+
+    if not path:
+      basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+      path = os.path.join(basedir,'files','checkpoints')
+    self.path = path
+
+  def chunk_path(self, target, mission, chunk, options=''):
+    return os.path.join(self.path, target, mission, options, '{}_{}.json'.format(*chunk))
+
+  def has(self, target, mission, chunk, options=''):
+    return os.path.isfile(self.chunk_path(target, mission, chunk, options))
+
+  def save(self, target, mission, chunk, features, options=''):
+    """
+    saves the features of a completed chunk (atomically)
+    """
+
+    filepath = self.chunk_path(target, mission, chunk, options)
+    if not os.path.isdir(os.path.dirname(filepath)):
+      os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    atomic_write(filepath, lambda f: f.write(json.dumps(features).encode('utf-8')))
+
+  def load(self, target, mission, chunk, options=''):
+    with open(self.chunk_path(target, mission, chunk, options), 'rb') as f:
+      return json.loads(f.read().decode('utf-8'))
+
+  def chunks(self, target, mission, options=''):
+    """
+    completed chunks of a target, mission and settings (in date order)
+    """
+
+    filepaths = glob.glob(os.path.join(self.path, target, mission, options, '*.json'))
+
+    return sorted(tuple(os.path.basename(f)[:-len('.json')].split('_')) for f in filepaths)
+
+  def clear(self, target, mission=None):
+    """
+    deletes checkpoints of a target (or of one mission of a target),
+    whatever their settings
+    """
+
+    for pattern in [os.path.join(self.path, target, mission or '*', '*.json'),\
+                    os.path.join(self.path, target, mission or '*', '*', '*.json')]:
+      for filepath in glob.glob(pattern):
+        os.remove(filepath)
+
+
+def iter_checkpointed(store, target, geom, startDate, stopDate, mission, removeClouds=True,\
+                      chunk_days=365, request_options=None, settle_days=30, **kwargs):
+  """
+  Generator of (chunk, features) in date order, like retrieval.iter_meanRadiance,
+  except that completed chunks are read from the store and only missing
+  chunks are requested (and saved as soon as they arrive).
+
+  request_options the client was built with (chunks are kept per settings,
+  see options_hash), chunks ending within settle_days of today are not saved
+
+  kwargs are passed to retrieval.iter_meanRadiance (e.g. max_workers, client)
+  """
+
+  options = options_hash(removeClouds, request_options)
+  settled = (datetime.datetime.utcnow().date() - datetime.timedelta(days=settle_days)).isoformat()
+
+  chunks = date_chunks(startDate, stopDate, chunk_days)
+  missing = [chunk for chunk in chunks if not store.has(target, mission, chunk, options)]
+  print('{} {}: {} of {} chunks already done'.format(target, mission, len(chunks)-len(missing), len(chunks)))
+
+  fetched = iter_meanRadiance(geom, startDate, stopDate, mission, removeClouds,\
+                              chunks=missing, **kwargs)
+
+  for chunk in chunks:
+    if chunk in missing:
+      chunk, features = next(fetched)
+      if chunk[1] <= settled:
+        store.save(target, mission, chunk, features, options)
+      else:
+        print('{} {}: chunk {} to {} is recent (not saved)'.format(target, mission, *chunk))
+    else:
+      features = store.load(target, mission, chunk, options)
+    yield chunk, features
@@ -31,11 +31,18 @@ def ESAclouds(toa):
 
     return cloud
 
-def shadowMask(toa,cloudMask):
+def shadowMask(toa,cloudMask,geom=None,min_height=500,max_height=4000,height_count=8,skip_clear=False):
     """
     Finds cloud shadows in images
 
     Originally by Gennadii Donchyts, adapted by Ian Housman
+
+    Options (defaults are the original behaviour):
+      geom         - only project clouds within the maximum shadow length 
+                     of this geometry (i.e. clouds that can shade it)
+      min_height, max_height, height_count - cloud heights sampled (meters)
+      skip_clear   - no shadow projection if there are no (ESA) clouds 
+                     within the maximum shadow length of geom
     """
 
     def potentialShadow(cloudHeight):
@@ -54,7 +61,7 @@ def shadowMask(toa,cloudMask):
         y = azimuth.sin().multiply(shadowVector).divide(nominalScale).round()
 
         # affine translation of clouds
-        cloudShift = cloudMask.changeProj(cloudMask.projection(), cloudMask.projection().translate(x, y)) # could incorporate shadow stretch?
+        cloudShift = shadowedClouds.changeProj(cloudMask.projection(), cloudMask.projection().translate(x, y)) # could incorporate shadow stretch?
 
         return cloudShift
 
@@ -62,12 +69,23 @@ def shadowMask(toa,cloudMask):
     azimuth = ee.Number(toa.get('solar_azimuth')).multiply(math.pi).divide(180.0).add(ee.Number(0.5).multiply(math.pi))
     zenith  = ee.Number(0.5).multiply(math.pi ).subtract(ee.Number(toa.get('solar_zenith')).multiply(math.pi).divide(180.0))
 
+    # clouds that could cast shadows on the geometry
+    shadowedClouds = cloudMask
+    if geom is not None:
+        maxShadowLength = zenith.tan().abs().multiply(max_height)
+        region = ee.Geometry(geom).buffer(maxShadowLength)
+        shadowedClouds = cloudMask.clip(region)
+
     # find potential shadow areas based on cloud and solar geometry
     nominalScale = cloudMask.projection().nominalScale()
-    cloudHeights = ee.List.sequence(500,4000,500)        
+    cloudHeights = ee.List.sequence(min_height, max_height, None, height_count)
     potentialShadowStack = cloudHeights.map(potentialShadow)
     potentialShadow = ee.ImageCollection.fromImages(potentialShadowStack).max()
 
+    # (clipped clouds leave no shadow outside the buffered region)
+    if geom is not None:
+        potentialShadow = potentialShadow.unmask(0)
+
     # shadows are not clouds
     potentialShadow = potentialShadow.And(cloudMask.Not())
 
@@ -80,6 +98,13 @@ def shadowMask(toa,cloudMask):
     # might be scope for one last check here. Dark surfaces (e.g. water, basalt, etc.) cause shadow commission errors.
     # perhaps using a NDWI (e.g. green and nir)
 
+    # no clouds, no shadows
+    if skip_clear and geom is not None:
+        # (no 'clouds' key, e.g. the region is outside the image, is clear)
+        cloudy = shadowedClouds.rename(['clouds']).reduceRegion(reducer=ee.Reducer.max(), geometry=region,\
+                                                                scale=60, bestEffort=True).get('clouds', 0)
+        shadow = ee.Image(ee.Algorithms.If(cloudy, shadow, cloudMask.multiply(0).rename(['shadows'])))
+
     return shadow
 
 #
@@ -89,9 +114,34 @@ class CloudRemover:
   ESAclouds = ESAclouds
   shadowMask = shadowMask
 
-  def sentinel2mask(img):
+  def clouds(img, mission):
+    """
+    cloud flag (1 = cloud) of a mission's image (i.e. without shadows)
+    """
+
+    if mission.lower() == 'sentinel2':
+      return CloudRemover.ESAclouds(img)
+
+    return img.select('fmask').eq(4)
+
+  def cloudFraction(img, mission, geom, scale=300):
+    """
+    fraction of cloudy pixels in a geometry at a coarse scale (fast)
+    """
+
+    fraction = CloudRemover.clouds(img, mission).reduceRegion(\
+      reducer = ee.Reducer.mean(),\
+      geometry = geom,\
+      scale = scale,\
+      bestEffort = True)
+
+    return fraction.values().get(0)
+
+  def sentinel2mask(img, geom=None, **options):
     """
     Masks cloud (and shadow) pixels from Sentinel 2 image
+
+    geom and options are passed to shadowMask
     """
       
     # top of atmosphere reflectance
@@ -105,16 +155,18 @@ class CloudRemover:
     ESAcloud = CloudRemover.ESAclouds(toa)
 
     # Shadow
-    shadow = CloudRemover.shadowMask(toa, ESAcloud)
+    shadow = CloudRemover.shadowMask(toa, ESAcloud, geom, **options)
 
     # cloud and shadow mask
     mask = ESAcloud.Or(shadow).eq(0)
 
     return img.updateMask(mask)
   
-  def landsatMask(img):
+  def landsatMask(img, geom=None, **options):
     """
     Masks cloud (and shadow) pixels from Landsat images
+
+    (FMASK already includes shadows, i.e. options are not used)
     """
     
     # FMASK
@@ -129,7 +181,12 @@ class CloudRemover:
     
     return img.updateMask(cloudFree)
   
-  def fromMission(mission):
+  def fromMission(mission, geom=None, **options):
+    """
+    cloud (and shadow) masking function of a mission, e.g. 
+
+    CloudRemover.fromMission('Sentinel2', geom, height_count=4, skip_clear=True)
+    """
     
     switch = {
       'sentinel2': CloudRemover.sentinel2mask,
@@ -139,7 +196,12 @@ class CloudRemover:
       'landsat4': CloudRemover.landsatMask,
     }
 
-    return switch[mission.lower()]
+    mask = switch[mission.lower()]
+
+    if geom is None and not options:
+      return mask
+
+    return lambda img: mask(img, geom, **options)
 
 
   
@@ -0,0 +1,165 @@
+"""
+coefficient_cache.py
+
+Opt-in memoization of the 6S emulator, i.e. of (a, b) perihelion correction
+coefficients returned by iLUT(solar_z, h2o, o3, aot, alt).
+
+Inputs repeat heavily across scenes at one site (constant altitude, monthly
+AOT fill values, day-of-year ozone fill values) so they are quantized to a
+configurable resolution and the iLUT is evaluated at the quantized inputs.
+
+Usage
+cache = CoefficientCache(path='coefficients.cache')
+timeSeries(target, geom, startDate, stopDate, missions, coefficient_cache=cache)
+print(cache.stats())
+"""
+
+import os
+import pickle
+import threading
+from collections import OrderedDict
+import numpy as np
+from atmcorr.interpolated_lookup_tables import atomic_pickle_dump, registry
+
+# order of iLUT inputs
+INPUTS = ['solar_z','h2o','o3','aot','alt']
+
+# default quantization (i.e. degrees, g/cm^2, atm-cm, unitless, km)
+DEFAULT_RESOLUTION = {
+  'solar_z':0.1,
+  'h2o':0.01,
+  'o3':0.001,
+  'aot':0.001,
+  'alt':0.001
+}
+
+def band_key(iLUTs, py6s_bandname):
+  """
+  cache key of one waveband's iLUT, i.e. the registry key (sensor, aerosol
+  profile, view zenith, iLUT path, engine) and band, so that coefficients of
+  different engines or profiles never share a (persisted) cache entry
+  """
+  return registry.key(iLUTs) + (py6s_bandname,)
+
+class CoefficientCache:
+  """
+  Bounded (LRU) cache of perihelion correction coefficients keyed on
+  (band key, quantized solar_z, h2o, o3, aot, alt), see band_key()
+
+  resolution - dict of quantization step per input (or one step for all)
+  maxsize    - maximum number of cached coefficient pairs
+  path       - optional pickle file, loaded on creation and written by save()
+  """
+
+  def __init__(self, resolution=None, maxsize=100000, path=None):
+
+    if resolution is None:
+      resolution = DEFAULT_RESOLUTION
+    if not isinstance(resolution, dict):
+      resolution = {key:resolution for key in INPUTS}
+    self.resolution = np.array([resolution[key] for key in INPUTS], dtype=float)
+    self.maxsize = maxsize
+    self.path = path
+    self.cache = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+    if path and os.path.isfile(path):
+      self.load()
+
+  def quantize(self, inputs):
+    """
+    rounds inputs (..., 5) to the cache resolution
+    """
+    return np.round(np.asarray(inputs, dtype=float) / self.resolution) * self.resolution
+
+  def lookup(self, band, iLUT, solar_z, h2o, o3, aot, alt):
+    """
+    perihelion coefficients (a, b) for a single set of inputs
+    """
+    return self.lookup_many(band, iLUT, [[solar_z, h2o, o3, aot, alt]])[0]
+
+  def lookup_many(self, band, iLUT, inputs):
+    """
+    perihelion coefficients (n, 2) for an (n, 5) array of inputs, the iLUT
+    is called once for all distinct cache misses
+    """
+
+    inputs = self.quantize(np.asarray(inputs, dtype=float).reshape(-1, len(INPUTS)))
+    perihelion = np.full((len(inputs), 2), np.nan)
+
+    # inputs that are not finite are never cached
+    finite = np.isfinite(inputs).all(axis=1)
+    if not finite.all():
+      perihelion[~finite] = np.asarray(iLUT(inputs[~finite]), dtype=float).reshape(-1, 2)
+    if not finite.any():
+      return perihelion
+
+    rows, inverse = np.unique(inputs[finite], axis=0, return_inverse=True)
+    keys = [(band,) + tuple(row) for row in rows.tolist()]
+
+    # cache hits
+    values = [None] * len(keys)
+    with self.lock:
+      for i, key in enumerate(keys):
+        if key in self.cache:
+          self.cache.move_to_end(key)
+          values[i] = self.cache[key]
+    missing = [i for i, value in enumerate(values) if value is None]
+
+    # cache misses (one iLUT call)
+    if missing:
+      results = np.asarray(iLUT(rows[missing]), dtype=float).reshape(-1, 2)
+      with self.lock:
+        for i, result in zip(missing, results):
+          values[i] = (float(result[0]), float(result[1]))
+          self.cache[keys[i]] = values[i]
+        while len(self.cache) > self.maxsize:
+          self.cache.popitem(last=False)
+
+    # statistics are per scene (i.e. repeats within inputs are hits)
+    with self.lock:
+      self.misses += len(missing)
+      self.hits += int(finite.sum()) - len(missing)
+
+    perihelion[finite] = np.array(values)[inverse.ravel()]
+
+    return perihelion
+
+  def stats(self):
+    """
+    hit/miss counters and hit rate
+    """
+    requests = self.hits + self.misses
+    return {
+      'hits':self.hits,
+      'misses':self.misses,
+      'hit_rate':self.hits / requests if requests else 0.0,
+      'size':len(self.cache),
+      'maxsize':self.maxsize
+    }
+
+  def save(self, path=None):
+    """
+    persists cached coefficients to disk
+    """
+    path = path or self.path
+    with self.lock:
+      data = {'resolution':self.resolution.tolist(), 'cache':list(self.cache.items())}
+    atomic_pickle_dump(data, path)
+
+  def load(self, path=None):
+    """
+    loads cached coefficients (only if saved with the same resolution)
+    """
+    path = path or self.path
+    with open(path, 'rb') as f:
+      data = pickle.load(f)
+    if not np.allclose(data['resolution'], self.resolution):
+      print('coefficient cache resolution differs (ignoring): '+path)
+      return
+    with self.lock:
+      self.cache.update(data['cache'])
+      while len(self.cache) > self.maxsize:
+        self.cache.popitem(last=False)
@@ -0,0 +1,183 @@
+"""
+coefficients.py
+
+Atmospheric correction coefficients (a, b) per image and waveband for an
+image collection, i.e. surface reflectance = (radiance - a) / b
+
+  - iLUTs are loaded once (see interpolated_lookup_tables.registry)
+  - image metadata and atmospheric correction inputs of the whole
+    collection are fetched in one request
+  - coefficients are computed for all images at once (one iLUT call per band)
+  - output is JSON (records) or Parquet, one row per image
+  - optionally, corrected images are exported (see image_correction.py)
+
+Usage
+python -m atmcorr.coefficients --mission Sentinel2 --start 2016-11-19 --stop 2017-02-17 \
+  --rectangle 85.5268 25.6240 85.7263 25.8241 --output coefficients.parquet
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import ee
+from atmcorr.atmospheric import AncillaryLookup
+from atmcorr.atmcorr_timeseries import batch_inputs, elliptical_orbit_correction
+from atmcorr.interpolated_lookup_tables import atomic_write
+import atmcorr.interpolated_lookup_tables as iLUT
+import atmcorr.mission_specifics as mission_s
+
+def collection(geom, startDate, stopDate, mission):
+  """
+  image collection of the coefficients (and corrected images), i.e. every
+  image at the geometry (no sun angle filter)
+  """
+  return ee.ImageCollection(mission_s.eeCollection(mission)).filterBounds(geom).filterDate(startDate, stopDate)
+
+def request_inputs(geom, startDate, stopDate, mission, ancillary=None):
+  """
+  Earth Engine request for the atmospheric correction inputs of every image
+  in a collection (ancillary lookups are deduplicated per time step unless
+  an ancillary table of local values is given, see ancillary.AncillaryCache.table)
+
+  The altitude is the SRTM (CGIAR/SRTM90_V4) mean at the centroid
+  """
+
+  # creates Earth Engine objects on import (i.e. after ee.Initialize)
+  from atmcorr.ee_requests import AtmcorrInput, day_of_year
+
+  ic = collection(geom, startDate, stopDate, mission)
+  lookup = AncillaryLookup(ic, geom) if ancillary is None else ancillary
+
+  # i.e. Py6S uses units of kilometers
+  altitude = ee.Number(ee.Image('CGIAR/SRTM90_V4').reduceRegion(reducer=ee.Reducer.mean(),\
+                       geometry=geom.centroid()).get('elevation')).divide(1000)
+
+  def inputs(image):
+    date = ee.Date(image.get('system:time_start'))
+    properties = {
+      'imageID':image.get('system:index'),
+      'timeStamp':ee.Number(image.get('system:time_start')).divide(1000),
+      'atmcorr_inputs':AtmcorrInput.fromImage(image, mission, geom, date, day_of_year(date), lookup, altitude)
+    }
+    return ee.Feature(None, properties)
+
+  return ee.FeatureCollection(ic.map(inputs)).sort('timeStamp')
+
+def coefficients(features, iLUTs, mission):
+  """
+  data frame of atmospheric correction inputs and (elliptical orbit corrected)
+  coefficients '<band>_a' and '<band>_b' for each feature (i.e. image)
+  """
+
+  ee_bandnames = mission_s.ee_bandnames(mission)
+  py6s_bandnames = mission_s.py6s_bandnames(mission)
+
+  df = pd.DataFrame({
+    'imageID':[f['properties'].get('imageID') for f in features],
+    'timeStamp':[f['properties']['timeStamp'] for f in features],
+    'mission':mission
+  })
+
+  inputs, doy = batch_inputs(features)
+  for i, key in enumerate(['solar_z','h2o','o3','aot','alt']):
+    df[key] = inputs[:,i]
+  df['doy'] = doy
+
+  if not features:
+    for ee_bandname in ee_bandnames:
+      df[ee_bandname+'_a'] = []
+      df[ee_bandname+'_b'] = []
+    return df
+
+  # one iLUT call per waveband for all images
+  orbit_correction = elliptical_orbit_correction(doy)
+  for ee_bandname, py6s_bandname in zip(ee_bandnames, py6s_bandnames):
+    perihelion = np.asarray(iLUTs.iLUTs[py6s_bandname](inputs), dtype=float).reshape(-1, 2)
+    df[ee_bandname+'_a'] = perihelion[:,0] * orbit_correction
+    df[ee_bandname+'_b'] = perihelion[:,1] * orbit_correction
+
+  return df
+
+def write_coefficients(df, filepath):
+  """
+  writes coefficients as Parquet (.parquet) or JSON records (otherwise)
+  """
+
+  directory = os.path.dirname(os.path.abspath(filepath))
+  if not os.path.isdir(directory):
+    os.makedirs(directory, exist_ok=True)
+
+  if filepath.endswith('.parquet'):
+    atomic_write(filepath, lambda f: df.to_parquet(f, engine='pyarrow', index=False))
+  else:
+    atomic_write(filepath, lambda f: f.write(df.to_json(orient='records', indent=2).encode('utf-8')))
+
+def collection_coefficients(geom, startDate, stopDate, mission, path=False, engine='delaunay', ancillary=None):
+  """
+  atmospheric correction coefficients of every image in a collection
+  """
+
+  # interpolated lookup tables (loaded once per process)
+  iLUTs = iLUT.registry.get(mission, path=path, engine=engine)
+
+  features = request_inputs(geom, startDate, stopDate, mission, ancillary).getInfo()['features']
+  print('{} {} to {}: {} images'.format(mission, startDate, stopDate, len(features)))
+
+  return coefficients(features, iLUTs, mission)
+
+def parse_args(argv=None):
+
+  parser = argparse.ArgumentParser(description='Atmospheric correction coefficients of an image collection')
+  parser.add_argument('--mission', default='Sentinel2', choices=['Sentinel2','Landsat8','Landsat7','Landsat5','Landsat4'])
+  parser.add_argument('--start', required=True, help='start date (YYYY-MM-DD)')
+  parser.add_argument('--stop', required=True, help='stop date (YYYY-MM-DD, exclusive)')
+  location = parser.add_mutually_exclusive_group(required=True)
+  location.add_argument('--rectangle', nargs=4, type=float, metavar=('XMIN','YMIN','XMAX','YMAX'))
+  location.add_argument('--point', nargs=2, type=float, metavar=('LON','LAT'))
+  parser.add_argument('--output', default='coefficients.json', help='.json or .parquet file')
+  parser.add_argument('--ilut-path', default=False, help='directory of iLUT files (default: files/iLUTs)')
+  parser.add_argument('--engine', default='delaunay', choices=list(iLUT.ENGINES))
+  parser.add_argument('--ancillary-cache', default=None, help='local ancillary cache file (see ancillary.py)')
+  parser.add_argument('--export', action='store_true', help='export surface reflectance images (see image_correction.py)')
+  parser.add_argument('--folder', default=None, help='Google Drive folder of exports')
+  parser.add_argument('--scale', type=float, default=None, help='export scale in meters (default: nominal)')
+  parser.add_argument('--stack', action='store_true', help='one export of all scenes stacked as bands')
+  parser.add_argument('--dry-run', action='store_true', help='print the export plan without starting tasks')
+
+  return parser.parse_args(argv)
+
+def main(argv=None):
+
+  args = parse_args(argv)
+
+  ee.Initialize()
+
+  if args.rectangle:
+    geom = ee.Geometry.Rectangle(*args.rectangle)
+  else:
+    geom = ee.Geometry.Point(*args.point)
+
+  # ancillary values are fetched (if not cached yet) before the request is built
+  ancillary = None
+  if args.ancillary_cache:
+    from atmcorr.ancillary import AncillaryCache
+    lon, lat = args.point or [(args.rectangle[0] + args.rectangle[2]) / 2, (args.rectangle[1] + args.rectangle[3]) / 2]
+    cache = AncillaryCache(path=args.ancillary_cache)
+    cache.prefetch(lon, lat, args.start, args.stop)
+    ancillary = cache.table(lon, lat, args.start, args.stop)
+
+  df = collection_coefficients(geom, args.start, args.stop, args.mission,\
+                               path=args.ilut_path, engine=args.engine, ancillary=ancillary)
+
+  write_coefficients(df, args.output)
+  print('saved: '+args.output)
+
+  if args.export:
+    from atmcorr.image_correction import corrected_collection, export_corrected
+    ic = corrected_collection(geom, args.start, args.stop, args.mission, df)
+    export_corrected(ic, df, args.mission, geom, folder=args.folder, scale=args.scale,\
+                     stack=args.stack, dry_run=args.dry_run)
+
+if __name__ == '__main__':
+  main()
@@ -12,10 +12,46 @@ Returns a feature collection which could be input into, for exampled:
 """
 
 import ee
-from atmcorr.atmospheric import Atmospheric
+from atmcorr.atmospheric import Atmospheric, AncillaryLookup
 from atmcorr.cloudRemover import CloudRemover
 import atmcorr.mission_specifics as mission_s
 
+def day_of_year(date):
+  """
+  day of year of an ee.Date (i.e. Jan 1st = 1)
+  """
+  jan01 = ee.Date.fromYMD(date.get('year'),1,1)
+  return ee.Number(date.difference(jan01,'day')).add(1)
+
+def radiance_from_TOA(image, mission, day_of_year):
+  """
+  calculate at-sensor radiance from top-of-atmosphere (TOA) reflectance
+  """
+
+  # top of atmosphere reflectance
+  toa = mission_s.TOA(image, mission)
+
+  # solar irradiances
+  ESUNs = mission_s.ESUNs(image, mission)
+
+  # wavebands
+  bands = mission_s.ee_bandnames(mission)
+
+  # solar zenith (radians)
+  theta = mission_s.solar_z(image, mission).multiply(0.017453293)
+
+  # circular math
+  pi = ee.Number(3.14159265359)
+
+  # Earth-Sun distance squared (AU)
+  d = ee.Number(day_of_year).subtract(4).multiply(0.017202).cos().multiply(-0.01672).add(1)
+  d_squared = d.multiply(d)
+
+  # radiace at-sensor
+  rad = toa.select(ee.List(bands)).multiply(ESUNs).multiply(theta.cos()).divide(pi).divide(d_squared)
+
+  return rad
+
 class AtmcorrInput:
   """
   Grabs the inputs required for atmospheric correction with 6S emulator
@@ -24,20 +60,37 @@ class AtmcorrInput:
   # global elevation (kilometers)
   elevation = ee.Image('USGS/GMTED2010').divide(1000)
 
-  def get():
+  def fromImage(image, mission, geom, date, day_of_year, ancillary=None, altitude=None):
+    """
+    atmospheric correction inputs for an image at a given geometry
+
+    ancillary (optional) looks up h2o, o3 and aot by image, i.e. an
+    AncillaryLookup (deduplicated) or ancillary.AncillaryTable (precomputed)
+    altitude (optional) of the target in kilometers, default from GMTED2010
+    """
     
-    altitude = AtmcorrInput.elevation.reduceRegion(\
-        reducer = ee.Reducer.mean(),\
-        geometry = TimeSeries.geom.centroid()\
-        )
+    if altitude is None:
+      altitude = AtmcorrInput.elevation.reduceRegion(\
+          reducer = ee.Reducer.mean(),\
+          geometry = geom.centroid()\
+          ).get('be75')
+
+    if ancillary is None:
+      h2o = Atmospheric.water(geom,date)
+      o3 = Atmospheric.ozone(geom,date)
+      aot = Atmospheric.aerosol(geom,date)
+    else:
+      h2o = ancillary.water(image)
+      o3 = ancillary.ozone(image)
+      aot = ancillary.aerosol(image)
 
     return ee.Dictionary({
-      'solar_z':mission_s.solar_z(TimeSeries.image, TimeSeries.mission),
-      'h2o':Atmospheric.water(TimeSeries.geom,TimeSeries.date),
-      'o3':Atmospheric.ozone(TimeSeries.geom,TimeSeries.date),
-      'aot':Atmospheric.aerosol(TimeSeries.geom,TimeSeries.date),
-      'alt':altitude.get('be75'),
-      'doy':TimeSeries.day_of_year
+      'solar_z':mission_s.solar_z(image, mission),
+      'h2o':h2o,
+      'o3':o3,
+      'aot':aot,
+      'alt':altitude,
+      'doy':day_of_year
       })
   
 class TimeSeries:
@@ -46,104 +99,325 @@ class TimeSeries:
   contained within an earth engine geometry for all images in a collection,
   It also gathers the atmospheric correction input variables required to 
   get surface reflectance from at-sensor radiance.
+
+  Each request has its own TimeSeries instance (i.e. no shared state) so 
+  requests for many sites and missions can be built concurrently.
   """
 
-  def meanReduce(image, geom):
+  def __init__(self, geom, startDate, stopDate, mission, removeClouds):
+
+    # time and a place
+    self.geom = geom
+    self.startDate = startDate
+    self.stopDate = stopDate
+
+    # satellite mission
+    self.mission = mission
+
+    # cloud removal
+    self.removeClouds = removeClouds
+    self.cloudRemover = CloudRemover
+    self.cloud_options = {}
+
+    # reduction options (see meanReduce and qualityReduce)
+    self.reduce_options = {}
+
+    # scene pre-screening (optional, see TimeSeries.prescreen)
+    self.max_cloud_cover = None
+    self.max_cloud_fraction = None
+    self.cloud_fraction_scale = 300
+
+    # ancillary lookups (optional, see AncillaryLookup and ancillary.AncillaryTable)
+    self.ancillary = None
+
+  @staticmethod
+  def meanReduce(image, geom, scale=None, tileScale=1, bestEffort=False, maxPixels=None):
     """
     Calculates mean average pixel values in a geometry
     """    
     
     mean_averages = image.reduceRegion(\
           reducer = ee.Reducer.mean(),\
-          geometry = geom)
+          geometry = geom,\
+          scale = scale,\
+          tileScale = tileScale,\
+          bestEffort = bestEffort,\
+          maxPixels = maxPixels)
     
     return mean_averages
-   
-  def radianceFromTOA():
+
+  @staticmethod
+  def qualityReduce(radiance, image, geom, bands, stdDev=False, percentiles=None,\
+                    scale=None, tileScale=1, bestEffort=False, maxPixels=None):
     """
-    calculate at-sensor radiance from top-of-atmosphere (TOA) reflectance
+    Mean, valid (i.e. clear) pixel count and optionally standard deviation 
+    and percentiles of each band in a single reduceRegion pass.
+
+    The clear fraction is the clear pixel count (first band) over the count
+    of pixels in the scene footprint (i.e. before cloud masking)
     """
 
-    # top of atmosphere reflectance
-    toa = mission_s.TOA(TimeSeries.image, TimeSeries.mission)
+    reducer = ee.Reducer.mean().combine(ee.Reducer.count(), sharedInputs=True)
+    if stdDev:
+      reducer = reducer.combine(ee.Reducer.stdDev(), sharedInputs=True)
+    if percentiles:
+      reducer = reducer.combine(ee.Reducer.percentile(percentiles), sharedInputs=True)
 
-    # solar irradiances
-    ESUNs = mission_s.ESUNs(TimeSeries.image, TimeSeries.mission)
+    # scene footprint
+    footprint = image.select([bands[0]]).multiply(0).add(1).rename(['footprint'])
 
-    # wavebands
-    bands = mission_s.ee_bandnames(TimeSeries.mission)
+    stats = radiance.addBands(footprint).reduceRegion(\
+          reducer = reducer,\
+          geometry = geom,\
+          scale = scale,\
+          tileScale = tileScale,\
+          bestEffort = bestEffort,\
+          maxPixels = maxPixels)
 
-    # solar zenith (radians)
-    theta = mission_s.solar_z(TimeSeries.image, TimeSeries.mission).multiply(0.017453293)
+    def statistic(suffix):
+      keys = [band+'_'+suffix for band in bands]
+      return stats.select(keys).rename(keys, bands)
 
-    # circular math
-    pi = ee.Number(3.14159265359)
+    footprintCount = ee.Number(stats.get('footprint_count'))
+    clearCount = ee.Number(stats.get(bands[0]+'_count'))
 
-    # Earth-Sun distance squared (AU)
-    d = ee.Number(TimeSeries.day_of_year).subtract(4).multiply(0.017202).cos().multiply(-0.01672).add(1)
-    d_squared = d.multiply(d)
+    properties = {
+      'mean_averages':statistic('mean'),
+      'pixel_counts':statistic('count'),
+      'pixel_count':clearCount,
+      'clear_fraction':ee.Algorithms.If(footprintCount.gt(0), clearCount.divide(footprintCount), None)
+    }
+    if stdDev:
+      properties['std_devs'] = statistic('stdDev')
+    if percentiles:
+      properties['percentiles'] = stats.select(['{}_p{}'.format(band, p) for band in bands for p in percentiles])
 
-    # radiace at-sensor
-    rad = toa.select(ee.List(bands)).multiply(ESUNs).multiply(theta.cos()).divide(pi).divide(d_squared)
+    return properties
+   
+  @staticmethod
+  def cloudMasker(cloudRemover, mission, geom, cloud_options):
+    """
+    cloud masking function, cloud_options are passed to cloudRemover.shadowMask
+    except 'clip' (i.e. clip=True projects shadows only near the geometry)
+    """
 
-    return rad
+    options = dict(cloud_options or {})
+    clip = options.pop('clip', False)
+
+    return cloudRemover.fromMission(mission, geom if clip else None, **options)
+
+  def radianceFromTOA(self, image, day_of_year):
+    """
+    calculate at-sensor radiance from top-of-atmosphere (TOA) reflectance
+    """
+
+    return radiance_from_TOA(image, self.mission, day_of_year)
   
-  def extractor(image):
+  def extractor(self, image):
     
-    # update TimeSeries class
-    TimeSeries.image = image
-    TimeSeries.date = ee.Date(image.get('system:time_start'))
-    jan01 = ee.Date.fromYMD(TimeSeries.date.get('year'),1,1)
-    TimeSeries.day_of_year = ee.Number(TimeSeries.date.difference(jan01,'day')).add(1)
+    # date of image acquisition
+    date = ee.Date(image.get('system:time_start'))
+    doy = day_of_year(date)
     
     # remove clouds and shadows?
-    if TimeSeries.removeClouds:
-      cloudRemover = TimeSeries.cloudRemover.fromMission(TimeSeries.mission)
-      TimeSeries.image = cloudRemover(image)
+    masked = image
+    if self.removeClouds:
+      cloudRemover = TimeSeries.cloudMasker(self.cloudRemover, self.mission, self.geom, self.cloud_options)
+      masked = cloudRemover(image)
 
     # radiance at-sensor
-    radiance = TimeSeries.radianceFromTOA()
+    radiance = self.radianceFromTOA(masked, doy)
 
-    # mean average radiance
-    mean_averages = TimeSeries.meanReduce(radiance, TimeSeries.geom)
+    # mean average radiance (and quality, see qualityReduce)
+    options = dict(self.reduce_options)
+    quality = options.pop('quality', False)
+    stdDev = options.pop('stdDev', False)
+    percentiles = options.pop('percentiles', None)
+    if quality or stdDev or percentiles:
+      reduction = TimeSeries.qualityReduce(radiance, image, self.geom, \
+        mission_s.ee_bandnames(self.mission), stdDev, percentiles, **options)
+    else:
+      reduction = {'mean_averages':TimeSeries.meanReduce(radiance, self.geom, **options)}
 
     # atmospheric correction inputs
-    atmcorr_inputs = AtmcorrInput.get()
+    atmcorr_inputs = AtmcorrInput.fromImage(masked, self.mission, self.geom, date, doy, self.ancillary)
     
     # export to feature collection
     properties = {
       'imageID':image.get('system:index'),
       'timeStamp':ee.Number(image.get('system:time_start')).divide(1000),
-      'mean_averages':mean_averages,
       'atmcorr_inputs':atmcorr_inputs      
     }  
+    properties.update(reduction)
+
+    return ee.Feature(self.geom, properties)
+
+  def collection(self):
+    """
+    Earth Engine image collection for this request
+    """
 
-    return ee.Feature(TimeSeries.geom, properties)
+    return ee.ImageCollection(mission_s.eeCollection(self.mission))\
+      .filterBounds(self.geom)\
+      .filterDate(self.startDate, self.stopDate)\
+      .filter(mission_s.sunAngleFilter(self.mission))
 
-def request_meanRadiance(geom, startDate, stopDate, mission, removeClouds):
+  def prescreen(self, ic):
+    """
+    Drops scenes that are too cloudy before extraction, using
+    
+      - scene metadata (cloud cover percent > max_cloud_cover) and/or
+      - a coarse cloud fraction over the geometry (> max_cloud_fraction)
+    
+    Scenes without cloud information are kept. Returns the screened 
+    collection and a report of scenes skipped (ee.Dictionary)
+    """
+
+    def atMost(prop, maximum):
+      return ee.Filter.Or(ee.Filter.lte(prop, maximum), ee.Filter.notNull([prop]).Not())
+
+    scenes = ic.size()
+
+    if self.max_cloud_cover is not None:
+      ic = ic.filter(atMost(mission_s.cloudCoverProperty(self.mission), self.max_cloud_cover))
+    metadata = ic.size()
+
+    if self.max_cloud_fraction is not None:
+      def setCloudFraction(image):
+        return image.set('cloud_fraction', self.cloudRemover.cloudFraction(\
+          image, self.mission, self.geom, self.cloud_fraction_scale))
+      ic = ic.map(setCloudFraction).filter(atMost('cloud_fraction', self.max_cloud_fraction))
+
+    report = ee.Dictionary({
+      'scenes':scenes,
+      'skipped_cloud_cover':ee.Number(scenes).subtract(metadata),
+      'skipped_cloud_fraction':ee.Number(metadata).subtract(ic.size())
+    })
+
+    return ic, report
+
+def request_meanRadiance(geom, startDate, stopDate, mission, removeClouds, dedupe_ancillary=False,\
+                         ancillary_table=None, cloud_options=None, prescreen=None, reduce_options=None):
   """
   Creates Earth Engine invocation for mean radiance values within a fixed
   geometry over an image collection (optionally applies cloud mask first)
+
+  dedupe_ancillary=True looks up h2o, o3 and aot once per distinct time step
+  (see AncillaryLookup), the collection's 'ancillary_lookups' property 
+  reports the number of lookups saved
+
+  ancillary_table (see ancillary.AncillaryCache.table) provides h2o, o3 and
+  aot computed locally beforehand, so no ancillary reductions are requested
+  at all (and building the request makes no Earth Engine round trips)
+
+  cloud_options configure cloud shadow masking (see TimeSeries.cloudMasker), 
+  e.g. {'clip':True, 'height_count':4, 'skip_clear':True}
+
+  prescreen drops cloudy scenes before extraction (see TimeSeries.prescreen),
+  e.g. {'max_cloud_cover':80, 'max_cloud_fraction':0.95}, the collection's 
+  'prescreen' property reports the number of scenes skipped
+
+  reduce_options set the scale, tileScale, bestEffort and maxPixels of the 
+  reduction and, with quality=True (or stdDev/percentiles), add pixel counts
+  and the clear-pixel fraction per scene (see TimeSeries.qualityReduce), 
+  e.g. {'quality':True, 'percentiles':[10,90], 'scale':30, 'tileScale':4}
+
+  This function is reentrant (e.g. can be called from a thread pool)
   """
 
-  # initialize
+  timeSeries = TimeSeries(geom, startDate, stopDate, mission, removeClouds)
+  timeSeries.cloud_options = cloud_options or {}
+  timeSeries.reduce_options = reduce_options or {}
+  ic = timeSeries.collection()
 
-  # time and a place
-  TimeSeries.geom = geom
-  TimeSeries.startDate = startDate
-  TimeSeries.stopDate = stopDate
+  if prescreen:
+    timeSeries.max_cloud_cover = prescreen.get('max_cloud_cover')
+    timeSeries.max_cloud_fraction = prescreen.get('max_cloud_fraction')
+    timeSeries.cloud_fraction_scale = prescreen.get('cloud_fraction_scale', 300)
+    ic, screening = timeSeries.prescreen(ic)
 
-  # satellite mission
-  TimeSeries.mission = mission
-  
-  # cloud removal
-  TimeSeries.removeClouds = removeClouds
-  TimeSeries.cloudRemover = CloudRemover  
+  if ancillary_table is not None:
+    timeSeries.ancillary = ancillary_table
+  elif dedupe_ancillary:
+    timeSeries.ancillary = AncillaryLookup(ic, geom)
+
+  request = ic.map(timeSeries.extractor).sort('timestamp')
+
+  if dedupe_ancillary and ancillary_table is None:
+    request = request.set('ancillary_lookups', timeSeries.ancillary.report())
+
+  if prescreen:
+    request = request.set('prescreen', screening)
+
+  return request
+
+
+def sites_collection(sites):
+  """
+  Earth Engine feature collection of sites, each with a 'site_id' property.
+
+  sites can be an ee.FeatureCollection (already with 'site_id' properties), 
+  a dictionary of {site_id:geometry} or a list of (site_id, geometry) pairs
+  """
+
+  if isinstance(sites, dict):
+    sites = list(sites.items())
+
+  # anything else is taken to be a feature collection
+  if not isinstance(sites, (list, tuple)):
+    return sites
+
+  return ee.FeatureCollection([ee.Feature(geom, {'site_id':site_id}) for site_id, geom in sites])
+
+def request_meanRadiance_sites(sites, startDate, stopDate, mission, removeClouds, cloud_options=None):
+  """
+  Creates Earth Engine invocation for mean radiance values within many 
+  geometries (i.e. sites) over an image collection. Each image is reduced 
+  once over all sites it covers (i.e. reduceRegions) and atmospheric 
+  correction inputs are gathered at each site.
+
+  Returns a feature collection with one feature per (site, image), tagged 
+  with 'site_id', which can be split locally with atmcorr_timeseries.split_sites
+  (cloud_options as in request_meanRadiance, clipped to all sites)
+  """
+
+  sites = sites_collection(sites)
+  bands = mission_s.ee_bandnames(mission)
+  cloudRemover = TimeSeries.cloudMasker(CloudRemover, mission, sites.geometry(), cloud_options)
+
+  def extractor(image):
+
+    date = ee.Date(image.get('system:time_start'))
+    doy = day_of_year(date)
+
+    # remove clouds and shadows?
+    masked = cloudRemover(image) if removeClouds else image
+
+    # radiance at-sensor
+    radiance = radiance_from_TOA(masked, mission, doy)
+
+    # mean average radiance (one reduction over all sites in this image)
+    means = radiance.reduceRegions(\
+      collection = sites.filterBounds(image.geometry()),\
+      reducer = ee.Reducer.mean())
+
+    def siteFeature(site):
+      geom = site.geometry()
+      properties = {
+        'site_id':site.get('site_id'),
+        'imageID':image.get('system:index'),
+        'timeStamp':ee.Number(image.get('system:time_start')).divide(1000),
+        'mean_averages':site.toDictionary().select(bands, True),
+        'atmcorr_inputs':AtmcorrInput.fromImage(image, mission, geom, date, doy)
+      }
+      return ee.Feature(geom, properties)
+
+    return means.map(siteFeature)
 
   # Earth Engine image collection
   ic = ee.ImageCollection(mission_s.eeCollection(mission))\
-    .filterBounds(geom)\
+    .filterBounds(sites.geometry())\
     .filterDate(startDate, stopDate)\
     .filter(mission_s.sunAngleFilter(mission))
 
-  return ic.map(TimeSeries.extractor).sort('timestamp')
\ No newline at end of file
+  return ee.FeatureCollection(ic.map(extractor)).flatten().sort('timeStamp')
@@ -0,0 +1,142 @@
+"""
+grid.py
+
+Spatially varying atmospheric correction, i.e. (a, b) coefficient fields
+rather than one (solar_z, h2o, o3, aot, alt) tuple at the centroid.
+
+Atmospheric correction inputs are sampled on a coarse grid of nodes over a
+region (altitude from GMTED2010, water vapour, ozone and AOT from an
+ancillary backend), the iLUTs are evaluated once per node (vectorized, one
+call per band) and the coefficient fields are bilinearly upsampled to pixel
+resolution, block by block, while correcting rasters (see raster.py).
+
+The cost is proportional to the number of grid nodes, not pixels.
+
+Usage
+fields = spatial_coefficients(bounds, (rows, cols), 'Sentinel2', properties, GriddedAncillary(path))
+correct_tiles(['tile.npy'], ['sr.npy'], 'Sentinel2', properties, coefficients=[fields])
+"""
+
+import numpy as np
+from atmcorr.atmcorr_timeseries import elliptical_orbit_correction
+from atmcorr.raster import day_of_year
+import atmcorr.interpolated_lookup_tables as iLUT
+import atmcorr.mission_specifics as mission_s
+
+def grid_nodes(bounds, nodes=(5, 5)):
+  """
+  lon and lat (rows, cols) of a grid of nodes spanning bounds
+  (xmin, ymin, xmax, ymax), row 0 at the top (i.e. north) as in rasters
+  """
+
+  xmin, ymin, xmax, ymax = bounds
+  rows, cols = nodes
+  lons = np.linspace(xmin, xmax, cols)
+  lats = np.linspace(ymax, ymin, rows)
+
+  return np.meshgrid(lons, lats)
+
+def request_altitudes(lons, lats):
+  """
+  altitude (km) from GMTED2010 at each node (one Earth Engine request)
+  """
+
+  import ee
+  from atmcorr.ee_requests import AtmcorrInput
+
+  points = ee.FeatureCollection([ee.Feature(ee.Geometry.Point(float(x), float(y)), {'node':i}) \
+                                 for i, (x, y) in enumerate(zip(np.ravel(lons), np.ravel(lats)))])
+  samples = AtmcorrInput.elevation.reduceRegions(collection=points, reducer=ee.Reducer.first())
+  features = samples.getInfo()['features']
+
+  alt = np.full(np.size(lons), np.nan)
+  for feature in features:
+    value = feature['properties'].get('first')
+    if value is not None:
+      alt[feature['properties']['node']] = value
+
+  return alt.reshape(np.shape(lons))
+
+def coefficient_grid(iLUTs, mission, solar_z, h2o, o3, aot, alt, doy):
+  """
+  a and b (bands, rows, cols) at each node (elliptical orbit corrected),
+  inputs are numbers or arrays of the node grid's shape
+  """
+
+  shape = np.broadcast(solar_z, h2o, o3, aot, alt).shape
+  inputs = np.column_stack([np.broadcast_to(np.asarray(x, dtype=float), shape).ravel() \
+                            for x in [solar_z, h2o, o3, aot, alt]])
+
+  # one iLUT call per waveband for all nodes
+  orbit_correction = elliptical_orbit_correction(doy)
+  a, b = [], []
+  for band in mission_s.py6s_bandnames(mission):
+    perihelion = np.asarray(iLUTs.iLUTs[band](inputs), dtype=float).reshape(-1, 2)
+    a.append(perihelion[:,0].reshape(shape) * orbit_correction)
+    b.append(perihelion[:,1].reshape(shape) * orbit_correction)
+
+  return np.array(a), np.array(b)
+
+
+class CoefficientField:
+  """
+  Coefficient field (bands, node rows, node cols) bilinearly upsampled to a
+  raster (rows, cols) whose corner pixels are at the corner nodes,
+  callable as field(band, r0, r1) for a block of rows (see raster.correct_band)
+  """
+
+  def __init__(self, nodes, shape):
+    self.nodes = np.asarray(nodes, dtype=float)
+    self.shape = shape
+
+  @staticmethod
+  def weights(n_pixels, n_nodes, start=0, stop=None):
+    """
+    lower node index and weight of the upper node for pixels [start, stop)
+    """
+    pixels = np.arange(start, n_pixels if stop is None else stop)
+    position = pixels * (n_nodes - 1) / max(n_pixels - 1, 1)
+    i = np.clip(np.floor(position).astype(int), 0, max(n_nodes - 2, 0))
+    w = position - i if n_nodes > 1 else np.zeros(len(pixels))
+    return i, np.minimum(i + 1, n_nodes - 1), w
+
+  def __call__(self, band, r0, r1):
+
+    grid = self.nodes[band]
+    rows, cols = self.shape
+
+    # along rows, then along columns (separable bilinear)
+    i0, i1, wy = CoefficientField.weights(rows, grid.shape[0], r0, r1)
+    blockRows = grid[i0] * (1 - wy)[:, np.newaxis] + grid[i1] * wy[:, np.newaxis]
+
+    j0, j1, wx = CoefficientField.weights(cols, grid.shape[1])
+    block = blockRows[:, j0] * (1 - wx) + blockRows[:, j1] * wx
+
+    return block.astype('float32')
+
+
+def spatial_coefficients(bounds, shape, mission, properties, ancillary, nodes=(5, 5), altitude=None,\
+                         iLUTs=None, engine='delaunay'):
+  """
+  (a, b) coefficient fields of a raster (rows, cols) spanning bounds, for
+  raster.correct_tiles(coefficients=[...])
+
+  ancillary - an ancillary backend (e.g. ancillary.GriddedAncillary)
+  altitude  - km, number or node grid (default: GMTED2010 from Earth Engine)
+  """
+
+  if iLUTs is None:
+    iLUTs = iLUT.registry.get(mission, engine=engine)
+
+  lons, lats = grid_nodes(bounds, nodes)
+  time = properties['system:time_start']
+
+  h2o, o3, aot = ancillary.inputs(lons.ravel(), lats.ravel(), np.full(lons.size, time))
+  if altitude is None:
+    altitude = request_altitudes(lons, lats)
+  solar_z = mission_s.solar_z_value(properties, mission)
+
+  a, b = coefficient_grid(iLUTs, mission, solar_z, h2o.reshape(lons.shape), o3.reshape(lons.shape),\
+                          aot.reshape(lons.shape), altitude, day_of_year(time))
+
+  return CoefficientField(a, shape), CoefficientField(b, shape)
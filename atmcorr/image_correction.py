@@ -0,0 +1,134 @@
+"""
+image_correction.py
+
+Server-side (i.e. per-pixel) atmospheric correction of whole image collections.
+
+Per-scene coefficients (a, b) are computed locally from the iLUTs (see
+coefficients.py), attached to each image as 'atmcorr_a' and 'atmcorr_b'
+properties, and a single correction function is mapped over the collection,
+so one Earth Engine graph covers every scene.
+
+Exports are either one task per scene or a single task of all scenes
+stacked as bands (stack=True). dry_run=True builds the export plan without
+creating any tasks.
+
+Usage
+df = collection_coefficients(geom, startDate, stopDate, mission)
+ic = corrected_collection(geom, startDate, stopDate, mission, df)
+tasks = export_corrected(ic, df, mission, geom, folder='atmcorr', dry_run=True)
+"""
+
+import numpy as np
+import ee
+from atmcorr.ee_requests import radiance_from_TOA, day_of_year
+from atmcorr.coefficients import collection
+import atmcorr.mission_specifics as mission_s
+
+def coefficient_arrays(df, mission):
+  """
+  a and b (scenes, wavebands) and which scenes have all coefficients
+  """
+
+  bands = mission_s.ee_bandnames(mission)
+  a = df[[band+'_a' for band in bands]].values.astype(float)
+  b = df[[band+'_b' for band in bands]].values.astype(float)
+  valid = np.isfinite(a).all(axis=1) & np.isfinite(b).all(axis=1)
+
+  return a, b, valid
+
+def coefficient_table(df, mission):
+  """
+  {imageID:{'a':[...], 'b':[...]}} in waveband order, scenes with missing
+  coefficients (e.g. no ancillary data) are skipped
+  """
+
+  a, b, valid = coefficient_arrays(df, mission)
+  if not valid.all():
+    print('{}: skipped {} scenes without coefficients'.format(mission, int((~valid).sum())))
+
+  return {imageID:{'a':a[i].tolist(), 'b':b[i].tolist()} \
+          for i, imageID in enumerate(df['imageID']) if valid[i]}
+
+def attach_coefficients(ic, table):
+  """
+  sets 'atmcorr_a' and 'atmcorr_b' (lists in waveband order) on each image
+  of a collection that has coefficients
+  """
+
+  coefficients = ee.Dictionary(table)
+
+  def attach(image):
+    coefs = ee.Dictionary(coefficients.get(image.get('system:index')))
+    return image.set({'atmcorr_a':coefs.get('a'), 'atmcorr_b':coefs.get('b')})
+
+  return ic.filter(ee.Filter.inList('system:index', list(table))).map(attach)
+
+def correct_image(image, mission):
+  """
+  surface reflectance of an image with attached coefficients,
+  i.e. (radiance - a) / b
+  """
+
+  bands = mission_s.ee_bandnames(mission)
+  date = ee.Date(image.get('system:time_start'))
+
+  radiance = radiance_from_TOA(image, mission, day_of_year(date))
+  a = ee.Image.constant(ee.List(image.get('atmcorr_a'))).rename(bands)
+  b = ee.Image.constant(ee.List(image.get('atmcorr_b'))).rename(bands)
+
+  SR = radiance.subtract(a).divide(b).rename(bands)
+
+  return ee.Image(SR.copyProperties(image)).set('system:time_start', image.get('system:time_start'))
+
+def corrected_collection(geom, startDate, stopDate, mission, df):
+  """
+  surface reflectance image collection (one graph for all scenes) given
+  a data frame of coefficients (see coefficients.collection_coefficients)
+  """
+
+  ic = collection(geom, startDate, stopDate, mission)
+  ic = attach_coefficients(ic, coefficient_table(df, mission))
+
+  return ic.map(lambda image: correct_image(image, mission))
+
+def export_corrected(ic, df, mission, region, description='atmcorr', folder=None, scale=None,\
+                     stack=False, dry_run=False, **export_options):
+  """
+  exports a corrected collection to Google Drive, one task per scene or a
+  single task of all scenes stacked as bands (stack=True)
+
+  returns started tasks, or the export configurations (dry_run=True), i.e.
+  the arguments of Export.image.toDrive and the scenes of each image
+  """
+
+  scale = scale or mission_s.nominal_scale(mission)
+  valid = coefficient_arrays(df, mission)[2]
+  imageIDs = [imageID for imageID, ok in zip(df['imageID'], valid) if ok]
+
+  if stack:
+    plan = [(description, ic.toBands(), imageIDs)]
+  else:
+    plan = [('{}_{}'.format(description, imageID),\
+             ee.Image(ic.filter(ee.Filter.eq('system:index', imageID)).first()), [imageID])\
+            for imageID in imageIDs]
+
+  tasks = []
+  for name, image, images in plan:
+    config = {
+      'description':name[:100],
+      'fileNamePrefix':name,
+      'folder':folder,
+      'scale':scale,
+      'region':region,
+      'maxPixels':1e13
+    }
+    config.update(export_options)
+    if dry_run:
+      print('dry run: {} ({} scenes)'.format(name, len(images)))
+      tasks.append(dict(config, image=image, images=images))
+    else:
+      task = ee.batch.Export.image.toDrive(image=image, **config)
+      task.start()
+      tasks.append(task)
+
+  return tasks
@@ -5,6 +5,21 @@ interpolated_lookup_tables.py, Sam Murphy (2017-06-22)
 The interpolated_lookup_table.handler manages loading, downloading 
 and interpolating the look up tables used by the 6S emulator 
 
+Three interpolation engines are available:
+
+  'delaunay' - scipy LinearNDInterpolator over the 5D triangulation (.ilut)
+  'regular'  - multilinear interpolation over the rectilinear LUT grid (.rlut),
+               i.e. scipy RegularGridInterpolator
+  'mmap'     - the 'regular' engine in a memory-mappable binary format (.mlut)
+               whose bands are loaded lazily, on first access
+
+All engines reproduce the look up table exactly at the grid nodes ('regular'
+and 'mmap' are the same interpolant). Between nodes the triangulation and the
+multilinear scheme weight neighbouring nodes differently, so (a, b)
+coefficients differ by up to REGULAR_GRID_RTOL (relative), measured on a
+synthetic look up table with 6S-like grid spacing (see tests/). The 6S look
+up tables themselves are not part of the tests; use engine_agreement() to
+check a band.
 """
 
 import os
@@ -14,20 +29,309 @@ import pickle
 import urllib.request
 import zipfile
 import time
+import json
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import product
-from scipy.interpolate import LinearNDInterpolator
+import numpy as np
+from scipy.interpolate import LinearNDInterpolator, RegularGridInterpolator
 import atmcorr.mission_specifics as mission_s
 
+# look up table input variables (i.e. order of the grid axes)
+INVARS = ['solar_zs','H2Os','O3s','AOTs','alts']
+
+# file extension of each interpolation engine
+ENGINES = {
+  'delaunay':'.ilut',
+  'regular':'.rlut',
+  'mmap':'.mlut'
+}
+
+# memory-mappable iLUT file format (.mlut)
+#
+#   magic (8 bytes) | version (uint32) | header length (uint32) | JSON header |
+#   zero padding to MMAP_ALIGN bytes | coefficients (C order, header['dtype'])
+#
+# the header holds the grid axes, coefficient array shape, dtype and offset
+MMAP_MAGIC = b'ATMCILUT'
+MMAP_VERSION = 1
+MMAP_ALIGN = 64
+
+# (relative) tolerance between 'regular' and 'delaunay' coefficients, the
+# worst case measured on the synthetic look up table of tests/synthetic.py
+# (DENSE_GRID, 3 x 20000 random points) is 1.45% (a) and 1.39% (b)
+REGULAR_GRID_RTOL = 0.02
+
+class RegularGridLUT:
+  """
+  Multilinear interpolant over the rectilinear look up table grid
+  (scipy RegularGridInterpolator).
+
+  Called like LinearNDInterpolator, i.e. iLUT(solar_z, h2o, o3, aot, alt)
+  or iLUT(points) where points has shape (..., 5). Returns (a, b) in the
+  last dimension, NaN outside of the grid.
+  """
+
+  def __init__(self, axes, values):
+    self.axes = [np.asarray(axis, dtype=float) for axis in axes]
+    self.values = values # shape = grid shape + (number of outputs,)
+    self.interpolator = RegularGridInterpolator(self.axes, self.values, method='linear',\
+                                                bounds_error=False, fill_value=np.nan)
+
+  @classmethod
+  def from_LUT(cls, LUT):
+    """
+    builds interpolant from a look up table (i.e. a loaded .lut file)
+    """
+    invars = LUT['config']['invars']
+    axes = [np.asarray(invars[key], dtype=float) for key in INVARS]
+    shape = tuple(len(axis) for axis in axes)
+    values = np.asarray(LUT['outputs'], dtype=float).reshape(shape + (-1,))
+    return cls(axes, values)
+
+  def __getstate__(self):
+    # pickles (.rlut) hold the grid only
+    return {'axes':self.axes, 'values':self.values}
+
+  def __setstate__(self, state):
+    self.__init__(state['axes'], state['values'])
+
+  def __call__(self, *args):
+
+    # (..., ndim) array of points
+    if len(args) == 1:
+      points = np.asarray(args[0], dtype=float)
+    else:
+      points = np.stack(np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in args]), axis=-1)
+
+    return self.interpolator(points)
+
+
+def build_interpolator(LUT, engine='delaunay'):
+  """
+  interpolated look up table (iLUT) from a look up table
+  """
+
+  if engine in ['regular','mmap']:
+    return RegularGridLUT.from_LUT(LUT)
+
+  # input variables (all permutations)
+  invars = LUT['config']['invars']
+  inputs = list(product(*[invars[key] for key in INVARS]))
+
+  # output variables (6S correction coefficients)
+  outputs = LUT['outputs']
+
+  # piecewise linear interpolant in n-dimensions
+  return LinearNDInterpolator(inputs,outputs)
+
+
+def atomic_write(filepath, write):
+  """
+  calls write(f) on a temporary file in the same directory then renames it,
+  so that filepath is never left truncated (e.g. by a crash or interrupt)
+  """
+
+  fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)), suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      write(f)
+    os.replace(tmp_filepath, filepath)
+  except BaseException:
+    if os.path.exists(tmp_filepath):
+      os.remove(tmp_filepath)
+    raise
+
+
+def atomic_pickle_dump(obj, filepath):
+  """
+  pickles obj to filepath (atomically, see atomic_write)
+  """
+  atomic_write(filepath, lambda f: pickle.dump(obj, f))
+
+
+def save_mmap_iLUT(iLUT, filepath):
+  """
+  saves a RegularGridLUT in the memory-mappable iLUT format (.mlut)
+  """
+
+  values = np.ascontiguousarray(iLUT.values, dtype='<f8')
+
+  def header_bytes(offset):
+    header = {
+      'version':MMAP_VERSION,
+      'invars':INVARS,
+      'axes':[axis.tolist() for axis in iLUT.axes],
+      'shape':list(values.shape),
+      'dtype':values.dtype.str,
+      'offset':offset
+    }
+    return json.dumps(header).encode('utf-8')
+
+  # offset depends on header length (which includes the offset..)
+  offset = 0
+  while True:
+    prefix = 16 + len(header_bytes(offset))
+    aligned = -(-prefix // MMAP_ALIGN) * MMAP_ALIGN
+    if aligned == offset:
+      break
+    offset = aligned
+  header = header_bytes(offset)
+
+  def write(f):
+    f.write(MMAP_MAGIC)
+    f.write(struct.pack('<II', MMAP_VERSION, len(header)))
+    f.write(header)
+    f.write(b'\0' * (offset - 16 - len(header)))
+    f.write(values.tobytes())
+
+  atomic_write(filepath, write)
+
+
+def load_mmap_iLUT(filepath):
+  """
+  opens a memory-mappable iLUT file (.mlut), coefficients are read by the
+  operating system on demand (and shared between processes on one host)
+  """
+
+  with open(filepath, 'rb') as f:
+    if f.read(8) != MMAP_MAGIC:
+      raise ValueError('not a memory-mappable iLUT file: '+filepath)
+    version, header_length = struct.unpack('<II', f.read(8))
+    if version > MMAP_VERSION:
+      raise ValueError('unsupported iLUT file version {}: {}'.format(version, filepath))
+    header = json.loads(f.read(header_length).decode('utf-8'))
+
+  values = np.memmap(filepath, dtype=np.dtype(header['dtype']), mode='r',\
+    offset=header['offset'], shape=tuple(header['shape']))
+
+  return RegularGridLUT(header['axes'], values)
+
+
+def to_regular_grid(iLUT):
+  """
+  RegularGridLUT from an existing iLUT (i.e. a pickled LinearNDInterpolator),
+  the triangulation points are the (complete) look up table grid
+  """
+
+  if isinstance(iLUT, RegularGridLUT):
+    return iLUT
+
+  points = np.asarray(iLUT.points, dtype=float)
+  axes = [np.unique(points[:,d]) for d in range(points.shape[1])]
+  shape = tuple(len(axis) for axis in axes)
+  if int(np.prod(shape)) != len(points):
+    raise ValueError('iLUT points are not a complete rectilinear grid')
+
+  # sort points into grid order (first axis varies slowest)
+  order = np.lexsort(points.T[::-1])
+  values = np.asarray(iLUT.values, dtype=float)[order].reshape(shape + (-1,))
+
+  return RegularGridLUT(axes, values)
+
+
+def convert_ilut_file(ilut_filepath, mlut_filepath):
+  """
+  converts a pickled iLUT file (.ilut or .rlut) to the memory-mappable format
+  """
+
+  with open(ilut_filepath, 'rb') as f:
+    iLUT = pickle.load(f)
+  save_mmap_iLUT(to_regular_grid(iLUT), mlut_filepath)
+
+
+def save_iLUT(iLUT, filepath, engine='delaunay'):
+  """
+  saves an iLUT in the file format of its engine
+  """
+
+  if engine == 'mmap':
+    save_mmap_iLUT(iLUT, filepath)
+  else:
+    atomic_pickle_dump(iLUT, filepath)
+
+
+class LazyiLUTs(Mapping):
+  """
+  Mapping of waveband to iLUT that only loads a band on first access
+  """
+
+  def __init__(self, filepaths, load=load_mmap_iLUT):
+    self.filepaths = dict(filepaths)
+    self.load = load
+    self.loaded = {}
+    self.lock = threading.Lock()
+
+  def __getitem__(self, band):
+    try:
+      return self.loaded[band]
+    except KeyError:
+      pass
+    filepath = self.filepaths[band]
+    with self.lock:
+      if band not in self.loaded:
+        self.loaded[band] = self.load(filepath)
+    return self.loaded[band]
+
+  def __iter__(self):
+    return iter(self.filepaths)
+
+  def __len__(self):
+    return len(self.filepaths)
+
+
+def interpolate_LUT_file(lut_filepath, ilut_filepath, engine='delaunay'):
+  """
+  interpolates a single look up table file (.lut) and saves the iLUT, 
+  returns the time taken (secs)
+  """
+
+  t = time.time()
+  with open(lut_filepath, 'rb') as f:
+    LUT = pickle.load(f)
+  save_iLUT(build_interpolator(LUT, engine), ilut_filepath, engine)
+
+  return time.time() - t
+
+
+def engine_agreement(reference, candidate, n=1000, seed=0):
+  """
+  Maximum relative difference in (a, b) between two iLUTs of the same band
+  at n random points inside the candidate grid (e.g. 'delaunay' vs 'regular').
+  """
+
+  rng = np.random.RandomState(seed)
+  points = np.column_stack([rng.uniform(axis[0], axis[-1], n) for axis in candidate.axes])
+  ref = np.asarray(reference(points), dtype=float)
+  new = np.asarray(candidate(points), dtype=float)
+  ok = np.isfinite(ref).all(axis=1) & np.isfinite(new).all(axis=1)
+  rel = np.abs(new[ok] - ref[ok]) / np.abs(ref[ok])
+
+  return rel.max(axis=0)
+
+
 class handler:
   """
   The interpolated_lookup_table.handler manages loading, downloading 
   and interpolating the look up tables used by the 6S emulator 
   """
   
-  def __init__(self, mission, path=False):
+  def __init__(self, mission, path=False, engine='delaunay', processes=1,\
+               aerosol_profile='Continental', view_zenith=0):
    
     self.userDefinedPath = path
     self.mission = mission
+    self.aerosol_profile = aerosol_profile
+    self.view_zenith = view_zenith
+    if engine not in ENGINES:
+      raise ValueError("engine '{}' not in {}".format(engine, list(ENGINES)))
+    self.engine = engine
+    self.extension = ENGINES[engine]
+    self.processes = processes
     self.supportedMissions = ['Sentinel2', 'Landsat8', 'Landsat7', 'Landsat5', 'Landsat4']
     
     # default file paths
@@ -36,9 +340,9 @@ class handler:
     self.files_path = os.path.join(self.base_path,'files')
     self.py6S_sensor = mission_s.py6S_sensor(self.mission)
     self.LUT_path = os.path.join(self.files_path,'LUTs',self.py6S_sensor,\
-        'Continental','view_zenith_0')
+        self.aerosol_profile,'view_zenith_{}'.format(self.view_zenith))
     self.iLUT_path = os.path.join(self.files_path,'iLUTs',self.py6S_sensor,\
-        'Continental','view_zenith_0')
+        self.aerosol_profile,'view_zenith_{}'.format(self.view_zenith))
   
   def download_LUTs(self):
     """
@@ -81,62 +385,97 @@ class handler:
     print('download successful')
   
   
-  def interpolate_LUTs(self):
+  def interpolate_LUTs(self, processes=None):
     """
     interpolates look up table files (.lut)
+
+    processes > 1 interpolates wavebands concurrently in a process pool
+    (defaults to self.processes)
     """
 
+    processes = processes or self.processes
+
     filepaths = sorted(glob.glob(self.LUT_path+os.path.sep+'*.lut'))
     if filepaths:
       print('\n...Running n-dimensional interpolation may take a several minutes (only need to do this once)...')
+      
+      # look up tables that still need interpolating
+      jobs = []
+      for fpath in filepaths:
+        fname = os.path.basename(fpath)
+        fid, ext = os.path.splitext(fname)
+        ilut_filepath = os.path.join(self.iLUT_path,fid+self.extension)
+        if os.path.isfile(ilut_filepath):
+          print('iLUT file already exists (skipping interpolation): {}'.format(fname))
+        else:
+          jobs.append((fname, fpath, ilut_filepath))
+
+      # per-band timings (secs)
+      timings = {}
+      t = time.time()
       try:
-        for fpath in filepaths:
-          fname = os.path.basename(fpath)
-          fid, ext = os.path.splitext(fname)
-          ilut_filepath = os.path.join(self.iLUT_path,fid+'.ilut')
-          if os.path.isfile(ilut_filepath):
-            print('iLUT file already exists (skipping interpolation): {}'.format(fname))
-          else:
+        if processes > 1 and len(jobs) > 1:
+          print('Interpolating {} files with {} processes'.format(len(jobs), processes))
+          with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(interpolate_LUT_file, fpath, ilut_filepath, self.engine):fname \
+                       for fname, fpath, ilut_filepath in jobs}
+            for future in as_completed(futures):
+              fname = futures[future]
+              try:
+                timings[fname] = future.result()
+                print('Interpolated: {} ({:.2f} secs)'.format(fname, timings[fname]))
+              except Exception as e:
+                print('interpolation error: {} ({})'.format(fname, e))
+        else:
+          for fname, fpath, ilut_filepath in jobs:
             print('Interpolating: '+fname)
-            
-            # load look up table
-            LUT = pickle.load(open(fpath,"rb"))
-
-            # input variables (all permutations)
-            invars = LUT['config']['invars']
-            inputs = list(product(invars['solar_zs'],
-                                  invars['H2Os'],
-                                  invars['O3s'],
-                                  invars['AOTs'],
-                                  invars['alts']))  
-            
-            # output variables (6S correction coefficients)
-            outputs = LUT['outputs']
-
-            # piecewise linear interpolant in n-dimensions
-            t = time.time()
-            interpolator = LinearNDInterpolator(inputs,outputs)
-            print('Interpolation took {:.2f} (secs) = '.format(time.time()-t))
-            
-            # save new interpolated LUT file
-            pickle.dump(interpolator, open(ilut_filepath, 'wb' ))
-
+            timings[fname] = interpolate_LUT_file(fpath, ilut_filepath, self.engine)
+            print('Interpolation took {:.2f} (secs) = '.format(timings[fname]))
       except:
 
         print('interpolation error')
 
+      # timing report
+      if timings:
+        print('\nInterpolation timings (secs)')
+        for fname in sorted(timings):
+          print('  {:<20} {:8.2f}'.format(fname, timings[fname]))
+        print('  {:<20} {:8.2f} (wall clock)'.format('total', time.time()-t))
+
     else:
       
       print('look up tables files (.lut) not found in LUTs directory:\n{}'.format(self.LUT_path))
 
+  def convert_iLUTs(self, source_engine='delaunay'):
+    """
+    converts existing pickled iLUT files (.ilut or .rlut) in self.iLUT_path
+    to the memory-mappable format (.mlut)
+    """
+
+    ilut_files = sorted(glob.glob(self.iLUT_path+os.path.sep+'*'+ENGINES[source_engine]))
+    if not ilut_files:
+      print('Interpolated look-up table files not found in:\n{}'.format(self.iLUT_path))
+    for f in ilut_files:
+      mlut_filepath = os.path.splitext(f)[0]+ENGINES['mmap']
+      if os.path.isfile(mlut_filepath):
+        print('iLUT file already exists (skipping conversion): {}'.format(os.path.basename(mlut_filepath)))
+      else:
+        print('Converting: '+os.path.basename(f))
+        convert_ilut_file(f, mlut_filepath)
+
   def load_iluts_from_path(self):
     """
-    looks for .ilut files in self.iLUT_path and loads them into self.iLUTs
+    looks for iLUT files (.ilut, .rlut or .mlut, see self.engine) in self.iLUT_path 
+    and loads them into self.iLUTs
     """
     
-    print('Loading interpolated look up tables (.ilut) for {}..'.format(self.mission))
+    print('Loading interpolated look up tables ({}) for {}..'.format(self.extension, self.mission))
 
-    ilut_files = glob.glob(self.iLUT_path+os.path.sep+'*.ilut')
+    ilut_files = glob.glob(self.iLUT_path+os.path.sep+'*'+self.extension)
+    if ilut_files and self.engine == 'mmap':
+      self.iLUTs = LazyiLUTs({os.path.basename(f).split('.')[0][-2:]:f for f in ilut_files})
+      print('Success (bands load on first access)')
+      return
     if ilut_files:
       try:
         for f in ilut_files:
@@ -224,6 +563,141 @@ class handler:
 
 
 
+def iLUT_nbytes(iLUT):
+  """
+  approximate memory held by a single (loaded) iLUT in bytes,
+  memory-mapped coefficients are not counted (they live in the OS cache)
+  """
+
+  if isinstance(iLUT, RegularGridLUT):
+    values = 0 if isinstance(iLUT.values, np.memmap) else iLUT.values.nbytes
+    return values + sum(axis.nbytes for axis in iLUT.axes)
+
+  # LinearNDInterpolator (points, values and triangulation)
+  nbytes = 0
+  for obj, names in [(iLUT, ['points','values']),\
+                     (getattr(iLUT, 'tri', None), ['points','simplices','neighbors','equations'])]:
+    for name in names:
+      nbytes += getattr(getattr(obj, name, None), 'nbytes', 0)
+
+  return nbytes
+
+
+class registry:
+  """
+  Process-wide cache of loaded iLUT handlers keyed by 
+  (sensor, aerosol profile, view zenith, iLUT path, engine).
+
+  Each set of iLUTs is loaded from disk once per process and returned to
+  later callers (e.g. Landsat4 and Landsat5 share LANDSAT_TM iLUTs). An
+  optional memory cap (max_bytes) evicts the least recently used sets.
+
+  Loading (i.e. downloading and interpolating) holds a per-key lock only,
+  so cache hits for other missions never wait on it. Handlers that failed
+  to load are not cached, later calls try again.
+  """
+
+  max_bytes = None
+  handlers = OrderedDict()
+  loading = {}
+  hits = 0
+  misses = 0
+  lock = threading.RLock()
+
+  def key(iLUTs):
+    return (iLUTs.py6S_sensor, iLUTs.aerosol_profile, iLUTs.view_zenith,\
+            os.path.abspath(iLUTs.userDefinedPath or iLUTs.iLUT_path), iLUTs.engine)
+
+  def get(mission, path=False, engine='delaunay', **kwargs):
+    """
+    iLUT handler for this mission (loaded on first request only)
+    """
+
+    iLUTs = handler(mission, path=path, engine=engine, **kwargs)
+    key = registry.key(iLUTs)
+
+    with registry.lock:
+      if key in registry.handlers:
+        registry.hits += 1
+        registry.handlers.move_to_end(key)
+        return registry.handlers[key]
+      key_lock = registry.loading.setdefault(key, threading.Lock())
+
+    with key_lock:
+
+      # loaded by another thread while waiting?
+      with registry.lock:
+        if key in registry.handlers:
+          registry.hits += 1
+          registry.handlers.move_to_end(key)
+          return registry.handlers[key]
+        registry.misses += 1
+
+      iLUTs.get()
+      if not iLUTs.iLUTs:
+        print('iLUT registry: no iLUTs loaded for {} (not cached)'.format(key))
+        return iLUTs
+
+      with registry.lock:
+        registry.handlers[key] = iLUTs
+        registry.evict()
+
+    return iLUTs
+
+  def nbytes(iLUTs=None):
+    """
+    memory held by a handler's iLUTs (or by all registered handlers)
+    """
+
+    if iLUTs is None:
+      return sum(registry.nbytes(h) for h in list(registry.handlers.values()))
+
+    # lazily loaded bands only count once they are loaded
+    bands = getattr(iLUTs.iLUTs, 'loaded', iLUTs.iLUTs)
+
+    return sum(iLUT_nbytes(iLUT) for iLUT in bands.values())
+
+  def evict():
+    """
+    drops least recently used handlers until under the memory cap
+    (the most recently used handler is always kept)
+    """
+
+    with registry.lock:
+      while registry.max_bytes is not None and len(registry.handlers) > 1 \
+            and registry.nbytes() > registry.max_bytes:
+        key, _ = registry.handlers.popitem(last=False)
+        print('iLUT registry evicted: {}'.format(key))
+
+  def invalidate(mission=None):
+    """
+    forgets loaded iLUTs for a mission (or for all missions)
+    """
+
+    with registry.lock:
+      if mission is None:
+        registry.handlers.clear()
+        return
+      sensor = mission_s.py6S_sensor(mission)
+      for key in [k for k in registry.handlers if k[0] == sensor]:
+        del registry.handlers[key]
+
+  def stats():
+    """
+    hit/miss counters and current memory usage
+    """
+
+    with registry.lock:
+      requests = registry.hits + registry.misses
+      return {
+        'hits':registry.hits,
+        'misses':registry.misses,
+        'hit_rate':registry.hits / requests if requests else 0.0,
+        'entries':len(registry.handlers),
+        'nbytes':registry.nbytes()
+      }
+
+
 # debugging
 # iLUTs = handler() 
 # iLUTs.mission = 'Landsat7'
@@ -107,6 +107,21 @@ def sunAngleFilter(mission):
 
   return switch[mission]
 
+def cloudCoverProperty(mission):
+  """
+  scene-level cloud cover metadata (percent)
+  """
+
+  switch = {
+    'Sentinel2':'CLOUDY_PIXEL_PERCENTAGE',
+    'Landsat8':'CLOUD_COVER',
+    'Landsat7':'CLOUD_COVER',
+    'Landsat5':'CLOUD_COVER',
+    'Landsat4':'CLOUD_COVER'
+  }
+
+  return switch[mission]
+
 def ESUNs(img, mission):
   """
   ESUN (Exoatmospheric spectral irradiance)
@@ -127,35 +142,36 @@ def ESUNs(img, mission):
   [2] Benjamin Leutner (https://github.com/bleutner/RStoolbox)
   """
 
-  sentinel2 =  ee.Image([
-      ee.Number(img.get('SOLAR_IRRADIANCE_B1')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B2')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B3')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B4')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B5')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B6')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B7')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B8')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B8A')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B9')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B10')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B11')),
-      ee.Number(img.get('SOLAR_IRRADIANCE_B12'))
-    ])
-
-  Landsat8 = ee.Image([1895.33, 2004.57, 1820.75, 1549.49, 951.76, 247.55, 85.46, 1723.8, 366.97])
-  Landsat7 = ee.Image([1997, 1812, 1533, 1039, 230.8, 84.9]) # PAN =  1362 (removed to match Py6S)
-  Landsat5 = ee.Image([1983, 1796, 1536, 1031, 220, 83.44])
-  Landsat4 = ee.Image([1983, 1795, 1539, 1028, 219.8, 83.49])
+  if mission == 'Sentinel2':
+    return ee.Image([ee.Number(img.get(prop)) for prop in ESUN_properties(mission)])
+
+  return ee.Image(ESUN_values(mission))
+
+def ESUN_properties(mission):
+  """
+  image metadata holding ESUN (i.e. Sentinel 2, per scene)
+  """
+
+  bands = ee_bandnames(mission)
+
+  return ['SOLAR_IRRADIANCE_'+band for band in bands] if mission == 'Sentinel2' else []
+
+def ESUN_values(mission, properties=None):
+  """
+  ESUN as plain numbers (waveband order), Sentinel 2 from image metadata
+  (i.e. a dictionary of image properties)
+  """
 
   switch = {
-    'Sentinel2':sentinel2,
-    'Landsat8':Landsat8,
-    'Landsat7':Landsat7,
-    'Landsat5':Landsat5,
-    'Landsat4':Landsat4
+    'Landsat8':[1895.33, 2004.57, 1820.75, 1549.49, 951.76, 247.55, 85.46, 1723.8, 366.97],
+    'Landsat7':[1997, 1812, 1533, 1039, 230.8, 84.9], # PAN =  1362 (removed to match Py6S)
+    'Landsat5':[1983, 1796, 1536, 1031, 220, 83.44],
+    'Landsat4':[1983, 1795, 1539, 1028, 219.8, 83.49]
   }
 
+  if mission == 'Sentinel2':
+    return [float(properties[prop]) for prop in ESUN_properties(mission)]
+
   return switch[mission]
 
 def solar_z(image, mission):
@@ -182,6 +198,31 @@ def solar_z(image, mission):
 
   return getSolarZenith(image)
 
+def solar_z_value(properties, mission):
+  """
+  solar zenith angle (degrees) from image metadata (i.e. a dictionary)
+  """
+
+  if mission == 'Sentinel2':
+    return float(properties['MEAN_SOLAR_ZENITH_ANGLE'])
+
+  return 90 - float(properties['SUN_ELEVATION'])
+
+def TOA_scale(mission):
+  """
+  scale factor from stored values to top of atmosphere reflectance
+  """
+
+  switch = {
+    'Sentinel2':1/10000,
+    'Landsat8':1,
+    'Landsat7':1,
+    'Landsat5':1,
+    'Landsat4':1
+  }
+
+  return switch[mission]
+
 def TOA(image, mission):
 
   switch = {
@@ -193,4 +234,19 @@ def TOA(image, mission):
     'Landsat4':image
   }
 
-  return switch[mission]
\ No newline at end of file
+  return switch[mission]
+
+def nominal_scale(mission):
+  """
+  nominal pixel size (meters) of visible to short-wave infrared wavebands
+  """
+
+  switch = {
+    'Sentinel2':10,
+    'Landsat8':30,
+    'Landsat7':30,
+    'Landsat5':30,
+    'Landsat4':30
+  }
+
+  return switch[mission]
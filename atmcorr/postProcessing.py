@@ -1,36 +1,137 @@
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import colorsys
+
+def rgb_to_hsv(r, g, b):
+    """
+    colorsys.rgb_to_hsv for numpy arrays (identical results), NaN in any
+    channel gives NaN hue, saturation and value (and saturation is inf
+    where colorsys would divide by a zero maximum)
+    """
+    r, g, b = [np.asarray(x, dtype=float) for x in (r, g, b)]
+
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    v = maxc
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = rangec / maxc
+        rc = (maxc - r) / rangec
+        gc = (maxc - g) / rangec
+        bc = (maxc - b) / rangec
+
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = (h / 6.0) % 1.0
+
+    # greys
+    grey = minc == maxc
+    h = np.where(grey, 0.0, h)
+    s = np.where(grey, 0.0, s)
+
+    return h, s, v
 
 def hsv(DF):
     """
     Hue-staturation-value
     """
-    rgb = list(zip(DF['red'], DF['green'], DF['blue']))
-    DF['hue'] = [colorsys.rgb_to_hsv(x[0], x[1], x[2])[0] for x in rgb]
-    DF['sat'] = [colorsys.rgb_to_hsv(x[0], x[1], x[2])[1] for x in rgb]
-    DF['val'] = [colorsys.rgb_to_hsv(x[0], x[1], x[2])[2] for x in rgb]
+    DF['hue'], DF['sat'], DF['val'] = rgb_to_hsv(DF['red'], DF['green'], DF['blue'])
     return DF
   
 
+def clip(df, startDate, stopDate):
+    """
+    rows of the days from startDate to stopDate, plus every row of the
+    closest day with a value (per column) on either side, i.e. exactly what
+    the daily means need to be interpolated up to the edges
+    """
+    df = df.sort_index(kind='stable')
+    days = df.index.floor('D')
+    before = np.asarray(days < pd.Timestamp(startDate))
+    after = np.asarray(days > pd.Timestamp(stopDate))
+    keep = ~before & ~after
+
+    valid = df.notna().values
+    for i in range(df.shape[1]):
+        for side, closest in [(before, np.max), (after, np.min)]:
+            candidates = days[side & valid[:, i]]
+            if len(candidates):
+                keep |= np.asarray(days == closest(candidates))
+
+    return df[keep]
+
+
+def daily(df, startDate, stopDate):
+    """
+    daily, gap-filled and clipped time series (with hue-saturation-value)
+    of a data frame with a datetime index
+    """
+
+    # numeric columns only (e.g. not mission or site labels)
+    df = df.select_dtypes('number')
+
+    # clip time series (before resampling, so nothing is interpolated only to be dropped)
+    df = clip(df, startDate, stopDate)
+
+    # resample to daily
+    resampled = df.resample('D').mean()
+
+    # fill in NaNs
+    interpolated = resampled.interpolate().ffill().bfill()
+
+    # clip to date range
+    DF = interpolated.truncate(before=startDate, after=stopDate)
+
+    # lets add hue-saturation-value color space
+    DF = hsv(DF)
+
+    return DF
+
+
 def postProcessing(allTimeSeries, startDate, stopDate):
     
     # create a dataframe
     df = pd.DataFrame.from_dict(allTimeSeries)
 
     # timestamp as index
-    df.index = [pd.datetime.utcfromtimestamp(t) for t in allTimeSeries['timeStamp']]
+    df.index = pd.to_datetime(df['timeStamp'], unit='s').values
     df = df.drop('timeStamp', axis=1)
 
-    # resample to daily
-    daily = df.resample('D').mean()
+    return daily(df, startDate, stopDate)
 
-    # fill in NaNs
-    interpolated = daily.interpolate().ffill().bfill()
 
-    # clip time series
-    DF = interpolated.truncate(before=startDate, after=stopDate)
+def groupedPostProcessing(df, startDate, stopDate, by=('site', 'mission'), processes=None):
+    """
+    Post-processing of a long-format data frame of many time series
+    (e.g. ResultStore.load()) in one pass per group of 'by' columns.
 
-    # lets add hue-saturation-value color space
-    DF = hsv(DF)
+    processes > 1 spreads groups over a process pool (e.g. many sites)
+
+    Returns a data frame indexed by the 'by' columns and date
+    """
+
+    by = [key for key in by if key in df]
+
+    # timestamp as index
+    df = df.set_index(pd.DatetimeIndex(pd.to_datetime(df['timeStamp'], unit='s').values))
+    df = df.drop('timeStamp', axis=1)
+
+    if not by:
+        return daily(df, startDate, stopDate)
+
+    groups = df.groupby(by, sort=True, observed=True)
+    keys = list(groups.groups)
+    frames = (group.drop(columns=by) for _, group in groups)
+
+    if processes and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(daily, frames, repeat(startDate), repeat(stopDate),\
+                                    chunksize=max(1, len(keys) // (4 * processes))))
+    else:
+        results = [daily(frame, startDate, stopDate) for frame in frames]
+
+    if not results:
+        return pd.DataFrame()
 
-    return DF
\ No newline at end of file
+    return pd.concat(results, keys=keys, names=by + ['date'])
@@ -0,0 +1,223 @@
+"""
+raster.py
+
+Local per-pixel atmospheric correction of top of atmosphere (TOA) rasters
+exported from Earth Engine (i.e. .npy arrays or GeoTIFFs of the mission's
+wavebands, in ee_bandnames order)
+
+  radiance = TOA * ESUN * cos(solar_z) / (pi * d^2)
+  surface reflectance = (radiance - a) / b
+
+where (a, b) come from the iLUTs (elliptical orbit corrected) and ESUN,
+solar_z and the Earth-Sun distance d are the same as in
+ee_requests.radiance_from_TOA.
+
+Rasters are processed in blocks of rows through memory-mapped (or windowed)
+I/O, with (tile, band) pairs spread over a thread pool, so memory stays
+bounded whatever the scene size. GeoTIFFs need rasterio (optional).
+
+Usage
+properties = ee.Image(...).toDictionary().getInfo()  # incl. system:time_start
+atmosphere = {'h2o':1.2, 'o3':0.3, 'aot':0.15, 'alt':0.1}
+correct_tiles(['tile0.npy','tile1.npy'], ['sr0.npy','sr1.npy'], 'Sentinel2', properties, atmosphere)
+"""
+
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from atmcorr.atmcorr_timeseries import elliptical_orbit_correction
+import atmcorr.interpolated_lookup_tables as iLUT
+import atmcorr.mission_specifics as mission_s
+
+def day_of_year(time_start):
+  """
+  (fractional) day of year of a time stamp in milliseconds (i.e. Jan 1st = 1)
+  as in ee_requests.day_of_year
+  """
+  date = datetime.datetime.utcfromtimestamp(time_start / 1000)
+  jan01 = datetime.datetime(date.year, 1, 1)
+  return (date - jan01).total_seconds() / 86400 + 1
+
+def earth_sun_distance(day_of_year):
+  """
+  Earth-Sun distance (AU)
+  """
+  return 1 - 0.01672 * np.cos(0.017202 * (np.asarray(day_of_year) - 4))
+
+def radiance_multipliers(mission, properties):
+  """
+  stored value to at-sensor radiance multiplier for each waveband
+  """
+
+  ESUNs = np.array(mission_s.ESUN_values(mission, properties), dtype=float)
+  theta = mission_s.solar_z_value(properties, mission) * 0.017453293
+  d = earth_sun_distance(day_of_year(properties['system:time_start']))
+
+  return mission_s.TOA_scale(mission) * ESUNs * np.cos(theta) / 3.14159265359 / (d * d)
+
+def scene_coefficients(iLUTs, mission, solar_z, h2o, o3, aot, alt, doy):
+  """
+  (a, b) for each waveband (elliptical orbit corrected)
+  """
+
+  orbit_correction = elliptical_orbit_correction(doy)
+  coefficients = np.array([iLUTs.iLUTs[band](solar_z, h2o, o3, aot, alt) \
+                           for band in mission_s.py6s_bandnames(mission)], dtype=float)
+
+  return coefficients[:,0] * orbit_correction, coefficients[:,1] * orbit_correction
+
+
+class NpyRaster:
+  """
+  (bands, rows, cols) .npy raster, memory-mapped
+  """
+
+  def __init__(self, filepath, mode='r'):
+    self.filepath = filepath
+    self.data = np.load(filepath, mmap_mode=mode)
+    if self.data.ndim == 2:
+      self.data = self.data[np.newaxis]
+    self.shape = self.data.shape
+
+  @classmethod
+  def create(cls, filepath, shape, like=None):
+    np.lib.format.open_memmap(filepath, mode='w+', dtype='float32', shape=shape).flush()
+    return cls(filepath, mode='r+')
+
+  def read(self, band, r0, r1):
+    return self.data[band, r0:r1]
+
+  def write(self, band, r0, r1, block):
+    self.data[band, r0:r1] = block
+
+  def close(self):
+    if isinstance(self.data, np.memmap):
+      self.data.flush()
+
+
+class GeoTiffRaster:
+  """
+  GeoTIFF raster read and written in windows (needs rasterio)
+  """
+
+  def __init__(self, filepath, mode='r'):
+    try:
+      import rasterio
+    except ImportError:
+      raise ImportError('rasterio is required to read/write GeoTIFFs: '+filepath)
+    self.filepath = filepath
+    self.dataset = rasterio.open(filepath, mode)
+    self.shape = (self.dataset.count, self.dataset.height, self.dataset.width)
+
+    # GDAL datasets are not thread-safe
+    self.lock = threading.Lock()
+
+  @classmethod
+  def create(cls, filepath, shape, like=None):
+    import rasterio
+    # georeferencing of a GeoTIFF source, otherwise a minimal profile
+    profile = dict(like.dataset.profile) if isinstance(like, GeoTiffRaster) else {'driver':'GTiff'}
+    profile.update(count=shape[0], height=shape[1], width=shape[2], dtype='float32', nodata=np.nan)
+    with rasterio.open(filepath, 'w', **profile):
+      pass
+    return cls(filepath, mode='r+')
+
+  def window(self, r0, r1):
+    from rasterio.windows import Window
+    return Window(0, r0, self.shape[2], r1 - r0)
+
+  def read(self, band, r0, r1):
+    with self.lock:
+      return self.dataset.read(band + 1, window=self.window(r0, r1))
+
+  def write(self, band, r0, r1, block):
+    with self.lock:
+      self.dataset.write(block.astype('float32'), band + 1, window=self.window(r0, r1))
+
+  def close(self):
+    self.dataset.close()
+
+
+def open_raster(filepath, mode='r'):
+  if filepath.lower().endswith(('.tif', '.tiff')):
+    return GeoTiffRaster(filepath, mode)
+  return NpyRaster(filepath, mode)
+
+def create_raster(filepath, shape, like=None):
+  if filepath.lower().endswith(('.tif', '.tiff')):
+    return GeoTiffRaster.create(filepath, shape, like)
+  return NpyRaster.create(filepath, shape, like)
+
+def correct_band(src, dst, band, multiplier, a, b, block_rows=512, nodata=None):
+  """
+  surface reflectance of one band, one block of rows at a time
+
+  a and b are numbers, or callables of (band, r0, r1) returning the block
+  of a (spatially varying) coefficient field
+  """
+
+  rows = src.shape[1]
+  for r0 in range(0, rows, block_rows):
+    r1 = min(r0 + block_rows, rows)
+    toa = np.asarray(src.read(band, r0, r1), dtype='float32')
+    radiance = toa * np.float32(multiplier)
+    block_a = a(band, r0, r1) if callable(a) else a
+    block_b = b(band, r0, r1) if callable(b) else b
+    with np.errstate(divide='ignore', invalid='ignore'):
+      SR = (radiance - block_a) / block_b
+    if nodata is not None:
+      SR = np.where(toa == nodata, np.nan, SR)
+    dst.write(band, r0, r1, SR.astype('float32'))
+
+def correct_tiles(tiles, outputs, mission, properties, atmosphere=None, coefficients=None,\
+                  iLUTs=None, engine='delaunay', block_rows=512, max_workers=4, nodata=None):
+  """
+  Atmospherically corrects TOA raster tiles (of the same scene) to surface
+  reflectance, one output per tile
+
+  properties  - image metadata (ESUN, solar angles and system:time_start)
+  atmosphere  - {'h2o', 'o3', 'aot', 'alt'} (Py6S units)
+  coefficients - (a, b) per waveband instead of atmosphere, numbers or
+                 callables of (band, r0, r1) per tile (e.g. grid.py fields)
+  nodata      - stored TOA value of missing pixels (e.g. 0), output NaN
+  """
+
+  bands = mission_s.ee_bandnames(mission)
+  multipliers = radiance_multipliers(mission, properties)
+
+  if coefficients is None:
+    if iLUTs is None:
+      iLUTs = iLUT.registry.get(mission, engine=engine)
+    solar_z = mission_s.solar_z_value(properties, mission)
+    doy = day_of_year(properties['system:time_start'])
+    a, b = scene_coefficients(iLUTs, mission, solar_z, atmosphere['h2o'], atmosphere['o3'],\
+                              atmosphere['aot'], atmosphere['alt'], doy)
+    coefficients = [(a, b)] * len(tiles)
+
+  sources, destinations = [], []
+  try:
+    for tile, output in zip(tiles, outputs):
+      src = open_raster(tile)
+      if src.shape[0] != len(bands):
+        raise ValueError('{} has {} bands, expected {} ({})'.format(tile, src.shape[0], len(bands), bands))
+      sources.append(src)
+      destinations.append(create_raster(output, src.shape, like=src))
+
+    def task(job):
+      i, band = job
+      a, b = coefficients[i]
+      a_band = a if callable(a) else float(np.asarray(a)[band])
+      b_band = b if callable(b) else float(np.asarray(b)[band])
+      correct_band(sources[i], destinations[i], band, multipliers[band], a_band, b_band,\
+                   block_rows, nodata)
+
+    jobs = [(i, band) for i in range(len(sources)) for band in range(len(bands))]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+      list(pool.map(task, jobs))
+
+  finally:
+    for raster in sources + destinations:
+      raster.close()
+
+  return outputs
@@ -0,0 +1,124 @@
+"""
+result_store.py
+
+Columnar (Parquet) cache of surface reflectance time series.
+
+One partition per site (i.e. target) with timeStamp, mission and waveband
+columns
+
+  files/parquet/site=<target>/part-0.parquet
+
+Loads only read the partitions of the requested sites, push date range
+predicates down to the Parquet reader and can keep Arrow memory as is
+(zero-copy) with arrow_dtypes=True. Sites may have different columns.
+
+Usage
+store = ResultStore()
+store.save('forest', allTimeSeries)
+df = store.load(['forest','lake'], startDate='2016-01-01', stopDate='2017-01-01')
+"""
+
+import os
+import glob
+import calendar
+import datetime
+import pandas as pd
+from atmcorr.interpolated_lookup_tables import atomic_write
+
+def to_timestamp(date):
+  """
+  'YYYY-MM-DD' to seconds since 1970-01-01 (UTC), i.e. timeStamp units
+  """
+  return calendar.timegm(datetime.datetime.strptime(date, '%Y-%m-%d').timetuple())
+
+class ResultStore:
+  """
+  Parquet store of time series partitioned by site
+  """
+
+  def __init__(self, path=None):
+
+    if not path:
+      basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+      path = os.path.join(basedir,'files','parquet')
+    self.path = path
+
+  def site_path(self, site):
+    return os.path.join(self.path, 'site={}'.format(site))
+
+  def exists(self, site):
+    return bool(glob.glob(os.path.join(self.site_path(site), '*.parquet')))
+
+  def sites(self):
+    """
+    sites in the store
+    """
+    paths = glob.glob(os.path.join(self.path, 'site=*'))
+    return sorted(os.path.basename(p)[len('site='):] for p in paths)
+
+  def save(self, site, allTimeSeries):
+    """
+    saves (i.e. replaces) the time series of a site
+    """
+
+    # site is a partition key (i.e. directory name) not a column
+    df = pd.DataFrame(allTimeSeries)
+    df = df.drop(columns=['site'], errors='ignore')
+    if 'timeStamp' in df:
+      df = df.sort_values('timeStamp', kind='stable').reset_index(drop=True)
+
+    site_path = self.site_path(site)
+    if not os.path.isdir(site_path):
+      os.makedirs(site_path, exist_ok=True)
+    atomic_write(os.path.join(site_path, 'part-0.parquet'),\
+                 lambda f: df.to_parquet(f, engine='pyarrow', index=False))
+
+  def load(self, sites=None, startDate=None, stopDate=None, columns=None, arrow_dtypes=False):
+    """
+    time series as a pandas data frame (with a 'site' column)
+
+    sites              - site or list of sites (default all)
+    startDate/stopDate - 'YYYY-MM-DD' (stopDate is exclusive)
+    columns            - subset of columns to read
+    arrow_dtypes       - keep Arrow backed columns (i.e. zero-copy)
+    """
+
+    # pyarrow is only needed to read and write the store
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    if sites is None:
+      sites = self.sites()
+    if isinstance(sites, str):
+      sites = [sites]
+    filepaths = [f for site in sites for f in sorted(glob.glob(os.path.join(self.site_path(site), '*.parquet')))]
+    if not filepaths:
+      return pd.DataFrame(columns=columns)
+
+    # sites can have different columns (e.g. quality statistics) and all-null
+    # columns, so the schema is the union of all files (nulls are promoted)
+    schema = pa.unify_schemas([pq.read_schema(f).remove_metadata() for f in filepaths],\
+                              promote_options='permissive')
+    schema = schema.append(pa.field('site', pa.string()))
+    partitioning = ds.partitioning(pa.schema([('site', pa.string())]), flavor='hive')
+    dataset = ds.dataset(filepaths, schema=schema, format='parquet',\
+                         partitioning=partitioning, partition_base_dir=self.path)
+
+    predicate = None
+    if startDate:
+      predicate = ds.field('timeStamp') >= to_timestamp(startDate)
+    if stopDate:
+      before = ds.field('timeStamp') < to_timestamp(stopDate)
+      predicate = before if predicate is None else predicate & before
+
+    table = dataset.to_table(columns=columns, filter=predicate)
+
+    return table.to_pandas(types_mapper=pd.ArrowDtype if arrow_dtypes else None)
+
+  def delete(self, site):
+    """
+    deletes the time series of a site
+    """
+    for filepath in glob.glob(os.path.join(self.site_path(site), '*.parquet')):
+      os.remove(filepath)
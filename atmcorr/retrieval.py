@@ -0,0 +1,112 @@
+"""
+retrieval.py
+
+Fetches mean radiance feature collections from Earth Engine.
+
+Long time series (e.g. 30 years of Landsat over a large polygon) can exceed
+Earth Engine's element/memory limits in a single getInfo(). The date range
+is therefore split into chunks which are fetched with bounded concurrency
+and retries, and yielded (in date order) as batches of features.
+
+Usage
+for chunk, features in iter_meanRadiance(geom, '1990-01-01', '2020-01-01', 'Landsat5'):
+  ...
+"""
+
+import time
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import ee
+
+def request_getInfo(geom, startDate, stopDate, mission, removeClouds, **request_options):
+  """
+  Default Earth Engine client, i.e. builds a mean radiance request and
+  blocks until it has been computed.
+
+  Any callable with this signature (returning the feature collection as a
+  dictionary) can be used as a 'client' instead, e.g. a local stub in tests.
+  request_options are passed to request_meanRadiance (e.g. dedupe_ancillary)
+  """
+
+  # creates Earth Engine objects on import (i.e. after ee.Initialize), so
+  # date_chunks and the offline modules using it import without Earth Engine
+  from atmcorr.ee_requests import request_meanRadiance
+
+  request = request_meanRadiance(geom, ee.Date(startDate), ee.Date(stopDate), \
+                                 mission, removeClouds, **request_options)
+
+  meanRadiance = request.getInfo()
+
+  # collection level reports (e.g. ancillary lookups saved)
+  for key, value in sorted(meanRadiance.get('properties', {}).items()):
+    print('{} {} to {}, {}: {}'.format(mission, startDate, stopDate, key, value))
+
+  return meanRadiance
+
+def date_chunks(startDate, stopDate, chunk_days=365):
+  """
+  splits [startDate, stopDate) into consecutive (start, stop) date ranges
+  of at most chunk_days (dates are 'YYYY-MM-DD' strings)
+  """
+
+  start = datetime.datetime.strptime(startDate, '%Y-%m-%d').date()
+  stop = datetime.datetime.strptime(stopDate, '%Y-%m-%d').date()
+  step = datetime.timedelta(days=chunk_days)
+
+  chunks = []
+  while start < stop:
+    end = min(start + step, stop)
+    chunks.append((start.isoformat(), end.isoformat()))
+    start = end
+
+  return chunks
+
+def fetch_chunk(geom, chunk, mission, removeClouds=True, retries=3, backoff=2, client=request_getInfo):
+  """
+  features for a single date chunk, retrying failed requests
+  (waiting backoff, 2*backoff, 4*backoff.. seconds)
+  """
+
+  for attempt in range(retries + 1):
+    try:
+      return client(geom, chunk[0], chunk[1], mission, removeClouds)['features']
+    except Exception as e:
+      if attempt == retries:
+        raise RuntimeError('{} chunk {} to {} failed after {} attempts: {}'\
+          .format(mission, chunk[0], chunk[1], retries + 1, e))
+      print('{} chunk {} to {} failed (retrying): {}'.format(mission, chunk[0], chunk[1], e))
+      time.sleep(backoff * 2**attempt)
+
+def iter_meanRadiance(geom, startDate, stopDate, mission, removeClouds=True, chunk_days=365,\
+                      max_workers=4, retries=3, client=request_getInfo, chunks=None):
+  """
+  Generator of (chunk, features) in date order.
+
+  At most max_workers chunks are in flight (or waiting to be consumed) at
+  any time, so memory stays flat however long the time series is.
+  An explicit list of chunks can be given (e.g. only those still missing).
+  """
+
+  if chunks is None:
+    chunks = date_chunks(startDate, stopDate, chunk_days)
+  chunks = iter(chunks)
+
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+    pending = deque()
+
+    def submit():
+      for chunk in chunks:
+        pending.append((chunk, pool.submit(fetch_chunk, geom, chunk, mission,\
+                                           removeClouds, retries, client=client)))
+        return
+
+    for _ in range(max_workers):
+      submit()
+
+    while pending:
+      chunk, future = pending.popleft()
+      features = future.result()
+      submit()
+      yield chunk, features
@@ -1,47 +1,146 @@
 import os
+import datetime
+import functools
 import ee
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 import atmcorr.interpolated_lookup_tables as iLUT
-from atmcorr.ee_requests import request_meanRadiance
-from atmcorr.atmcorr_timeseries import surface_reflectance_timeseries
+from atmcorr.ee_requests import request_meanRadiance_sites
+from atmcorr.retrieval import request_getInfo, iter_meanRadiance
+from atmcorr.checkpoints import iter_checkpointed
+from atmcorr.result_store import ResultStore
+from atmcorr.atmcorr_timeseries import surface_reflectance_timeseries, surface_reflectance_chunks, split_sites, QUALITY
 from atmcorr.mission_specifics import ee_bandnames, common_bandnames
 
-def timeseries_extrator(geom, startDate, stopDate, mission, removeClouds=True):
+def timeseries_extrator(geom, startDate, stopDate, mission, removeClouds=True, batch=False, engine='delaunay',\
+                        coefficient_cache=None, client=request_getInfo, chunk_days=None, chunk_workers=4, retries=3,\
+                        checkpoints=None, target=None, request_options=None):
     """
     This is the function for extracting atmospherically corrected, 
     cloud-free time series for a given satellite mission.
+
+    batch=True corrects all scenes at once with the vectorized engine
+    engine selects the iLUT interpolation engine ('delaunay', 'regular' or 'mmap')
+    coefficient_cache (optional) memoizes iLUT calls (see coefficient_cache.py)
+    client fetches mean radiances from Earth Engine (see retrieval.request_getInfo)
+    chunk_days splits the request into date chunks, fetched with chunk_workers 
+    concurrent requests and retries (see retrieval.iter_meanRadiance)
+    checkpoints (a CheckpointStore) saves each chunk of target (required) as soon 
+    as it arrives and skips chunks that are already done with the same settings
+    (default chunk_days=365, recent chunks are always refetched)
+    request_options are passed to the client's Earth Engine request, 
+    e.g. {'dedupe_ancillary':True}, {'ancillary_table':cache.table(lon, lat, startDate, stopDate)} or
+    {'cloud_options':{'clip':True, 'skip_clear':True}} (see ee_requests.request_meanRadiance)
     """
+
+    # checkpoints are kept per target
+    if checkpoints is not None and not target:
+        raise ValueError('checkpoints need a target (the name chunks are saved under)')
+
+    if request_options:
+        client = functools.partial(client, **request_options)
     
-    # interpolated lookup tables 
-    iLUTs = iLUT.handler(mission) 
-    iLUTs.get()
+    # interpolated lookup tables (loaded once per process)
+    iLUTs = iLUT.registry.get(mission, engine=engine)
+
+    # checkpointed retrieval is always chunked
+    if checkpoints is not None and not chunk_days:
+        chunk_days = 365
+
+    # streaming retrieval (atmospheric correction one chunk at a time)
+    if chunk_days:
+        print('Getting data from Earth Engine in {} day chunks.. ({})'.format(chunk_days, mission))
+        if checkpoints is not None:
+            chunks = iter_checkpointed(checkpoints, target, geom, startDate, stopDate, mission, removeClouds,\
+                                       chunk_days=chunk_days, request_options=request_options,\
+                                       max_workers=chunk_workers, retries=retries, client=client)
+        else:
+            chunks = iter_meanRadiance(geom, startDate, stopDate, mission, removeClouds, chunk_days=chunk_days,\
+                                       max_workers=chunk_workers, retries=retries, client=client)
+        timeseries = surface_reflectance_chunks((features for chunk, features in chunks), iLUTs, mission,\
+                                                batch=batch, coefficient_cache=coefficient_cache)
+        print('number of valid images = {} ({})'.format(len(timeseries['timeStamp']), mission))
+        return timeseries if timeseries['timeStamp'] else {}
     
     # earth engine request
-    print('Getting data from Earth Engine.. ')
-    request = request_meanRadiance(geom, ee.Date(startDate), ee.Date(stopDate), \
-                                   mission, removeClouds)
-    meanRadiance = request.getInfo()
-    print('Data collection complete')
+    print('Getting data from Earth Engine.. ({})'.format(mission))
+    meanRadiance = client(geom, startDate, stopDate, mission, removeClouds)
+    print('Data collection complete ({})'.format(mission))
     
     # return if no pixels available
     num = len(meanRadiance['features'])
     if num == 0:
         return {}
     else:
-        print('number of valid images = {}'.format(num))
+        print('number of valid images = {} ({})'.format(num, mission))
     
     # atmospheric correction
-    print('Running atmospheric correction')
-    timeseries = surface_reflectance_timeseries(meanRadiance, iLUTs, mission)
-    print('Done')
+    print('Running atmospheric correction ({})'.format(mission))
+    timeseries = surface_reflectance_timeseries(meanRadiance, iLUTs, mission, batch=batch,\
+                                              coefficient_cache=coefficient_cache)
+    if coefficient_cache is not None:
+        print('coefficient cache: {}'.format(coefficient_cache.stats()))
+    print('Done ({})'.format(mission))
     
     return timeseries  
 
-def extractAllTimeSeries(target, geom, startDate, stopDate, missions, removeClouds=True):
+def sites_timeseries_extractor(sites, startDate, stopDate, mission, removeClouds=True, batch=False,\
+                               engine='delaunay', coefficient_cache=None, cloud_options=None):
+    """
+    Extracts atmospherically corrected, cloud-free time series for many sites
+    with a single Earth Engine request (see request_meanRadiance_sites).
+
+    cloud_options configure cloud shadow masking (see ee_requests.TimeSeries.cloudMasker)
+
+    Returns a dictionary of {site_id:timeseries}
+    """
+
+    # interpolated lookup tables (loaded once per process)
+    iLUTs = iLUT.registry.get(mission, engine=engine)
+
+    # earth engine request (all sites)
+    print('Getting data from Earth Engine.. ')
+    request = request_meanRadiance_sites(sites, ee.Date(startDate), ee.Date(stopDate), \
+                                         mission, removeClouds, cloud_options)
+    meanRadiance = request.getInfo()
+    print('Data collection complete')
+
+    # atmospheric correction (each site)
+    print('Running atmospheric correction')
+    allSites = {}
+    for site_id, siteRadiance in split_sites(meanRadiance).items():
+        print('site {}: number of valid images = {}'.format(site_id, len(siteRadiance['features'])))
+        allSites[site_id] = surface_reflectance_timeseries(siteRadiance, iLUTs, mission, batch=batch,\
+                                                           coefficient_cache=coefficient_cache)
+    print('Done')
+
+    return allSites
+
+def extractAllTimeSeries(target, geom, startDate, stopDate, missions, removeClouds=True, max_workers=1, **options):
     """
     Extracts time series for each mission and join them together
+
+    max_workers > 1 runs missions concurrently, i.e. Earth Engine requests 
+    for several missions are in flight together and each mission is 
+    atmospherically corrected as soon as its data arrive. Results are 
+    always joined in the order of 'missions'.
+
+    options are passed to timeseries_extrator (e.g. batch, engine, client)
     """ 
+
+    # checkpoints are kept per target
+    if options.get('checkpoints') is not None:
+        options.setdefault('target', target)
+
+    def extract(mission):
+        return timeseries_extrator(geom, startDate, stopDate, mission, removeClouds=removeClouds, **options)
+
+    if max_workers > 1 and len(missions) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(extract, missions))
+    else:
+        results = [extract(mission) for mission in missions]
     
     # will store results here (and use consistent band names)
     allTimeSeries = {
@@ -51,13 +150,18 @@ def extractAllTimeSeries(target, geom, startDate, stopDate, missions, removeClou
         'nir':[],
         'swir1':[], 
         'swir2':[],
-        'timeStamp':[]
+        'timeStamp':[],
+        'imageID':[],
+        'mission':[]
     }
 
+    # per-scene quality (if any mission has it, see ee_requests.TimeSeries.qualityReduce)
+    quality = [key for key in QUALITY if any(key in timeseries for timeseries in results)]
+    for key in quality:
+        allTimeSeries[key] = []
+
     # for mission in ['Landsat4']:
-    for mission in missions:
-        
-        timeseries = timeseries_extrator(geom, startDate, stopDate, mission, removeClouds=removeClouds) 
+    for mission, timeseries in zip(missions, results):
         
         # names of wavebands
         eeNames = ee_bandnames(mission)
@@ -71,20 +175,32 @@ def extractAllTimeSeries(target, geom, startDate, stopDate, missions, removeClou
                     allTimeSeries[commonName].append(timeseries[key])
             if key == 'timeStamp':
                 allTimeSeries['timeStamp'].append(timeseries['timeStamp'])
+                allTimeSeries['imageID'].append(timeseries['imageID'])
+                allTimeSeries['mission'].append([mission] * len(timeseries['timeStamp']))
+                for qualityKey in quality:
+                    allTimeSeries[qualityKey].append(timeseries.get(qualityKey, [None] * len(timeseries['timeStamp'])))
     
     # flatten each variables (from separate missions) into a single list
     def flatten(multilist):
-        if isinstance(multilist[0], list):
+        if multilist and isinstance(multilist[0], list):
             return [item for sublist in multilist for item in sublist]
         else:
             return multilist
 
     for key in allTimeSeries.keys():
         allTimeSeries[key] = flatten(allTimeSeries[key])
+
+    # persist memoized coefficients for the next run
+    coefficient_cache = options.get('coefficient_cache')
+    if coefficient_cache is not None and coefficient_cache.path:
+        coefficient_cache.save()
     
     return allTimeSeries
 
 def saveToExcel(target, allTimeSeries):
+    """
+    exports a time series to files/excel/<target>.xlsx
+    """
     basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     excel_dir = os.path.join(basedir,'files','excel')
     if not os.path.exists(excel_dir):
@@ -97,6 +213,9 @@ def saveToExcel(target, allTimeSeries):
     df.to_excel(os.path.join(excel_dir, target+'.xlsx'), index=False)
 
 def loadFromExcel(target):
+    """
+    loads an exported excel file (the result store is the cache, see timeSeries)
+    """
     basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     excel_path = os.path.join(basedir,'files','excel',target+'.xlsx')
 
@@ -104,26 +223,81 @@ def loadFromExcel(target):
       print('Loading from excel file')
       return pd.read_excel(excel_path).to_dict(orient='list')
 
-def timeSeries(target, geom, startDate, stopDate, missions, removeClouds=True):
+def updateTimeSeries(target, geom, startDate, stopDate, missions, store, removeClouds=True, **options):
+    """
+    Incremental update of a stored time series, i.e. for each mission only 
+    scenes from the latest cached timeStamp up to stopDate are requested and
+    corrected, then appended to the store (duplicates removed by imageID).
+
+    Returns the updated data frame
+    """
+
+    cached = store.load(target).drop(columns=['site'])
+    updates = [cached]
+
+    for mission in missions:
+
+        # latest cached scene of this mission
+        latest = cached.loc[cached['mission'] == mission, 'timeStamp'].max() \
+                 if 'mission' in cached else cached['timeStamp'].max()
+        if pd.isnull(latest):
+            newStartDate = startDate
+        else:
+            newStartDate = max(startDate, datetime.datetime.utcfromtimestamp(latest).strftime('%Y-%m-%d'))
+        if newStartDate >= stopDate:
+            print('{} {} is up to date'.format(target, mission))
+            continue
+
+        print('{} {}: updating from {} to {}'.format(target, mission, newStartDate, stopDate))
+        newTimeSeries = extractAllTimeSeries(target, geom, newStartDate, stopDate, [mission],\
+                                             removeClouds=removeClouds, **options)
+        updates.append(pd.DataFrame(newTimeSeries))
+
+    # append (scenes already processed are identified by imageID)
+    df = pd.concat(updates, ignore_index=True)
+    if 'imageID' in cached:
+        keys = ['mission','imageID'] if 'mission' in df else ['imageID']
+        df = df.drop_duplicates(subset=keys, keep='first')
+    print('{} new scenes'.format(len(df) - len(cached)))
+
+    store.save(target, df)
+
+    return df
+
+def timeSeries(target, geom, startDate, stopDate, missions, removeClouds=True, store=None, excel=False,\
+               as_frame=False, incremental=False, **options):
     """
     time series flow
-    1) try loading from excel
+    1) try loading from the result store (Parquet, see result_store.py)
+       (incremental=True fetches scenes newer than the cache, see updateTimeSeries)
     2) run the extraction
-    3) save to excel
+    3) save to the result store (and optionally export to excel)
+
+    as_frame=True returns a pandas data frame rather than a dictionary
+    options are passed to extractAllTimeSeries (e.g. max_workers, batch, engine)
     """
 
-    # try loading from excel first
-    try:
-      allTimeSeries = loadFromExcel(target)
-      if allTimeSeries:
-        return allTimeSeries
-    except:
-      pass
+    store = store or ResultStore()
+
+    # try loading from the result store first
+    if store.exists(target):
+      if incremental:
+        df = updateTimeSeries(target, geom, startDate, stopDate, missions, store,\
+                              removeClouds=removeClouds, **options)
+      else:
+        print('Loading from result store')
+        df = store.load(target).drop(columns=['site'])
+      return df if as_frame else df.to_dict(orient='list')
        
     # run extraction
-    allTimeSeries = extractAllTimeSeries(target, geom, startDate, stopDate, missions)
+    allTimeSeries = extractAllTimeSeries(target, geom, startDate, stopDate, missions,\
+                                         removeClouds=removeClouds, **options)
 
-    # save to excel
-    saveToExcel(target, allTimeSeries)
+    # save to result store
+    store.save(target, allTimeSeries)
+
+    # export to excel?
+    if excel:
+      saveToExcel(target, allTimeSeries)
 
-    return allTimeSeries
\ No newline at end of file
+    return pd.DataFrame(allTimeSeries) if as_frame else allTimeSeries
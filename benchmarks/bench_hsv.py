@@ -0,0 +1,71 @@
+"""
+bench_hsv.py
+
+postProcessing.rgb_to_hsv (numpy, whole columns) against the original
+per-row colorsys conversion (three colorsys calls per row), on random
+reflectances including ties, greys and negative values.
+
+Usage
+python benchmarks/bench_hsv.py [rows]
+"""
+
+import os
+import sys
+import time
+import colorsys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from atmcorr.postProcessing import rgb_to_hsv
+
+def colorsys_hsv(DF):
+  """
+  the original postProcessing.hsv
+  """
+  rgb = list(zip(DF['red'], DF['green'], DF['blue']))
+  DF['hue'] = [colorsys.rgb_to_hsv(x[0], x[1], x[2])[0] for x in rgb]
+  DF['sat'] = [colorsys.rgb_to_hsv(x[0], x[1], x[2])[1] for x in rgb]
+  DF['val'] = [colorsys.rgb_to_hsv(x[0], x[1], x[2])[2] for x in rgb]
+  return DF
+
+def reflectances(rows, seed=0):
+  """
+  red, green and blue columns with ties, greys and negative values
+  (but no zero maximum, where colorsys raises ZeroDivisionError)
+  """
+
+  rng = np.random.RandomState(seed)
+  rgb = rng.uniform(-0.05, 0.6, (rows, 3))
+  ties = rng.rand(rows) < 0.05
+  rgb[ties, 1] = rgb[ties, 0]
+  greys = rng.rand(rows) < 0.05
+  rgb[greys] = rgb[greys, :1]
+  rgb[rgb.max(axis=1) == 0] = 0.1
+
+  return pd.DataFrame(rgb, columns=['red', 'green', 'blue'])
+
+def timed(f, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    t = time.perf_counter()
+    result = f()
+    best = min(best, time.perf_counter() - t)
+  return best, result
+
+def main(rows=200000):
+
+  df = reflectances(rows)
+
+  t_colorsys, expected = timed(lambda: colorsys_hsv(df.copy()), 1)
+  t_numpy, (h, s, v) = timed(lambda: rgb_to_hsv(df['red'], df['green'], df['blue']), 5)
+
+  identical = all(np.array_equal(np.asarray(expected[key]), x) for key, x in [('hue', h), ('sat', s), ('val', v)])
+
+  print('{:,} rows'.format(rows))
+  print('  colorsys, 3 calls per row: {:8.3f} s'.format(t_colorsys))
+  print('  rgb_to_hsv:                {:8.3f} s  ({:.0f}x)'.format(t_numpy, t_colorsys / t_numpy))
+  print('  identical to colorsys:     {}'.format(identical))
+
+if __name__ == '__main__':
+  main(*[int(arg) for arg in sys.argv[1:]])
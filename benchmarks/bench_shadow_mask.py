@@ -0,0 +1,239 @@
+"""
+bench_shadow_mask.py
+
+Request cost of the cloudRemover.shadowMask options, measured by running
+the real shadowMask code against a local stub of the Earth Engine API.
+
+The stub computes nothing. Each image operation becomes a node that costs
+the pixels of its footprint at its scale. The cost of a request is the sum
+over the nodes its output depends on, where ee.Algorithms.If only depends
+on the branch it takes (as on the server). Footprints are squares: an image
+covers the whole tile, and clip() shrinks it to the clip region.
+
+Two costs are reported: the shifted pixels (changeProj, once per cloud
+height) and all pixels, which include the per-pixel steps over the whole
+tile (e.g. dark pixel detection at 10 m) that the options do not clip.
+
+Earth Engine also restricts computation to the pixels a reduction needs, so
+absolute numbers are upper bounds. The ratios compare the options under one
+cost model; they are not measured Earth Engine quotas.
+
+Usage
+python benchmarks/bench_shadow_mask.py
+"""
+
+import os
+import sys
+import math
+import types
+
+TILE = 109800 # Sentinel-2 tile width (m)
+
+class Node:
+  """
+  pixel cost of one operation and the nodes it depends on
+  """
+
+  def __init__(self, pixels=0, inputs=(), kind=None):
+    self.pixels = pixels
+    self.inputs = [node for node in inputs if node is not None]
+    self.kind = kind
+
+def cost(node, kind=None):
+  """
+  pixels of all (distinct) nodes an output depends on (or of one kind)
+  """
+
+  seen, stack, total = set(), [node], 0
+  while stack:
+    node = stack.pop()
+    if id(node) in seen:
+      continue
+    seen.add(id(node))
+    if kind is None or node.kind == kind:
+      total += node.pixels
+    stack.extend(node.inputs)
+
+  return total
+
+
+class Number:
+
+  def __init__(self, value, node=None):
+    self.value = value.value if isinstance(value, Number) else float(value)
+    self.node = value.node if isinstance(value, Number) else node
+
+  def apply(self, f, *others):
+    values = [other.value if isinstance(other, Number) else float(other) for other in others]
+    return Number(f(self.value, *values), self.node)
+
+  def add(self, x): return self.apply(lambda a, b: a + b, x)
+  def subtract(self, x): return self.apply(lambda a, b: a - b, x)
+  def multiply(self, x): return self.apply(lambda a, b: a * b, x)
+  def divide(self, x): return self.apply(lambda a, b: a / b, x)
+  def tan(self): return self.apply(math.tan)
+  def cos(self): return self.apply(math.cos)
+  def sin(self): return self.apply(math.sin)
+  def abs(self): return self.apply(abs)
+  def round(self): return self.apply(round)
+
+
+class Geometry:
+  """
+  square of a given side (m)
+  """
+
+  def __init__(self, side):
+    self.side = side
+
+  def buffer(self, distance):
+    return Geometry(self.side + 2 * Number(distance).value)
+
+
+class Projection:
+
+  def __init__(self, scale):
+    self.scale = scale
+
+  def nominalScale(self):
+    return Number(self.scale)
+
+  def translate(self, x, y):
+    return self
+
+
+class Dictionary:
+
+  def __init__(self, value, node):
+    self.value, self.node = value, node
+
+  def get(self, key, default=None):
+    return Number(self.value, self.node)
+
+
+class Image:
+
+  def __init__(self, side, scale, properties, node=None):
+    self.side = side
+    self.scale = scale
+    self.properties = properties
+    self.node = node or Node()
+
+  def op(self, *others, scale=None, kind=None):
+    scale = scale or min([self.scale] + [o.scale for o in others if isinstance(o, Image)])
+    inputs = [self.node] + [o.node for o in others if isinstance(o, Image)]
+    return Image(self.side, scale, self.properties, Node((self.side / scale)**2, inputs, kind))
+
+  def get(self, key):
+    return Number(self.properties[key])
+
+  def select(self, bands):
+    return self.op(scale=60 if 'QA60' in bands else self.scale)
+
+  def bitwiseAnd(self, x): return self.op(x)
+  def eq(self, x): return self.op(x)
+  def gt(self, x): return self.op(x)
+  def And(self, x): return self.op(x)
+  def Not(self): return self.op()
+  def multiply(self, x): return self.op(x)
+  def unmask(self, x=0): return Image(TILE, self.scale, self.properties, Node((TILE / self.scale)**2, [self.node]))
+  def rename(self, names): return self
+  def normalizedDifference(self, bands): return self.op()
+
+  def projection(self):
+    return Projection(self.scale)
+
+  def changeProj(self, source, target):
+    return self.op(kind='changeProj')
+
+  def clip(self, region):
+    return Image(min(self.side, region.side), self.scale, self.properties, self.node)
+
+  def reduceRegion(self, reducer=None, geometry=None, scale=None, bestEffort=False):
+    side = min(self.side, geometry.side)
+    node = Node((side / scale)**2, [self.node])
+    return Dictionary(1 if self.properties['cloudy'] else 0, node)
+
+
+class List:
+
+  def __init__(self, items):
+    self.items = items
+
+  def sequence(start, end, step=None, count=None):
+    return List([Number(start + (end - start) * i / (count - 1)) for i in range(count)])
+
+  def map(self, f):
+    return List([f(item) for item in self.items])
+
+
+class ImageCollection:
+
+  def __init__(self, images):
+    self.images = images
+
+  def fromImages(images):
+    return ImageCollection(images.items)
+
+  def max(self):
+    first = self.images[0]
+    return first.op(*self.images[1:])
+
+
+def If(condition, true, false):
+  chosen = true if condition.value else false
+  return Image(chosen.side, chosen.scale, chosen.properties, Node(0, [condition.node, chosen.node]))
+
+def install():
+  """
+  the stub as the ee module (before importing atmcorr.cloudRemover)
+  """
+
+  ee = types.ModuleType('ee')
+  ee.Number = Number
+  ee.Geometry = lambda geom: geom
+  ee.List = List
+  ee.ImageCollection = ImageCollection
+  ee.Algorithms = types.SimpleNamespace(If=If)
+  ee.Image = lambda image: image
+  ee.Reducer = types.SimpleNamespace(max=lambda: 'max', mean=lambda: 'mean')
+  sys.modules['ee'] = ee
+
+  return ee
+
+def request_cost(shadowMask, ESAclouds, site=None, cloudy=True, solar_zenith=30, **options):
+  """
+  shifted and total pixels of the shadow mask of a Sentinel-2 tile
+  """
+
+  toa = Image(TILE, 10, {'solar_azimuth':150, 'solar_zenith':solar_zenith, 'cloudy':cloudy})
+  geom = Geometry(site) if site else None
+  node = shadowMask(toa, ESAclouds(toa), geom, **options).node
+
+  return cost(node, 'changeProj'), cost(node)
+
+def main():
+
+  install()
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+  from atmcorr.cloudRemover import shadowMask, ESAclouds
+
+  cases = [
+    ('full tile (default)', {}),
+    ('2 km site, clip', {'site':2000}),
+    ('2 km site, clip, 4 heights', {'site':2000, 'height_count':4}),
+    ('10 km site, clip', {'site':10000}),
+    ('10 km site, clip, 4 heights', {'site':10000, 'height_count':4}),
+    ('2 km site, skip_clear (cloudy)', {'site':2000, 'skip_clear':True, 'cloudy':True}),
+    ('2 km site, skip_clear (clear)', {'site':2000, 'skip_clear':True, 'cloudy':False})
+  ]
+
+  shifted0, total0 = request_cost(shadowMask, ESAclouds)
+  print('{:<32} {:>14} {:>9} {:>14} {:>9}'.format('shadowMask options', 'shifted', 'cheaper', 'all pixels', 'cheaper'))
+  for name, options in cases:
+    shifted, total = request_cost(shadowMask, ESAclouds, **options)
+    print('{:<32} {:>14,.0f} {:>8.1f}x {:>14,.0f} {:>8.1f}x'.format(name, shifted,\
+          shifted0 / shifted if shifted else float('inf'), total, total0 / total))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+# repository root (atmcorr package) and this directory (fake_ee)
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(here), here]
+
+import fake_ee
+
+@pytest.fixture
+def ee():
+  """
+  fake Earth Engine module, atmcorr modules are re-imported against it
+  (and the modules imported before the test are restored afterwards, so
+  other tests keep using the classes they imported)
+  """
+
+  def imported():
+    return {k:v for k, v in sys.modules.items() if k in ('ee', 'atmcorr') or k.startswith('atmcorr.')}
+
+  before = imported()
+  yield fake_ee.install()
+  for name in imported():
+    del sys.modules[name]
+  sys.modules.update(before)
@@ -0,0 +1,117 @@
+"""
+fake_ee.py
+
+Local stand-in for the Earth Engine client library, so requests can be
+built (not run) without network or credentials.
+
+Every attribute lookup and call on the fake module returns a Node that
+records the expression, e.g. ee.Image('x').divide(1000) is recorded as
+['call', ['attr', ['call', ['ee', 'Image'], ['x'], {}], 'divide'], [1000], {}].
+Python functions passed as arguments (e.g. to ImageCollection.map) are
+called with placeholder nodes, as the real client does, so their graph is
+recorded too. Node.serialize() returns the whole graph as JSON.
+
+Usage
+ee = fake_ee.install()
+from atmcorr.ee_requests import request_meanRadiance
+request_meanRadiance(ee.Geometry.Point(85, 25), '2017-01-01', '2017-02-01', 'Sentinel2', True).serialize()
+"""
+
+import sys
+import json
+import types
+import inspect
+import importlib
+import threading
+
+# depth of nested functions being recorded (per thread)
+local = threading.local()
+
+class EEException(Exception):
+  pass
+
+def encode(value):
+  """
+  JSON-compatible expression of a value
+  """
+
+  if isinstance(value, Node):
+    return value.expr
+  if isinstance(value, dict):
+    return {str(k):encode(v) for k, v in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [encode(v) for v in value]
+  if isinstance(value, (str, int, float, bool)) or value is None:
+    return value
+  if callable(value):
+    return encode_function(value)
+  return repr(value)
+
+def encode_function(function):
+  """
+  calls a function with placeholder arguments and records its result
+  """
+
+  parameters = [p for p in inspect.signature(function).parameters.values() \
+                if p.default is p.empty and p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+  depth = getattr(local, 'depth', 0)
+  names = ['_var_{}_{}'.format(depth, i) for i in range(len(parameters))]
+
+  local.depth = depth + 1
+  try:
+    result = function(*[Node(['var', name]) for name in names])
+  finally:
+    local.depth = depth
+
+  return ['function', names, encode(result)]
+
+
+class Node:
+  """
+  recorded Earth Engine expression
+  """
+
+  def __init__(self, expr):
+    self.expr = expr
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return Node(['attr', self.expr, name])
+
+  def __call__(self, *args, **kwargs):
+    return Node(['call', self.expr, encode(args), encode(kwargs)])
+
+  def serialize(self):
+    return json.dumps(self.expr, sort_keys=True)
+
+  def getInfo(self):
+    raise EEException('fake_ee builds requests only, it cannot run them')
+
+
+class FakeModule(types.ModuleType):
+
+  EEException = EEException
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return Node(['ee', name])
+
+  def Initialize(self, *args, **kwargs):
+    pass
+
+
+def install():
+  """
+  replaces the ee module with the fake and re-imports atmcorr modules
+  (which create Earth Engine objects on import) against it
+  """
+
+  ee = FakeModule('ee')
+  sys.modules['ee'] = ee
+  for name in [name for name in sys.modules if name == 'atmcorr' or name.startswith('atmcorr.')]:
+    del sys.modules[name]
+  importlib.invalidate_caches()
+
+  return ee
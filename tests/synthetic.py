@@ -0,0 +1,84 @@
+"""
+synthetic.py
+
+Small synthetic 6S look up tables (same layout as the downloaded .lut files)
+and iLUT handlers built from them, for tests without downloads
+"""
+
+import os
+from itertools import product
+import numpy as np
+import atmcorr.interpolated_lookup_tables as iLUT
+import atmcorr.mission_specifics as mission_s
+
+GRID = {
+  'solar_zs':[0, 20, 40, 60],
+  'H2Os':[0.5, 2, 4],
+  'O3s':[0.2, 0.4],
+  'AOTs':[0.05, 0.2, 0.5],
+  'alts':[0, 1, 2]
+}
+
+def coefficients(solar_z, h2o, o3, aot, alt, band=0):
+  """
+  smooth (a, b) of a plausible magnitude (i.e. path radiance and transmission)
+  """
+  mu = np.cos(np.radians(solar_z))
+  a = (5 + band) * aot * (1 + 0.3 * (1 - mu)) + 0.2 * h2o - 0.5 * alt * aot
+  b = (1500 - 100 * band) * mu * np.exp(-aot / mu) * (1 - 0.02 * h2o) * (1 - 0.1 * o3) * (1 + 0.03 * alt)
+  return a, b
+
+# spacing closer to the 6S look up tables (slower to triangulate)
+DENSE_GRID = {
+  'solar_zs':[0, 10, 20, 30, 40, 50, 60],
+  'H2Os':[0.5, 1, 2, 3, 5],
+  'O3s':[0.2, 0.4],
+  'AOTs':[0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5],
+  'alts':[0, 1, 2]
+}
+
+def LUT(band=0, grid=GRID):
+  """
+  look up table in the .lut layout, i.e. {'config':{'invars':..}, 'outputs':..}
+  """
+  inputs = list(product(*[grid[key] for key in iLUT.INVARS]))
+  outputs = [coefficients(*x, band=band) for x in inputs]
+  return {'config':{'invars':dict(grid)}, 'outputs':[[float(a), float(b)] for a, b in outputs]}
+
+def handler(mission='Landsat8', engine='delaunay'):
+  """
+  iLUT handler of a mission with synthetic iLUTs (one per waveband)
+  """
+  iLUTs = iLUT.handler(mission, engine=engine)
+  iLUTs.iLUTs = {band:iLUT.build_interpolator(LUT(i), engine) \
+                 for i, band in enumerate(mission_s.py6s_bandnames(mission))}
+  return iLUTs
+
+def inside(n, seed=0):
+  """
+  n random (solar_z, h2o, o3, aot, alt) inside the grid
+  """
+  rng = np.random.RandomState(seed)
+  return np.column_stack([rng.uniform(min(GRID[key]), max(GRID[key]), n) for key in iLUT.INVARS])
+
+def write_iLUTs(path, mission='Landsat8', engine='regular'):
+  """
+  saves synthetic iLUT files of a mission in path (as handler(path=path) loads them)
+  """
+  for i, band in enumerate(mission_s.py6s_bandnames(mission)):
+    filepath = os.path.join(str(path), '{}_{}{}'.format(mission_s.py6S_sensor(mission), band, iLUT.ENGINES[engine]))
+    iLUT.save_iLUT(iLUT.build_interpolator(LUT(i), engine), filepath, engine)
+  return str(path)
+
+def features(timeStamps, mission='Landsat8', seed=0):
+  """
+  mean radiance features (as returned by Earth Engine) of scenes at timeStamps
+  """
+  bands = mission_s.ee_bandnames(mission)
+  points = inside(len(timeStamps), seed)
+  return [{'properties':{
+    'imageID':'scene{:.0f}'.format(timeStamp),
+    'timeStamp':timeStamp,
+    'mean_averages':{band:40.0 + 10 * j for j, band in enumerate(bands)},
+    'atmcorr_inputs':{'solar_z':solar_z, 'h2o':h2o, 'o3':o3, 'aot':aot, 'alt':alt, 'doy':1}
+  }} for timeStamp, (solar_z, h2o, o3, aot, alt) in zip(timeStamps, points)]
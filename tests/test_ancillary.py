@@ -0,0 +1,124 @@
+"""
+Offline ancillary backends (GriddedAncillary, AncillaryCache) and the tables
+requests consume, no Earth Engine needed
+"""
+
+import os
+import sys
+import subprocess
+import datetime
+import calendar
+import numpy as np
+import pytest
+
+def millis(*args):
+  return calendar.timegm(datetime.datetime(*args).timetuple()) * 1000
+
+def test_import_without_earth_engine():
+  # a fresh interpreter, i.e. the real (uninitialized) Earth Engine client
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  result = subprocess.run([sys.executable, '-c', 'import atmcorr.ancillary, atmcorr.checkpoints'],\
+                          cwd=root, capture_output=True, text=True)
+  assert result.returncode == 0, result.stderr
+
+def june_grids(path):
+  """
+  local grids of June 2010, every 6 hours (water, Earth Engine units kg/m^2)
+  and daily (ozone, Dobson units), with fill values
+  """
+  from atmcorr.ancillary import save_grid
+
+  lat, lon = [20, 30], [80, 90]
+
+  def grid(dataset, keys, values):
+    values = np.broadcast_to(np.asarray(values, dtype=float)[:, None, None], (len(keys), 2, 2))
+    save_grid(str(path / (dataset+'.npz')), dataset, keys, lat, lon, values)
+
+  hours = np.arange(millis(2010, 6, 1), millis(2010, 7, 1), 6 * 3600000)
+  days = np.arange(millis(2010, 6, 1), millis(2010, 7, 1), 24 * 3600000)
+  grid('water', hours, 20.0 + np.arange(len(hours)) % 10)
+  grid('ozone', days, 300.0 + np.arange(len(days)))
+  grid('ozone_fill', np.arange(366), 250.0 + np.arange(366) / 10)
+  grid('aerosol', [millis(2010, 6, 1)], [150.0])
+  grid('aerosol_fill', np.arange(1, 13), 0.5 + np.arange(12) / 100)
+
+  return str(path)
+
+def test_gridded_inputs(tmp_path):
+  from atmcorr.ancillary import GriddedAncillary
+
+  backend = GriddedAncillary(june_grids(tmp_path))
+  times = [millis(2010, 6, 15, 10, 30), millis(2010, 8, 1, 12)]
+  h2o, o3, aot = backend.inputs([85, 85], [25, 25], times)
+
+  # in June, dataset values (Py6S units), in August only the fills
+  assert np.allclose(h2o[0], 2.8) and np.isnan(h2o[1])
+  assert np.allclose(o3, [0.314, 0.2712])
+  assert np.allclose(aot, [0.15, 0.57])
+
+def test_time_step_keys():
+  from atmcorr.ancillary import water_keys, ozone_keys, aerosol_keys
+
+  # as Atmospheric.water_key, ozone_key and aerosol_key on the server
+  times = [millis(2010, 6, 15, 10, 30), millis(2010, 6, 16, 23, 10), millis(1999, 3, 2, 12)]
+  assert list(water_keys(times)) == ['2010-06-15T12', '2010-06-17T00', '1999-03-02T12']
+  assert list(ozone_keys(times)) == ['2010-06-15/2010-06-15', '2010-06-17/2010-06-16', '1999-03-03/1999-03-02']
+  assert list(aerosol_keys(times)) == ['2010-06/6', '2010-07/6', 'fill/3']
+
+def test_table_values_match_inputs(tmp_path):
+  from atmcorr.ancillary import GriddedAncillary, water_keys, ozone_keys, aerosol_keys
+
+  backend = GriddedAncillary(june_grids(tmp_path))
+  h2o, o3, aot = backend.table_values(85, 25, '2010-06-01', '2010-07-01')
+
+  # any acquisition time in the date range (e.g. just before midnight)
+  rng = np.random.RandomState(0)
+  times = rng.randint(millis(2010, 6, 1), millis(2010, 7, 1), 500).astype('int64')
+  times[:3] = [millis(2010, 6, 1), millis(2010, 6, 30, 23, 59), millis(2010, 6, 10, 21)]
+  expected = backend.inputs(85, 25, times)
+  for table, keys, values in zip([h2o, o3, aot], [water_keys, ozone_keys, aerosol_keys], expected):
+    found = np.array([table.get(key, np.nan) for key in keys(times)])
+    assert np.allclose(found, values, equal_nan=True)
+
+  # water vapour after the end of the grid is missing (i.e. None on the server)
+  assert np.isnan(expected[0][1]) == (water_keys(times[1:2])[0] not in h2o)
+
+class Features:
+
+  def __init__(self, features):
+    self.features = features
+
+  def getInfo(self):
+    return {'features':self.features}
+
+def stub_request(lon, lat, start, stop, fills=False):
+  """
+  AncillaryCache.request without Earth Engine, i.e. constant values
+  """
+  def features(dataset, keys, value):
+    return [{'properties':{'dataset':dataset, 'key':int(k), 'value':value}} for k in keys]
+  fs = features('water', np.arange(start, stop, 6 * 3600000), 25.0) + features('ozone', np.arange(start, stop, 24 * 3600000), 300.0)
+  if fills:
+    fs += features('ozone_fill', range(366), 250.0) + features('aerosol_fill', range(1, 13), 0.5)
+  return Features(fs)
+
+def test_cache_table_needs_prefetch(ee, tmp_path):
+  from atmcorr.ancillary import AncillaryCache
+  from atmcorr.ee_requests import request_meanRadiance
+
+  cache = AncillaryCache(path=str(tmp_path / 'cache.pkl'))
+  cache.request = stub_request
+  with pytest.raises(ValueError, match='prefetch'):
+    cache.table(85, 25, '2010-06-01', '2010-07-01')
+
+  cache.prefetch(85, 25, '2010-06-01', '2010-07-01')
+  h2o, o3, aot = cache.table_values(85, 25, '2010-06-01', '2010-07-01')
+  assert h2o['2010-06-15T12'] == 2.5 and o3['2010-06-16/2010-06-15'] == 0.3 and aot['2010-06/6'] == 0.5
+
+  # the request only consumes the table (fake_ee getInfo would raise), no ancillary reductions
+  cache.request = None
+  table = cache.table(85, 25, '2010-06-01', '2010-07-01')
+  graph = request_meanRadiance(ee.Geometry.Point(85, 25), '2010-06-01', '2010-07-01', 'Landsat7', True,\
+                               ancillary_table=table).serialize()
+  assert 'NCEP_RE/surface_wv' not in graph and 'TOMS/MERGED' not in graph
+  assert '"2010-06-15T12": 2.5' in graph
@@ -0,0 +1,47 @@
+"""
+Scalar and vectorized (batch) atmospheric correction of mean radiances
+"""
+
+import numpy as np
+import synthetic
+from atmcorr.atmcorr_timeseries import surface_reflectance_timeseries
+import atmcorr.mission_specifics as mission_s
+
+MISSION = 'Landsat8'
+
+def features():
+  bands = mission_s.ee_bandnames(MISSION)
+  points = synthetic.inside(6)
+  fs = []
+  for i, (solar_z, h2o, o3, aot, alt) in enumerate(points):
+    fs.append({'properties':{
+      'imageID':'scene{}'.format(i),
+      'timeStamp':1e9 + i * 86400,
+      'mean_averages':{band:40.0 + 10 * j for j, band in enumerate(bands)},
+      'atmcorr_inputs':{'solar_z':solar_z, 'h2o':h2o, 'o3':o3, 'aot':aot, 'alt':alt, 'doy':1 + 60 * i}
+    }})
+
+  # missing radiance, missing input, outside of the look up table
+  fs[1]['properties']['mean_averages'][bands[0]] = None
+  del fs[2]['properties']['mean_averages'][bands[1]]
+  fs[3]['properties']['atmcorr_inputs']['aot'] = None
+  fs[4]['properties']['atmcorr_inputs']['solar_z'] = 85
+
+  return {'features':fs}
+
+def test_batch_matches_scalar():
+  iLUTs = synthetic.handler(MISSION)
+  scalar = surface_reflectance_timeseries(features(), iLUTs, MISSION)
+  batch = surface_reflectance_timeseries(features(), iLUTs, MISSION, batch=True)
+
+  assert scalar['imageID'] == batch['imageID']
+  assert scalar['timeStamp'] == batch['timeStamp']
+  for band in mission_s.ee_bandnames(MISSION):
+    assert all(type(x) is float for x in scalar[band] + batch[band])
+    assert np.allclose(scalar[band], batch[band], rtol=1e-12, equal_nan=True)
+
+  # failed scenes are NaN in both engines
+  bands = mission_s.ee_bandnames(MISSION)
+  assert np.isnan(scalar[bands[0]][1]) and np.isnan(scalar[bands[1]][2])
+  assert all(np.isnan(scalar[band][i]) for band in bands for i in [3, 4])
+  assert np.isfinite(scalar[bands[0]][0])
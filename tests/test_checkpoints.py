@@ -0,0 +1,73 @@
+"""
+test_checkpoints.py
+
+Resumed (checkpointed) extraction against a stub client
+"""
+
+import pytest
+import synthetic
+from atmcorr.checkpoints import CheckpointStore, options_hash
+from atmcorr.result_store import to_timestamp
+
+MISSION = 'Landsat8'
+
+class Client:
+  """
+  stub Earth Engine client, one scene every 10 days
+  """
+
+  def __init__(self):
+    self.calls = []
+
+  def __call__(self, geom, startDate, stopDate, mission, removeClouds, **request_options):
+    self.calls.append((startDate, stopDate, request_options))
+    timeStamps = range(int(to_timestamp(startDate)), int(to_timestamp(stopDate)), 10 * 86400)
+    return {'features':synthetic.features(list(timeStamps), mission)}
+
+@pytest.fixture
+def extract(ee, monkeypatch, tmp_path):
+  import atmcorr.interpolated_lookup_tables as iLUT
+  from atmcorr.timeSeries import timeseries_extrator
+
+  iLUTs = synthetic.handler(MISSION)
+  monkeypatch.setattr(iLUT.registry, 'get', lambda mission, engine='delaunay': iLUTs)
+  store = CheckpointStore(str(tmp_path))
+
+  def extract(client, **options):
+    options.setdefault('target', 'site')
+    return timeseries_extrator(None, '2010-01-01', '2013-01-01', MISSION, client=client,\
+                               checkpoints=store, chunk_days=365, **options)
+
+  return extract
+
+def test_resume_makes_no_requests(extract):
+  client = Client()
+  first = extract(client)
+  assert len(client.calls) == 4 # 2012 is a leap year, i.e. 3 x 365 days + 1
+
+  client = Client()
+  assert extract(client) == first
+  assert client.calls == []
+
+  # ancillary lookups do not change the features
+  assert extract(client, request_options={'dedupe_ancillary':True}) == first
+  assert client.calls == []
+
+def test_request_options_invalidate_checkpoints(extract):
+  extract(Client())
+  client = Client()
+  options = {'cloud_options':{'clip':True}}
+  extract(client, request_options=options)
+  assert len(client.calls) == 4
+  assert all(call[2] == options for call in client.calls)
+  assert options_hash(True, options) != options_hash(True)
+
+  client = Client()
+  extract(client, request_options=options)
+  assert client.calls == []
+
+def test_checkpoints_need_a_target(extract):
+  client = Client()
+  with pytest.raises(ValueError, match='target'):
+    extract(client, target=None)
+  assert client.calls == []
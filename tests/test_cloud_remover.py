@@ -0,0 +1,15 @@
+"""
+cloudRemover.shadowMask options against a fake ee
+"""
+
+def test_skip_clear_has_a_default(ee):
+  from atmcorr.cloudRemover import shadowMask, ESAclouds
+
+  toa = ee.Image('COPERNICUS/S2/20170101T044222_20170101T044221_T45RUL')
+  geom = ee.Geometry.Point(85.6, 25.7)
+  graph = shadowMask(toa, ESAclouds(toa), geom, skip_clear=True).serialize()
+
+  # the cloud flag is read by band name, with an explicit default for empty dictionaries
+  assert '"get"], ["clouds", 0]' in graph
+  assert '"values"]' not in graph
+  assert '["clouds"]' in graph
@@ -0,0 +1,98 @@
+"""
+test_coefficient_cache.py
+
+CoefficientCache hits, LRU bound, persistence and agreement with the iLUT
+"""
+
+import numpy as np
+import pytest
+import atmcorr.interpolated_lookup_tables as iLUT
+from atmcorr.coefficient_cache import CoefficientCache
+import synthetic
+
+class Counted:
+  """
+  iLUT that counts the points it interpolates
+  """
+
+  def __init__(self, iLUT):
+    self.iLUT = iLUT
+    self.calls = 0
+    self.points = 0
+
+  def __call__(self, points):
+    self.calls += 1
+    self.points += len(points)
+    return self.iLUT(points)
+
+@pytest.fixture(scope='module')
+def regular():
+  return iLUT.build_interpolator(synthetic.LUT(), 'regular')
+
+def test_quantized_inputs_hit(regular):
+  cache, counted = CoefficientCache(), Counted(regular)
+  first = cache.lookup('B1', counted, 30.01, 1.5, 0.3, 0.2, 0.5)
+  second = cache.lookup('B1', counted, 30.04, 1.502, 0.3002, 0.2001, 0.5)
+  assert np.array_equal(first, second) and counted.points == 1
+  assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+  # other band or input step
+  cache.lookup('B2', counted, 30.01, 1.5, 0.3, 0.2, 0.5)
+  cache.lookup('B1', counted, 30.1, 1.5, 0.3, 0.2, 0.5)
+  assert counted.points == 3
+
+def test_lookup_many(regular):
+  cache, counted = CoefficientCache(), Counted(regular)
+  inputs = synthetic.inside(20)
+  repeated = np.vstack([inputs, inputs, [[np.nan, 1, 0.3, 0.2, 0]]])
+  perihelion = cache.lookup_many('B1', counted, repeated)
+  assert perihelion.shape == (41, 2)
+  assert np.array_equal(perihelion[:20], perihelion[20:40])
+  assert np.isnan(perihelion[40]).all()
+  assert cache.stats()['misses'] == 20 and cache.stats()['hits'] == 20
+  assert cache.stats()['size'] == 20
+
+  # one iLUT call for all misses (plus one for the non-finite row)
+  assert counted.calls == 2
+  cache.lookup_many('B1', counted, inputs)
+  assert counted.calls == 2
+
+def test_lru_bound(regular):
+  cache, counted = CoefficientCache(maxsize=3), Counted(regular)
+  inputs = synthetic.inside(4)
+  for x in inputs:
+    cache.lookup('B1', counted, *x)
+  assert cache.stats()['size'] == 3
+  cache.lookup('B1', counted, *inputs[0]) # evicted (least recently used)
+  assert counted.points == 5
+  cache.lookup('B1', counted, *inputs[3])
+  assert counted.points == 5
+
+def test_save_and_load(regular, tmp_path):
+  path = str(tmp_path / 'coefficients.cache')
+  cache = CoefficientCache(path=path)
+  inputs = synthetic.inside(10)
+  expected = cache.lookup_many('B1', regular, inputs)
+  cache.save()
+
+  counted = Counted(regular)
+  loaded = CoefficientCache(path=path)
+  assert loaded.stats()['size'] == 10
+  assert np.array_equal(loaded.lookup_many('B1', counted, inputs), expected)
+  assert counted.points == 0
+
+  # other resolution, saved coefficients are ignored
+  assert CoefficientCache(resolution=0.5, path=path).stats()['size'] == 0
+
+def test_cached_values_match_interpolation(regular):
+  cache = CoefficientCache()
+  inputs = synthetic.inside(500)
+  cached = cache.lookup_many('B1', regular, inputs)
+  assert np.array_equal(cached, regular(cache.quantize(inputs)))
+
+  # within the change of the iLUT over half a quantization step (per input)
+  uncached = regular(inputs)
+  lower, upper = [axis[0] for axis in regular.axes], [axis[-1] for axis in regular.axes]
+  steps = np.diag(cache.resolution / 2)
+  bound = sum(np.abs(regular(np.clip(inputs + step, lower, upper)) - uncached) for step in np.vstack([steps, -steps]))
+  assert (np.abs(cached - uncached) <= 1.01 * bound + 1e-12).all()
@@ -0,0 +1,14 @@
+"""
+Coefficients request (coefficients.request_inputs) built against a fake ee
+"""
+
+def test_request_inputs(ee):
+  from atmcorr.coefficients import request_inputs
+
+  geom = ee.Geometry.Point(85.6, 25.7)
+  graph = request_inputs(geom, '2016-11-19', '2017-02-17', 'Landsat8').serialize()
+
+  # SRTM altitude and every image (no sun angle filter)
+  assert '"CGIAR/SRTM90_V4"' in graph and 'USGS/GMTED2010' not in graph
+  assert '"SUN_ELEVATION", 15' not in graph
+  assert '"LANDSAT/LC8_L1T_TOA_FMASK"' in graph
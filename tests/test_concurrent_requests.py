@@ -0,0 +1,32 @@
+"""
+TimeSeries requests built concurrently (one instance per request) against
+a fake ee
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+def test_concurrent_builds_are_independent(ee):
+  from atmcorr.ee_requests import request_meanRadiance
+
+  sites = [(85.5, 25.7), (-3.2, 55.9), (151.2, -33.9)]
+  missions = ['Sentinel2', 'Landsat8', 'Landsat7']
+  jobs = [(site, mission) for site in sites for mission in missions]
+
+  def build(job):
+    (lon, lat), mission = job
+    request = request_meanRadiance(ee.Geometry.Point(lon, lat), '2017-01-01', '2017-03-01', mission, True)
+    return request.serialize()
+
+  with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+    concurrent = list(pool.map(build, jobs * 2))
+
+  # one distinct graph per (site, mission), whichever thread built it
+  assert len(set(concurrent)) == len(jobs)
+  assert concurrent == [build(job) for job in jobs * 2]
+
+  # each graph holds its own site and mission only
+  for ((lon, lat), mission), graph in zip(jobs, concurrent):
+    assert '[{}, {}]'.format(lon, lat) in graph
+    for other in sites:
+      if other != (lon, lat):
+        assert '[{}, {}]'.format(*other) not in graph
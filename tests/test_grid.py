@@ -0,0 +1,105 @@
+"""
+test_grid.py
+
+CoefficientField node values and bilinear upsampling, and spatial_coefficients
+against the iLUTs evaluated at each node
+"""
+
+import numpy as np
+import pytest
+from atmcorr.atmcorr_timeseries import elliptical_orbit_correction
+from atmcorr.grid import CoefficientField, spatial_coefficients, grid_nodes
+from atmcorr.raster import day_of_year
+import atmcorr.mission_specifics as mission_s
+import synthetic
+
+# 3 x 4 nodes on a 5 x 7 raster, i.e. nodes at even rows and columns
+NODES = np.random.RandomState(0).uniform(0, 100, (2, 3, 4))
+SHAPE = (5, 7)
+
+def bilinear(grid, y, x):
+  """
+  bilinear value at fractional node position (y, x)
+  """
+  i, j = min(int(y), grid.shape[0] - 2), min(int(x), grid.shape[1] - 2)
+  wy, wx = y - i, x - j
+  return (grid[i, j] * (1 - wy) * (1 - wx) + grid[i, j + 1] * (1 - wy) * wx +\
+          grid[i + 1, j] * wy * (1 - wx) + grid[i + 1, j + 1] * wy * wx)
+
+def test_nodes_exact():
+  field = CoefficientField(NODES, SHAPE)
+  for band in range(2):
+    values = field(band, 0, SHAPE[0])
+    assert values.shape == SHAPE and values.dtype == np.float32
+    # every node, including edges and corners
+    assert np.array_equal(values[::2, ::2], NODES[band].astype('float32'))
+    assert values[0, 0] == np.float32(NODES[band, 0, 0])
+    assert values[-1, -1] == np.float32(NODES[band, -1, -1])
+    assert values[0, -1] == np.float32(NODES[band, 0, -1])
+    assert values[-1, 0] == np.float32(NODES[band, -1, 0])
+
+def test_bilinear_between_nodes():
+  field = CoefficientField(NODES, SHAPE)
+  values = field(1, 0, SHAPE[0])
+  expected = np.array([[bilinear(NODES[1], r / 2, c / 2) for c in range(SHAPE[1])] for r in range(SHAPE[0])])
+  assert np.allclose(values, expected, rtol=1e-6)
+
+  # midpoints of edges and cells
+  assert values[1, 0] == pytest.approx((NODES[1, 0, 0] + NODES[1, 1, 0]) / 2, rel=1e-6)
+  assert values[0, 1] == pytest.approx((NODES[1, 0, 0] + NODES[1, 0, 1]) / 2, rel=1e-6)
+  assert values[1, 1] == pytest.approx(NODES[1, :2, :2].mean(), rel=1e-6)
+
+def test_uneven_spacing():
+  # 3 nodes on 4 rows: positions 0, 2/3, 4/3, 2
+  field = CoefficientField(NODES[:, :, :2], (4, 1))
+  values = field(0, 0, 4)[:, 0]
+  expected = [bilinear(NODES[0, :, :2], r * 2 / 3, 0) for r in range(4)]
+  assert np.allclose(values, expected, rtol=1e-6)
+  assert values[0] == np.float32(NODES[0, 0, 0]) and values[-1] == np.float32(NODES[0, -1, 0])
+
+def test_blocks_match_whole_raster():
+  field = CoefficientField(NODES, SHAPE)
+  whole = field(0, 0, SHAPE[0])
+  blocks = np.vstack([field(0, r0, min(r0 + 2, SHAPE[0])) for r0 in range(0, SHAPE[0], 2)])
+  assert np.array_equal(whole, blocks)
+
+def test_single_node_is_constant():
+  field = CoefficientField(np.full((1, 1, 1), 7.5), (3, 4))
+  assert np.array_equal(field(0, 0, 3), np.full((3, 4), 7.5, dtype='float32'))
+
+
+class NodeAncillary:
+  """
+  ancillary backend whose inputs vary across the nodes
+  """
+
+  def inputs(self, lon, lat, times):
+    lon, lat = np.asarray(lon), np.asarray(lat)
+    return 1 + 0.5 * (lon - 85), 0.25 + 0.1 * (lat - 27), 0.1 + 0.2 * (lon - 85) * (lat - 27)
+
+def test_spatial_coefficients_at_nodes():
+  mission = 'Sentinel2'
+  iLUTs = synthetic.handler(mission, 'regular')
+  bounds, nodes, shape = (85, 27, 86, 28), (3, 3), (5, 5)
+  time = 1485388800000 # 2017-01-26
+  properties = {'system:time_start':time, 'MEAN_SOLAR_ZENITH_ANGLE':35.0}
+  altitude = np.array([[0.2, 0.4, 0.6], [0.3, 0.5, 0.7], [0.4, 0.6, 0.8]])
+
+  a, b = spatial_coefficients(bounds, shape, mission, properties, NodeAncillary(),\
+                              nodes=nodes, altitude=altitude, iLUTs=iLUTs)
+
+  lons, lats = grid_nodes(bounds, nodes)
+  h2o, o3, aot = NodeAncillary().inputs(lons, lats, None)
+  orbit_correction = elliptical_orbit_correction(day_of_year(time))
+  for k, band in enumerate(mission_s.py6s_bandnames(mission)):
+    fieldA, fieldB = a(k, 0, shape[0]), b(k, 0, shape[0])
+    for i in range(nodes[0]):
+      for j in range(nodes[1]):
+        point = [[35.0, h2o[i, j], o3[i, j], aot[i, j], altitude[i, j]]]
+        expected = np.asarray(iLUTs.iLUTs[band](point), dtype=float).ravel() * orbit_correction
+        assert fieldA[2 * i, 2 * j] == pytest.approx(expected[0], rel=1e-5)
+        assert fieldB[2 * i, 2 * j] == pytest.approx(expected[1], rel=1e-5)
+
+    # halfway between nodes
+    assert fieldA[1, 2] == pytest.approx((fieldA[0, 2] + fieldA[2, 2]) / 2, rel=1e-5)
+    assert fieldB[3, 3] == pytest.approx(fieldB[2:5:2, 2:5:2].mean(), rel=1e-5)
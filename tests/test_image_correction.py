@@ -0,0 +1,80 @@
+"""
+Server-side correction and dry-run exports (image_correction) against a fake ee
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import atmcorr.mission_specifics as mission_s
+
+MISSION = 'Landsat8'
+
+def coefficients():
+  bands = mission_s.ee_bandnames(MISSION)
+  df = pd.DataFrame({'imageID':['LC81400422016001', 'LC81400422016017', 'LC81400422016033']})
+  for j, band in enumerate(bands):
+    df[band+'_a'] = [1.0 + j, 2.0 + j, 3.0 + j]
+    df[band+'_b'] = [100.0 + j, 200.0 + j, 300.0 + j]
+  df.loc[1, bands[2]+'_a'] = np.nan # no coefficients
+  return df
+
+class Batch:
+  """
+  ee.batch that records export tasks
+  """
+
+  def __init__(self):
+    self.started = []
+    batch = self
+
+    class Task:
+      def __init__(self, **config):
+        self.config = config
+      def start(self):
+        batch.started.append(self.config)
+
+    self.Export = type('Export', (), {'image':type('image', (), {'toDrive':staticmethod(Task)})})
+
+def test_corrected_collection(ee):
+  from atmcorr.image_correction import corrected_collection
+
+  geom = ee.Geometry.Point(85.6, 25.7)
+  graph = json.loads(corrected_collection(geom, '2016-01-01', '2016-03-01', MISSION, coefficients()).serialize())
+  text = json.dumps(graph)
+
+  # scenes with coefficients only, a and b in waveband order
+  assert '["system:index", ["LC81400422016001", "LC81400422016033"]]' in text
+  bands = mission_s.ee_bandnames(MISSION)
+  assert json.dumps({'a':[1.0 + j for j in range(len(bands))], 'b':[100.0 + j for j in range(len(bands))]}) in text
+
+  # (radiance - a) / b
+  assert '"subtract"]' in text and '"divide"]' in text
+  assert '"atmcorr_a"' in text and '"atmcorr_b"' in text
+
+def test_dry_run_export(ee):
+  from atmcorr.image_correction import corrected_collection, export_corrected
+
+  ee.batch = Batch()
+  geom = ee.Geometry.Point(85.6, 25.7)
+  df = coefficients()
+  ic = corrected_collection(geom, '2016-01-01', '2016-03-01', MISSION, df)
+  plan = export_corrected(ic, df, MISSION, geom, folder='atmcorr', dry_run=True, crs='EPSG:4326')
+
+  assert [task['images'] for task in plan] == [['LC81400422016001'], ['LC81400422016033']]
+  assert [task['description'] for task in plan] == ['atmcorr_LC81400422016001', 'atmcorr_LC81400422016033']
+  for task in plan:
+    assert (task['folder'], task['scale'], task['maxPixels'], task['crs']) == ('atmcorr', 30, 1e13, 'EPSG:4326')
+    assert task['region'] is geom
+    assert task['fileNamePrefix'] == task['description']
+    assert '["system:index", "{}"]'.format(task['images'][0]) in task['image'].serialize()
+  assert ee.batch.started == []
+
+  # stacked, one image of all scenes
+  stacked = export_corrected(ic, df, MISSION, geom, stack=True, scale=60, dry_run=True)
+  assert [(task['description'], task['images'], task['scale']) for task in stacked] == \
+         [('atmcorr', ['LC81400422016001', 'LC81400422016033'], 60)]
+  assert ee.batch.started == []
+
+  # without dry_run, one started task per scene
+  export_corrected(ic, df, MISSION, geom, folder='atmcorr')
+  assert [config['description'] for config in ee.batch.started] == [task['description'] for task in plan]
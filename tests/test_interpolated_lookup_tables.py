@@ -0,0 +1,74 @@
+"""
+test_interpolated_lookup_tables.py
+
+'regular' against 'delaunay' iLUTs and the memory-mappable (.mlut) format,
+on a synthetic look up table
+"""
+
+from itertools import product
+import numpy as np
+import pytest
+from scipy.interpolate import RegularGridInterpolator
+import atmcorr.interpolated_lookup_tables as iLUT
+import synthetic
+
+@pytest.fixture(scope='module')
+def engines():
+  LUT = synthetic.LUT(grid=synthetic.DENSE_GRID)
+  return LUT, iLUT.build_interpolator(LUT, 'delaunay'), iLUT.build_interpolator(LUT, 'regular')
+
+def test_engines_agree_within_rtol(engines):
+  LUT, delaunay, regular = engines
+  assert max(iLUT.engine_agreement(delaunay, regular, n=5000)) <= iLUT.REGULAR_GRID_RTOL
+
+def test_engines_reproduce_grid_nodes(engines):
+  LUT, delaunay, regular = engines
+  nodes = np.array(list(product(*[synthetic.DENSE_GRID[key] for key in iLUT.INVARS])), dtype=float)
+  outputs = np.array(LUT['outputs'])
+  assert np.allclose(regular(nodes), outputs, rtol=1e-12)
+  assert np.allclose(delaunay(nodes), outputs, rtol=1e-9)
+
+def test_regular_matches_scipy(engines):
+  LUT, delaunay, regular = engines
+  points = synthetic.inside(100)
+  scipy_iLUT = RegularGridInterpolator(regular.axes, regular.values)
+  assert np.array_equal(regular(points), scipy_iLUT(points))
+  assert np.array_equal(regular(*points.T), regular(points))
+
+def test_regular_outside_grid_is_nan(engines):
+  LUT, delaunay, regular = engines
+  assert np.isnan(regular(70, 1, 0.3, 0.1, 0)).all()
+
+def test_mmap_round_trip(engines, tmp_path):
+  LUT, delaunay, regular = engines
+  filepath = str(tmp_path / 'band.mlut')
+  iLUT.save_mmap_iLUT(regular, filepath)
+  loaded = iLUT.load_mmap_iLUT(filepath)
+  assert isinstance(loaded.values, np.memmap)
+  assert [a.tolist() for a in loaded.axes] == [a.tolist() for a in regular.axes]
+  points = synthetic.inside(200)
+  assert np.array_equal(loaded(points), regular(points))
+
+def test_load_mmap_rejects_other_files(tmp_path):
+  filepath = str(tmp_path / 'band.mlut')
+  with open(filepath, 'wb') as f:
+    f.write(b'not an iLUT file')
+  with pytest.raises(ValueError):
+    iLUT.load_mmap_iLUT(filepath)
+
+def test_convert_ilut_file(engines, tmp_path):
+  LUT, delaunay, regular = engines
+  ilut_filepath, mlut_filepath = str(tmp_path / 'band.ilut'), str(tmp_path / 'band.mlut')
+  iLUT.atomic_pickle_dump(delaunay, ilut_filepath)
+  iLUT.convert_ilut_file(ilut_filepath, mlut_filepath)
+  converted = iLUT.load_mmap_iLUT(mlut_filepath)
+  assert np.array_equal(np.asarray(converted.values), regular.values)
+  points = synthetic.inside(200)
+  assert np.array_equal(converted(points), regular(points))
+
+def test_to_regular_grid_needs_complete_grid():
+  LUT = synthetic.LUT()
+  delaunay = iLUT.build_interpolator(LUT, 'delaunay')
+  incomplete = iLUT.LinearNDInterpolator(delaunay.points[1:], delaunay.values[1:])
+  with pytest.raises(ValueError):
+    iLUT.to_regular_grid(incomplete)
@@ -0,0 +1,41 @@
+"""
+Daily post-processing (clip before resampling) against the original
+resample, interpolate then truncate order
+"""
+
+import numpy as np
+import pandas as pd
+from atmcorr.postProcessing import daily, hsv
+
+BANDS = ['blue','green','red','nir','swir1','swir2']
+
+def reference(df, startDate, stopDate):
+  df = df.select_dtypes('number').sort_index(kind='stable')
+  interpolated = df.resample('D').mean().interpolate().ffill().bfill()
+  return hsv(interpolated.truncate(before=startDate, after=stopDate))
+
+def assert_same(df, startDate, stopDate):
+  expected, actual = reference(df, startDate, stopDate), daily(df, startDate, stopDate)
+  assert list(actual.index) == list(expected.index)
+  assert np.allclose(actual.values, expected.values, equal_nan=True, rtol=0, atol=1e-12)
+
+def test_several_scenes_on_neighbouring_days():
+  # two scenes the day before startDate and two the day after stopDate
+  index = pd.to_datetime(['2017-01-05 04:00', '2017-01-09 10:00', '2017-01-09 11:00', '2017-01-15 00:00',\
+                          '2017-01-21 09:00', '2017-01-21 10:00', '2017-02-01 00:00'])
+  values = [0.1, 0.3, 0.68, 0.2, 0.5, 0.1, 0.9]
+  df = pd.DataFrame({band:values for band in BANDS}, index=index)
+  assert_same(df, '2017-01-10', '2017-01-20')
+
+def test_random_series_with_gaps():
+  rng = np.random.RandomState(0)
+  for trial in range(200):
+    n = rng.randint(1, 60)
+    index = pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.randint(0, 90, n), 'D') \
+                                      + pd.to_timedelta(rng.randint(0, 86400, n), 's')
+    values = rng.rand(n, len(BANDS))
+    values[rng.rand(n, len(BANDS)) < 0.3] = np.nan
+    df = pd.DataFrame(values, columns=BANDS, index=index)
+    df['mission'] = 'Sentinel2'
+    start, stop = sorted(pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.randint(0, 90, 2), 'D'))
+    assert_same(df, start.strftime('%Y-%m-%d'), stop.strftime('%Y-%m-%d'))
@@ -0,0 +1,37 @@
+"""
+Prescreening (TimeSeries.prescreen) of request_meanRadiance built against a fake ee
+"""
+
+import json
+import atmcorr.mission_specifics as mission_s
+
+def build(ee, mission, prescreen):
+  from atmcorr.ee_requests import request_meanRadiance
+  geom = ee.Geometry.Point(85.5, 25.7)
+  return request_meanRadiance(geom, '2017-01-01', '2017-03-01', mission, True, prescreen=prescreen).serialize()
+
+def test_cloud_cover_filter(ee):
+  for mission in ['Sentinel2', 'Landsat8']:
+    graph = build(ee, mission, {'max_cloud_cover':40})
+    prop = mission_s.cloudCoverProperty(mission)
+
+    # at most the threshold, or no cloud cover metadata
+    assert '"lte"], ["{}", 40]'.format(prop) in graph
+    assert '"notNull"], [["{}"]]'.format(prop) in graph
+    assert '"cloud_fraction"' not in graph
+
+    # report set on the collection
+    expr = json.loads(graph)
+    assert expr[1][2] == 'set' and expr[2][0] == 'prescreen'
+    report = json.dumps(expr[2][1])
+    assert all(key in report for key in ['"scenes"', '"skipped_cloud_cover"', '"skipped_cloud_fraction"'])
+
+def test_cloud_fraction_filter(ee):
+  graph = build(ee, 'Landsat8', {'max_cloud_fraction':0.9, 'cloud_fraction_scale':500})
+  assert '"lte"], ["cloud_fraction", 0.9]' in graph
+  assert '"CLOUD_COVER"' not in graph
+  assert '"scale": 500' in graph
+
+def test_no_prescreen(ee):
+  graph = build(ee, 'Landsat8', None)
+  assert '"prescreen"' not in graph and '"cloud_fraction"' not in graph
@@ -0,0 +1,99 @@
+"""
+Local per-pixel correction of TOA rasters (raster.py) against (L - a) / b
+"""
+
+import numpy as np
+import pytest
+from atmcorr import raster
+
+MISSION = 'Landsat8'
+PROPERTIES = {'SUN_ELEVATION':55.0, 'system:time_start':1483228800000 + 40 * 86400000}
+
+def toa_tile(filepath, shape=(9, 37, 23), seed=0):
+  toa = np.random.RandomState(seed).uniform(0, 0.5, shape).astype('float32')
+  toa[:, 0, 0] = 0 # missing pixel
+  np.save(filepath, toa)
+  return toa
+
+def expected(toa, a, b):
+  L = toa * raster.radiance_multipliers(MISSION, PROPERTIES).astype('float32')[:, None, None]
+  return (L - np.asarray(a, dtype='float32')[:, None, None]) / np.asarray(b, dtype='float32')[:, None, None]
+
+def test_correct_band_blocks(tmp_path):
+  toa = toa_tile(str(tmp_path / 'toa.npy'))
+  src = raster.open_raster(str(tmp_path / 'toa.npy'))
+  dst = raster.create_raster(str(tmp_path / 'sr.npy'), src.shape, like=src)
+
+  # spatially varying coefficients, blocks of rows
+  field_a = np.linspace(1, 2, toa.shape[1] * toa.shape[2]).reshape(toa.shape[1:])
+  def a(band, r0, r1):
+    return field_a[r0:r1] + band
+  multiplier = raster.radiance_multipliers(MISSION, PROPERTIES)[3]
+  raster.correct_band(src, dst, 3, multiplier, a, 150.0, block_rows=8, nodata=0)
+  dst.close()
+
+  SR = np.load(str(tmp_path / 'sr.npy'))[3]
+  L = toa[3] * np.float32(multiplier)
+  assert np.allclose(SR[1:], ((L - field_a - 3) / 150.0)[1:], rtol=1e-5)
+  assert np.isnan(SR[0, 0])
+
+def test_correct_tiles_npy(tmp_path):
+  tiles = [str(tmp_path / 'toa{}.npy'.format(i)) for i in range(2)]
+  outputs = [str(tmp_path / 'sr{}.npy'.format(i)) for i in range(2)]
+  toas = [toa_tile(tile, seed=i) for i, tile in enumerate(tiles)]
+  a, b = np.arange(1, 10, dtype=float), np.arange(100, 190, 10, dtype=float)
+
+  raster.correct_tiles(tiles, outputs, MISSION, PROPERTIES, coefficients=[(a, b), (2 * a, b)], block_rows=10)
+
+  assert np.allclose(np.load(outputs[0]), expected(toas[0], a, b), rtol=1e-5)
+  assert np.allclose(np.load(outputs[1]), expected(toas[1], 2 * a, b), rtol=1e-5)
+
+def test_correct_tiles_from_atmosphere(tmp_path):
+  import synthetic
+  iLUTs = synthetic.handler(MISSION)
+  toa = toa_tile(str(tmp_path / 'toa.npy'))
+  atmosphere = {'h2o':1.2, 'o3':0.3, 'aot':0.15, 'alt':0.1}
+
+  raster.correct_tiles([str(tmp_path / 'toa.npy')], [str(tmp_path / 'sr.npy')], MISSION, PROPERTIES,\
+                       atmosphere, iLUTs=iLUTs)
+
+  solar_z = 90 - PROPERTIES['SUN_ELEVATION']
+  a, b = raster.scene_coefficients(iLUTs, MISSION, solar_z, 1.2, 0.3, 0.15, 0.1,\
+                                   raster.day_of_year(PROPERTIES['system:time_start']))
+  assert np.allclose(np.load(str(tmp_path / 'sr.npy')), expected(toa, a, b), rtol=1e-5)
+
+def test_wrong_band_count(tmp_path):
+  toa_tile(str(tmp_path / 'toa.npy'), shape=(3, 5, 5))
+  with pytest.raises(ValueError):
+    raster.correct_tiles([str(tmp_path / 'toa.npy')], [str(tmp_path / 'sr.npy')], MISSION, PROPERTIES,\
+                         coefficients=[(np.zeros(9), np.ones(9))])
+
+def test_correct_tiles_npy_to_tif(tmp_path):
+  rasterio = pytest.importorskip('rasterio')
+  toa = toa_tile(str(tmp_path / 'toa.npy'))
+  a, b = np.arange(1, 10, dtype=float), np.arange(100, 190, 10, dtype=float)
+
+  # .npy sources have no profile to copy
+  raster.correct_tiles([str(tmp_path / 'toa.npy')], [str(tmp_path / 'sr.tif')], MISSION, PROPERTIES,\
+                       coefficients=[(a, b)])
+
+  with rasterio.open(str(tmp_path / 'sr.tif')) as f:
+    assert (f.count, f.height, f.width) == toa.shape
+    assert np.allclose(f.read(), expected(toa, a, b), rtol=1e-5)
+
+def test_correct_tiles_tif_keeps_georeferencing(tmp_path):
+  rasterio = pytest.importorskip('rasterio')
+  from rasterio.transform import from_origin
+  toa = toa_tile(str(tmp_path / 'toa.npy'))
+  profile = {'driver':'GTiff', 'count':toa.shape[0], 'height':toa.shape[1], 'width':toa.shape[2],\
+             'dtype':'float32', 'crs':'EPSG:32645', 'transform':from_origin(500000, 2850000, 30, 30)}
+  with rasterio.open(str(tmp_path / 'toa.tif'), 'w', **profile) as f:
+    f.write(toa)
+  a, b = np.arange(1, 10, dtype=float), np.arange(100, 190, 10, dtype=float)
+
+  raster.correct_tiles([str(tmp_path / 'toa.tif')], [str(tmp_path / 'sr.tif')], MISSION, PROPERTIES,\
+                       coefficients=[(a, b)], block_rows=16)
+
+  with rasterio.open(str(tmp_path / 'sr.tif')) as f:
+    assert f.crs.to_epsg() == 32645 and f.transform == profile['transform']
+    assert np.allclose(f.read(), expected(toa, a, b), rtol=1e-5)
@@ -0,0 +1,19 @@
+"""
+Reduction options of request_meanRadiance built against a fake ee
+"""
+
+def build(ee, reduce_options):
+  from atmcorr.ee_requests import request_meanRadiance
+  geom = ee.Geometry.Point(85.5, 25.7)
+  return request_meanRadiance(geom, '2017-01-01', '2017-03-01', 'Landsat8', True,\
+                              reduce_options=reduce_options).serialize()
+
+def test_mean_only_with_disabled_statistics(ee):
+  for options in [{'stdDev':False, 'scale':30}, {'percentiles':None}, {'quality':False, 'tileScale':4}]:
+    graph = build(ee, options)
+    assert '"count"' not in graph and '"stdDev"' not in graph
+
+def test_quality_statistics(ee):
+  graph = build(ee, {'stdDev':True, 'percentiles':[10, 90], 'scale':30})
+  assert '"count"' in graph and '"stdDev"' in graph and '"percentile"' in graph
+  assert '"clear_fraction"' in graph
@@ -0,0 +1,91 @@
+"""
+test_registry.py
+
+iLUT.registry hit/miss counters, LRU eviction, invalidation and concurrent loads
+"""
+
+import time
+import threading
+import pytest
+import atmcorr.interpolated_lookup_tables as iLUT
+import synthetic
+
+@pytest.fixture
+def registry(monkeypatch):
+  monkeypatch.setattr(iLUT.registry, 'handlers', iLUT.OrderedDict())
+  monkeypatch.setattr(iLUT.registry, 'loading', {})
+  monkeypatch.setattr(iLUT.registry, 'hits', 0)
+  monkeypatch.setattr(iLUT.registry, 'misses', 0)
+  monkeypatch.setattr(iLUT.registry, 'max_bytes', None)
+  return iLUT.registry
+
+def iLUT_dir(tmp_path, name, mission='Landsat8'):
+  path = tmp_path / name
+  path.mkdir()
+  return synthetic.write_iLUTs(path, mission)
+
+def test_stats_hits_and_misses(registry, tmp_path):
+  path = iLUT_dir(tmp_path, 'a')
+  first = registry.get('Landsat8', path=path, engine='regular')
+  second = registry.get('Landsat8', path=path, engine='regular')
+  assert first is second
+  stats = registry.stats()
+  assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+  assert stats['hit_rate'] == 0.5
+  assert stats['nbytes'] == registry.nbytes(first) > 0
+
+def test_lru_eviction_under_max_bytes(registry, tmp_path):
+  paths = [iLUT_dir(tmp_path, name) for name in 'abc']
+  a = registry.get('Landsat8', path=paths[0], engine='regular')
+  registry.max_bytes = 2 * registry.nbytes(a)
+  b = registry.get('Landsat8', path=paths[1], engine='regular')
+  registry.get('Landsat8', path=paths[0], engine='regular') # a is now most recent
+  c = registry.get('Landsat8', path=paths[2], engine='regular')
+  assert list(registry.handlers.values()) == [a, c]
+  assert registry.stats()['nbytes'] <= registry.max_bytes
+  assert b not in registry.handlers.values()
+
+def test_invalidate(registry, tmp_path):
+  landsat8 = registry.get('Landsat8', path=iLUT_dir(tmp_path, 'l8'), engine='regular')
+  landsat7 = registry.get('Landsat7', path=iLUT_dir(tmp_path, 'l7', 'Landsat7'), engine='regular')
+  registry.invalidate('Landsat8')
+  assert list(registry.handlers.values()) == [landsat7]
+  assert registry.get('Landsat8', path=landsat8.userDefinedPath, engine='regular') is not landsat8
+  assert registry.stats()['misses'] == 3
+  registry.invalidate()
+  assert registry.stats()['entries'] == 0
+
+def test_concurrent_get_loads_once(registry, tmp_path, monkeypatch):
+  path = iLUT_dir(tmp_path, 'a')
+  loads = []
+  load = iLUT.handler.get
+
+  def slow_load(self):
+    loads.append(self)
+    time.sleep(0.2)
+    load(self)
+
+  monkeypatch.setattr(iLUT.handler, 'get', slow_load)
+  results = [None] * 8
+
+  def get(i):
+    results[i] = registry.get('Landsat8', path=path, engine='regular')
+
+  threads = [threading.Thread(target=get, args=(i,)) for i in range(len(results))]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert len(loads) == 1
+  assert all(result is loads[0] for result in results)
+  assert (registry.hits, registry.misses) == (7, 1)
+
+def test_failed_load_is_not_cached(registry, tmp_path):
+  empty = tmp_path / 'empty'
+  empty.mkdir()
+  registry.get('Landsat8', path=str(empty), engine='regular')
+  assert registry.stats()['entries'] == 0
+  synthetic.write_iLUTs(empty)
+  assert registry.get('Landsat8', path=str(empty), engine='regular').iLUTs
+  assert registry.stats()['entries'] == 1
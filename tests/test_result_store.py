@@ -0,0 +1,52 @@
+"""
+test_result_store.py
+
+Parquet ResultStore with sites of different columns
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from atmcorr.result_store import ResultStore, to_timestamp
+
+pytest.importorskip('pyarrow')
+
+def series(startDate, n, **columns):
+  timeStamps = [to_timestamp(startDate) + i * 86400 for i in range(n)]
+  return dict({'timeStamp':timeStamps, 'mission':['Landsat8'] * n, 'blue':list(np.linspace(0.1, 0.2, n))}, **columns)
+
+@pytest.fixture
+def store(tmp_path):
+  store = ResultStore(str(tmp_path))
+  store.save('beach', series('2017-01-01', 2, clear_fraction=[None, None])) # all null
+  store.save('forest', series('2017-01-01', 4))
+  store.save('lake', series('2017-01-01', 3, pixel_count=[10, 20, 30], clear_fraction=[0.5, None, 1.0]))
+  return store
+
+def test_site_specific_columns(store):
+  lake = store.load('lake')
+  assert list(lake['pixel_count']) == [10, 20, 30]
+  assert np.allclose(lake['clear_fraction'], [0.5, np.nan, 1.0], equal_nan=True)
+  assert set(lake['site']) == {'lake'}
+  assert 'pixel_count' not in store.load('forest')
+  assert store.load('beach')['clear_fraction'].isna().all()
+
+def test_all_sites_union_of_columns(store):
+  df = store.load()
+  assert sorted(df.columns) == sorted(['timeStamp', 'mission', 'blue', 'pixel_count', 'clear_fraction', 'site'])
+  assert list(df.groupby('site').size()) == [2, 4, 3]
+  assert df.loc[df['site'] != 'lake', 'pixel_count'].isna().all()
+  assert np.allclose(df.loc[df['site'] == 'lake', 'clear_fraction'], [0.5, np.nan, 1.0], equal_nan=True)
+  assert list(df.loc[df['site'] == 'lake', 'pixel_count']) == [10, 20, 30]
+
+def test_date_range_and_columns(store):
+  df = store.load(['lake', 'forest'], startDate='2017-01-02', stopDate='2017-01-03', columns=['timeStamp', 'site'])
+  assert sorted(df['site']) == ['forest', 'lake']
+  assert (df['timeStamp'] == to_timestamp('2017-01-02')).all()
+
+def test_arrow_dtypes(store):
+  df = store.load('forest', arrow_dtypes=True)
+  assert isinstance(df['blue'].dtype, pd.ArrowDtype)
+
+def test_missing_site(store):
+  assert store.load('desert').empty
@@ -0,0 +1,50 @@
+"""
+test_retrieval.py
+
+fetch_chunk retries and iter_meanRadiance against stub clients
+"""
+
+import pytest
+from atmcorr import retrieval
+
+class Flaky:
+  """
+  client that fails a number of times (per chunk) and then succeeds
+  """
+
+  def __init__(self, failures):
+    self.failures = failures
+    self.calls = []
+
+  def __call__(self, geom, startDate, stopDate, mission, removeClouds):
+    self.calls.append((startDate, stopDate))
+    if self.calls.count((startDate, stopDate)) <= self.failures:
+      raise IOError('computation timed out')
+    return {'features':[{'id':startDate}]}
+
+def test_retries_until_success():
+  client = Flaky(2)
+  features = retrieval.fetch_chunk(None, ('2017-01-01', '2018-01-01'), 'Landsat8', retries=3, backoff=0, client=client)
+  assert features == [{'id':'2017-01-01'}]
+  assert len(client.calls) == 3
+
+def test_gives_up_after_retries():
+  client = Flaky(10)
+  with pytest.raises(RuntimeError, match='failed after 3 attempts'):
+    retrieval.fetch_chunk(None, ('2017-01-01', '2018-01-01'), 'Landsat8', retries=2, backoff=0, client=client)
+  assert len(client.calls) == 3
+
+def test_exponential_backoff(monkeypatch):
+  waits = []
+  monkeypatch.setattr(retrieval.time, 'sleep', waits.append)
+  retrieval.fetch_chunk(None, ('2017-01-01', '2018-01-01'), 'Landsat8', retries=3, backoff=2, client=Flaky(3))
+  assert waits == [2, 4, 8]
+
+def test_iter_meanRadiance_in_date_order(monkeypatch):
+  monkeypatch.setattr(retrieval.time, 'sleep', lambda seconds: None)
+  client = Flaky(1)
+  chunks = list(retrieval.iter_meanRadiance(None, '2010-01-01', '2015-01-01', 'Landsat8',\
+                                            chunk_days=365, max_workers=3, client=client))
+  assert [chunk for chunk, features in chunks] == retrieval.date_chunks('2010-01-01', '2015-01-01', 365)
+  assert [features for chunk, features in chunks] == [[{'id':chunk[0]}] for chunk, _ in chunks]
+  assert len(client.calls) == 2 * len(chunks)
@@ -0,0 +1,59 @@
+"""
+Multi-site requests (request_meanRadiance_sites) built against a fake ee
+"""
+
+import numpy as np
+
+def test_sites_collection_inputs(ee):
+  from atmcorr.ee_requests import sites_collection
+
+  a, b = ee.Geometry.Point(85.5, 25.7), ee.Geometry.Point(-3.2, 55.9)
+  fromDict = sites_collection({'a':a, 'b':b}).serialize()
+  fromList = sites_collection([('a', a), ('b', b)]).serialize()
+  assert fromDict == fromList
+  assert '"site_id": "a"' in fromDict and '"site_id": "b"' in fromDict
+
+  # anything else (e.g. an ee.FeatureCollection) is used as is
+  collection = ee.FeatureCollection('users/someone/sites')
+  assert sites_collection(collection) is collection
+
+def test_one_reduction_per_image(ee):
+  from atmcorr.ee_requests import request_meanRadiance_sites
+
+  sites = {'site{}'.format(i):ee.Geometry.Point(85 + i, 25) for i in range(5)}
+  graph = request_meanRadiance_sites(sites, '2017-01-01', '2017-03-01', 'Sentinel2', True).serialize()
+
+  assert graph.count('"reduceRegions"') == 1
+  for site_id in sites:
+    assert '"site_id": "{}"'.format(site_id) in graph
+
+def test_split_and_correct_sites(ee):
+  from atmcorr.atmcorr_timeseries import split_sites, surface_reflectance_timeseries, elliptical_orbit_correction
+  import atmcorr.mission_specifics as mission_s
+
+  mission = 'Landsat8'
+  bands = mission_s.ee_bandnames(mission)
+
+  class iLUTs:
+    py6S_sensor = mission_s.py6S_sensor(mission)
+    iLUTs = {band:(lambda *args: (0.01, 0.5)) for band in mission_s.py6s_bandnames(mission)}
+
+  def feature(site_id, t):
+    return {'properties':{
+      'site_id':site_id,
+      'imageID':'{}_{}'.format(site_id, t),
+      'timeStamp':t,
+      'mean_averages':{band:0.2 for band in bands},
+      'atmcorr_inputs':{'solar_z':30, 'h2o':1, 'o3':0.3, 'aot':0.1, 'alt':0.1, 'doy':1}
+    }}
+
+  meanRadiance = {'features':[feature('a', 1), feature('b', 1), feature('a', 2)]}
+  sites = split_sites(meanRadiance)
+
+  assert sorted(sites) == ['a', 'b']
+  assert len(sites['a']['features']) == 2
+
+  timeSeries = surface_reflectance_timeseries(sites['a'], iLUTs, mission)
+  assert timeSeries['imageID'] == ['a_1', 'a_2']
+  orbit_correction = elliptical_orbit_correction(1)
+  assert np.allclose(timeSeries[bands[0]], (0.2 - 0.01 * orbit_correction) / (0.5 * orbit_correction))
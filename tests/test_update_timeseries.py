@@ -0,0 +1,60 @@
+"""
+test_update_timeseries.py
+
+Incremental updates of a stored time series (overlapping frames)
+"""
+
+import pytest
+import synthetic
+from atmcorr.result_store import ResultStore, to_timestamp
+
+MISSIONS = ['Landsat8', 'Landsat7']
+DAY = 86400
+
+class Client:
+  """
+  stub Earth Engine client, one scene every 8 days (same imageIDs for all missions)
+  """
+
+  def __init__(self):
+    self.calls = []
+
+  def __call__(self, geom, startDate, stopDate, mission, removeClouds):
+    self.calls.append((mission, startDate, stopDate))
+    start, stop = to_timestamp(startDate), to_timestamp(stopDate)
+    timeStamps = [t for t in range(start - start % (8 * DAY), stop, 8 * DAY) if t >= start]
+    return {'features':synthetic.features(timeStamps, mission)}
+
+@pytest.fixture
+def timeSeries(ee, monkeypatch):
+  import atmcorr.interpolated_lookup_tables as iLUT
+  from atmcorr.timeSeries import timeSeries
+
+  handlers = {mission:synthetic.handler(mission) for mission in MISSIONS}
+  monkeypatch.setattr(iLUT.registry, 'get', lambda mission, engine='delaunay': handlers[mission])
+  return timeSeries
+
+def test_overlapping_update(timeSeries, tmp_path):
+  store = ResultStore(str(tmp_path))
+  old = timeSeries('site', None, '2017-01-01', '2017-02-01', MISSIONS, store=store, client=Client(), as_frame=True)
+  stored = store.load('site').drop(columns=['site'])
+
+  client = Client()
+  new = timeSeries('site', None, '2017-01-01', '2017-03-01', MISSIONS, store=store, client=client,\
+                   as_frame=True, incremental=True)
+
+  # requests start at the latest stored scene (i.e. the frames overlap)
+  latest = old['timeStamp'].max()
+  assert [call[1] for call in client.calls] == ['2017-01-26', '2017-01-26']
+  assert latest == to_timestamp('2017-01-26')
+
+  # scenes are unique per mission (imageIDs repeat across missions)
+  assert not new.duplicated(subset=['mission', 'imageID']).any()
+  assert new.duplicated(subset=['imageID']).any()
+  expected = Client()(None, '2017-01-01', '2017-03-01', 'Landsat8', True)['features']
+  for mission in MISSIONS:
+    assert (new['mission'] == mission).sum() == len(expected)
+
+  # stored scenes are kept as they were
+  assert new.iloc[:len(stored)].equals(stored)
+  assert store.load('site').drop(columns=['site']).shape == new.shape